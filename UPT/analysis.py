@@ -1,5 +1,8 @@
+import hashlib
 import json
+import threading
 import traceback
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from abc import ABC, abstractmethod
 from connection_settings import (
@@ -8,25 +11,212 @@ from connection_settings import (
     CLAUDE_MODEL,
     GEMINI_API_KEY,
     GEMINI_MODEL,
-    PROMPT_TEMPLATE
+    PROMPT_TEMPLATE,
+    ANALYSIS_SETTINGS,
+    SQL_POLLING_CONFIG
 )
 from log import log
+from checkpoint_manager import get_checkpoint_manager
+from metrics import get_metrics
+from llm_driver import get_llm_driver
 import os
 
 
+# Herramienta cuya entrada es el JSON estructurado (Claude, uso forzado)
+HERRAMIENTA_ESTRUCTURADA = "registrar_analisis"
+
+
+def _datos_de_texto(text):
+    """JSON extraído de una respuesta de texto (None si no hay JSON válido)"""
+    datos = extraer_json_de_texto(text) if text else None
+    if datos is not None and "raw_response" in datos:
+        datos = None
+    return datos
+
+
+def _tokens_cache(leidos=0, escritos=0):
+    """Tokens de entrada servidos desde la caché de prompts / escritos en ella"""
+    return {'cache_read': int(leidos), 'cache_write': int(escritos)}
+
+
+def _peticion_claude(model, prompt, max_tokens, schema=None, cached_prefix=None):
+    """
+    Argumentos de messages.create (con schema, uso forzado de una herramienta)
+    
+    cached_prefix va como system con cache_control: las llamadas siguientes
+    con el mismo prefijo lo leen de la caché del proveedor
+    """
+    peticion = {
+        "model": model,
+        "max_tokens": max_tokens,
+        "messages": [
+            {"role": "user", "content": prompt}
+        ]
+    }
+    if cached_prefix:
+        peticion["system"] = [{
+            "type": "text",
+            "text": cached_prefix,
+            "cache_control": {"type": "ephemeral"}
+        }]
+    if schema is not None:
+        # La entrada de la herramienta es el JSON
+        peticion["tools"] = [{
+            "name": HERRAMIENTA_ESTRUCTURADA,
+            "description": "Registra el resultado del análisis de la llamada",
+            "input_schema": schema
+        }]
+        peticion["tool_choice"] = {"type": "tool", "name": HERRAMIENTA_ESTRUCTURADA}
+    return peticion
+
+
+def _respuesta_claude(response, estructurada=False):
+    """
+    Returns:
+        tuple: (texto, o datos si es estructurada, tokens_in, tokens_out, tokens_cache)
+               tokens_in incluye los tokens leídos y escritos en caché
+    """
+    if not estructurada:
+        resultado = response.content[0].text.strip()
+    else:
+        resultado = next(
+            (bloque.input for bloque in response.content if bloque.type == "tool_use"),
+            None
+        )
+    
+    # Obtener tokens usados (input_tokens no incluye los de caché)
+    usage = response.usage
+    tokens_cache = _tokens_cache(
+        getattr(usage, "cache_read_input_tokens", 0) or 0,
+        getattr(usage, "cache_creation_input_tokens", 0) or 0
+    )
+    tokens_in = usage.input_tokens + tokens_cache['cache_read'] + tokens_cache['cache_write']
+    tokens_out = usage.output_tokens
+    
+    modo = " (estructurado)" if estructurada else ""
+    log(
+        f"Claude tokens{modo} - IN: {tokens_in}, OUT: {tokens_out}, "
+        f"CACHÉ: {tokens_cache['cache_read']} leídos / {tokens_cache['cache_write']} escritos"
+    )
+    
+    return resultado, tokens_in, tokens_out, tokens_cache
+
+
+def _config_gemini(max_tokens, schema=None):
+    """generation_config de Gemini (con schema, salida JSON restringida por response_schema)"""
+    generation_config = {
+        "max_output_tokens": max_tokens,
+        "temperature": 0.7,
+    }
+    if schema is not None:
+        generation_config["response_mime_type"] = "application/json"
+        generation_config["response_schema"] = schema
+    return generation_config
+
+
+def _respuesta_gemini(response, prompt, estructurada=False):
+    """
+    Returns:
+        tuple: (texto, o datos si es estructurada, tokens_in, tokens_out, tokens_cache)
+    """
+    text = response.text.strip()
+    
+    # Obtener tokens usados (Gemini proporciona esta info)
+    try:
+        tokens_in = response.usage_metadata.prompt_token_count
+        tokens_out = response.usage_metadata.candidates_token_count
+    except:
+        # Si no está disponible, estimamos
+        tokens_in = len(prompt.split()) * 1.3  # Estimación
+        tokens_out = len(text.split()) * 1.3
+    
+    # Caché implícita: prefijos repetidos se cobran como tokens en caché
+    try:
+        tokens_cache = _tokens_cache(response.usage_metadata.cached_content_token_count or 0)
+    except AttributeError:
+        tokens_cache = _tokens_cache()
+    
+    modo = " (estructurado)" if estructurada else ""
+    log(
+        f"Gemini tokens{modo} - IN: {int(tokens_in)}, OUT: {int(tokens_out)}, "
+        f"CACHÉ: {tokens_cache['cache_read']} leídos"
+    )
+    
+    # Los tokens ya se consumieron: se devuelven aunque la respuesta no se pueda parsear
+    resultado = text
+    if estructurada:
+        try:
+            resultado = json.loads(text)
+        except ValueError as e:
+            log(f"Respuesta estructurada de Gemini no es JSON válido: {e}")
+            resultado = None
+    
+    return resultado, int(tokens_in), int(tokens_out), tokens_cache
+
+
 class AIProvider(ABC):
     """Clase abstracta para proveedores de IA"""
     
+    # True si el proveedor tiene API de lotes (ver batch_analysis)
+    supports_batch = False
+    
     @abstractmethod
-    def generate_response(self, prompt: str, max_tokens: int = 4000) -> tuple:
+    def generate_response(self, prompt: str, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
         """
         Genera una respuesta del modelo de IA
         
+        Args:
+            cached_prefix: Instrucciones estáticas que preceden a prompt; el
+                proveedor las guarda en su caché de prompts si la soporta
+        
         Returns:
-            tuple: (response_text: str, tokens_in: int, tokens_out: int)
+            tuple: (response_text: str, tokens_in: int, tokens_out: int, tokens_cache: dict)
+                   tokens_cache: {'cache_read', 'cache_write'} (incluidos en tokens_in)
         """
         pass
     
+    def generate_structured(self, prompt: str, schema: dict, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
+        """
+        Genera una respuesta que sigue un JSON Schema
+        
+        Por defecto pide texto y extrae el JSON; los proveedores que lo
+        soportan restringen la salida al esquema.
+        
+        Returns:
+            tuple: (datos: dict o None si no hubo respuesta válida, tokens_in: int, tokens_out: int, tokens_cache: dict)
+        """
+        text, tokens_in, tokens_out, tokens_cache = self.generate_response(
+            prompt, max_tokens=max_tokens, cached_prefix=cached_prefix
+        )
+        return _datos_de_texto(text), tokens_in, tokens_out, tokens_cache
+    
+    def submit_batch(self, requests: list) -> str:
+        """
+        Envía un lote de peticiones a la API de lotes del proveedor
+        
+        Args:
+            requests: Lista de dicts con custom_id, prompt, max_tokens,
+                schema (o None) y cached_prefix (o None)
+        
+        Returns:
+            str: ID del lote
+        """
+        raise NotImplementedError(f"{self.get_provider_name()} no tiene API de lotes")
+    
+    def batch_ended(self, batch_id: str) -> bool:
+        """True si el lote terminó (con éxito, errores o expirado)"""
+        raise NotImplementedError(f"{self.get_provider_name()} no tiene API de lotes")
+    
+    def batch_results(self, batch_id: str):
+        """
+        Resultados de un lote terminado
+        
+        Yields:
+            tuple: (custom_id, (respuesta: str, o datos si la petición llevaba schema,
+                    tokens_in, tokens_out, tokens_cache) o None si falló o expiró)
+        """
+        raise NotImplementedError(f"{self.get_provider_name()} no tiene API de lotes")
+    
     @abstractmethod
     def get_provider_name(self) -> str:
         """Retorna el nombre del proveedor"""
@@ -36,35 +226,74 @@ class AIProvider(ABC):
 class ClaudeProvider(AIProvider):
     """Implementación para Claude (Anthropic)"""
     
+    supports_batch = True
+    
     def __init__(self):
         import anthropic
         self.client = anthropic.Anthropic(api_key=CLAUDE_API_KEY)
         self.model = CLAUDE_MODEL
+        self._batch_client = None
     
-    def generate_response(self, prompt: str, max_tokens: int = 4000) -> tuple:
+    def generate_response(self, prompt: str, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
         try:
-            response = self.client.messages.create(
-                model=self.model,
-                max_tokens=max_tokens,
-                messages=[
-                    {"role": "user", "content": prompt}
-                ]
-            )
+            response = self.client.messages.create(**_peticion_claude(self.model, prompt, max_tokens, cached_prefix=cached_prefix))
+            return _respuesta_claude(response)
             
-            text = response.content[0].text.strip()
-            
-            # Obtener tokens usados
-            tokens_in = response.usage.input_tokens
-            tokens_out = response.usage.output_tokens
-            
-            log(f"Claude tokens - IN: {tokens_in}, OUT: {tokens_out}")
-            
-            return text, tokens_in, tokens_out
+        except Exception as e:
+            log(f"Error al llamar a Claude: {e}")
+            traceback.print_exc()
+            return "", 0, 0, _tokens_cache()
+    
+    def generate_structured(self, prompt: str, schema: dict, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
+        try:
+            response = self.client.messages.create(**_peticion_claude(self.model, prompt, max_tokens, schema, cached_prefix))
+            return _respuesta_claude(response, estructurada=True)
             
         except Exception as e:
             log(f"Error al llamar a Claude: {e}")
             traceback.print_exc()
-            return "", 0, 0
+            return None, 0, 0, _tokens_cache()
+    
+    def _cliente_lotes(self):
+        """Cliente de Message Batches (batch_mode.base_url permite un servidor local de pruebas)"""
+        if self._batch_client is None:
+            base_url = ANALYSIS_SETTINGS.get("batch_mode", {}).get("base_url")
+            if base_url:
+                import anthropic
+                self._batch_client = anthropic.Anthropic(api_key=CLAUDE_API_KEY, base_url=base_url)
+            else:
+                self._batch_client = self.client
+        return self._batch_client
+    
+    def submit_batch(self, requests: list) -> str:
+        batch = self._cliente_lotes().messages.batches.create(requests=[
+            {
+                "custom_id": request["custom_id"],
+                "params": _peticion_claude(
+                    self.model,
+                    request["prompt"],
+                    request["max_tokens"],
+                    request.get("schema"),
+                    request.get("cached_prefix")
+                )
+            }
+            for request in requests
+        ])
+        return batch.id
+    
+    def batch_ended(self, batch_id: str) -> bool:
+        return self._cliente_lotes().messages.batches.retrieve(batch_id).processing_status == "ended"
+    
+    def batch_results(self, batch_id: str):
+        for item in self._cliente_lotes().messages.batches.results(batch_id):
+            if item.result.type != "succeeded":
+                log(f"Petición {item.custom_id} del lote {batch_id} sin respuesta: {item.result.type}")
+                yield item.custom_id, None
+                continue
+            # Las peticiones con schema responden con el bloque tool_use forzado
+            message = item.result.message
+            estructurada = any(bloque.type == "tool_use" for bloque in message.content)
+            yield item.custom_id, _respuesta_claude(message, estructurada)
     
     def get_provider_name(self) -> str:
         return "Claude"
@@ -78,36 +307,151 @@ class GeminiProvider(AIProvider):
         genai.configure(api_key=GEMINI_API_KEY)
         self.model = genai.GenerativeModel(GEMINI_MODEL)
     
-    def generate_response(self, prompt: str, max_tokens: int = 4000) -> tuple:
+    def generate_response(self, prompt: str, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
         try:
-            generation_config = {
-                "max_output_tokens": max_tokens,
-                "temperature": 0.7,
-            }
             response = self.model.generate_content(
-                prompt,
-                generation_config=generation_config
+                (cached_prefix or "") + prompt,
+                generation_config=_config_gemini(max_tokens)
             )
+            return _respuesta_gemini(response, (cached_prefix or "") + prompt)
             
-            text = response.text.strip()
+        except Exception as e:
+            log(f"Error al llamar a Gemini: {e}")
+            traceback.print_exc()
+            return "", 0, 0, _tokens_cache()
+    
+    def generate_structured(self, prompt: str, schema: dict, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
+        try:
+            response = self.model.generate_content(
+                (cached_prefix or "") + prompt,
+                generation_config=_config_gemini(max_tokens, schema)
+            )
+            return _respuesta_gemini(response, (cached_prefix or "") + prompt, estructurada=True)
             
-            # Obtener tokens usados (Gemini proporciona esta info)
-            try:
-                tokens_in = response.usage_metadata.prompt_token_count
-                tokens_out = response.usage_metadata.candidates_token_count
-            except:
-                # Si no está disponible, estimamos
-                tokens_in = len(prompt.split()) * 1.3  # Estimación
-                tokens_out = len(text.split()) * 1.3
+        except Exception as e:
+            log(f"Error al llamar a Gemini: {e}")
+            traceback.print_exc()
+            return None, 0, 0, _tokens_cache()
+    
+    def get_provider_name(self) -> str:
+        return "Gemini"
+
+
+class AsyncAIProvider(ABC):
+    """
+    Variante asíncrona de AIProvider
+    Se usa desde el bucle de llm_driver.AsyncLLMDriver: un solo hilo mantiene
+    muchas peticiones en vuelo sobre un pool de conexiones compartido.
+    """
+    
+    @abstractmethod
+    async def generate_response(self, prompt: str, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
+        """
+        Returns:
+            tuple: (response_text: str, tokens_in: int, tokens_out: int, tokens_cache: dict)
+        """
+        pass
+    
+    async def generate_structured(self, prompt: str, schema: dict, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
+        """
+        Returns:
+            tuple: (datos: dict o None si no hubo respuesta válida, tokens_in: int, tokens_out: int, tokens_cache: dict)
+        """
+        text, tokens_in, tokens_out, tokens_cache = await self.generate_response(
+            prompt, max_tokens=max_tokens, cached_prefix=cached_prefix
+        )
+        return _datos_de_texto(text), tokens_in, tokens_out, tokens_cache
+    
+    async def close(self):
+        """Libera las conexiones del pool"""
+        pass
+    
+    @abstractmethod
+    def get_provider_name(self) -> str:
+        """Retorna el nombre del proveedor"""
+        pass
+
+
+class AsyncClaudeProvider(AsyncAIProvider):
+    """Claude con AsyncAnthropic sobre un pool httpx compartido"""
+    
+    def __init__(self, max_connections=32):
+        import anthropic
+        import httpx
+        self._http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections
+            ),
+            timeout=httpx.Timeout(600.0, connect=10.0)
+        )
+        self.client = anthropic.AsyncAnthropic(api_key=CLAUDE_API_KEY, http_client=self._http_client)
+        self.model = CLAUDE_MODEL
+    
+    async def generate_response(self, prompt: str, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
+        try:
+            response = await self.client.messages.create(**_peticion_claude(self.model, prompt, max_tokens, cached_prefix=cached_prefix))
+            return _respuesta_claude(response)
+            
+        except Exception as e:
+            log(f"Error al llamar a Claude: {e}")
+            traceback.print_exc()
+            return "", 0, 0, _tokens_cache()
+    
+    async def generate_structured(self, prompt: str, schema: dict, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
+        try:
+            response = await self.client.messages.create(**_peticion_claude(self.model, prompt, max_tokens, schema, cached_prefix))
+            return _respuesta_claude(response, estructurada=True)
             
-            log(f"Gemini tokens - IN: {int(tokens_in)}, OUT: {int(tokens_out)}")
+        except Exception as e:
+            log(f"Error al llamar a Claude: {e}")
+            traceback.print_exc()
+            return None, 0, 0, _tokens_cache()
+    
+    async def close(self):
+        await self._http_client.aclose()
+    
+    def get_provider_name(self) -> str:
+        return "Claude"
+
+
+class AsyncGeminiProvider(AsyncAIProvider):
+    """
+    Gemini con generate_content_async
+    El SDK gestiona su propio canal gRPC y no expone el tamaño del pool: la
+    concurrencia la limita max_in_flight del driver.
+    """
+    
+    def __init__(self):
+        import google.generativeai as genai
+        genai.configure(api_key=GEMINI_API_KEY)
+        self.model = genai.GenerativeModel(GEMINI_MODEL)
+    
+    async def generate_response(self, prompt: str, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
+        try:
+            response = await self.model.generate_content_async(
+                (cached_prefix or "") + prompt,
+                generation_config=_config_gemini(max_tokens)
+            )
+            return _respuesta_gemini(response, (cached_prefix or "") + prompt)
             
-            return text, int(tokens_in), int(tokens_out)
+        except Exception as e:
+            log(f"Error al llamar a Gemini: {e}")
+            traceback.print_exc()
+            return "", 0, 0, _tokens_cache()
+    
+    async def generate_structured(self, prompt: str, schema: dict, max_tokens: int = 4000, cached_prefix: str = None) -> tuple:
+        try:
+            response = await self.model.generate_content_async(
+                (cached_prefix or "") + prompt,
+                generation_config=_config_gemini(max_tokens, schema)
+            )
+            return _respuesta_gemini(response, (cached_prefix or "") + prompt, estructurada=True)
             
         except Exception as e:
             log(f"Error al llamar a Gemini: {e}")
             traceback.print_exc()
-            return "", 0, 0
+            return None, 0, 0, _tokens_cache()
     
     def get_provider_name(self) -> str:
         return "Gemini"
@@ -123,8 +467,41 @@ def get_ai_provider() -> AIProvider:
         raise ValueError(f"Proveedor de IA no soportado: {AI_PROVIDER}")
 
 
+def get_async_ai_provider(max_connections=32) -> AsyncAIProvider:
+    """
+    Factory del proveedor asíncrono (se crea dentro del bucle del driver)
+    
+    Args:
+        max_connections: Tamaño del pool HTTP (solo Claude)
+    """
+    if AI_PROVIDER == "claude":
+        return AsyncClaudeProvider(max_connections=max_connections)
+    elif AI_PROVIDER == "gemini":
+        return AsyncGeminiProvider()
+    else:
+        raise ValueError(f"Proveedor de IA no soportado: {AI_PROVIDER}")
+
+
 # Instancia global del proveedor
 ai_provider = get_ai_provider()
+metrics = get_metrics()
+
+# Origen del JSON de separación cuando no hace falta pedirla al proveedor de IA
+SEPARACION_POR_CANALES = "canales_estereo"
+
+# Separación y evaluación en una sola llamada con salida estructurada
+COMBINED_MODE = bool(ANALYSIS_SETTINGS.get("combined_mode", False))
+# Separación y evaluación lanzadas a la vez (no dependen una de otra)
+PARALLEL_CALLS = bool(ANALYSIS_SETTINGS.get("parallel_calls", False))
+# Instrucciones estáticas enviadas como prefijo cacheable (caché de prompts del proveedor)
+# Desactivado por defecto: con la rúbrica incluida los prefijos no llegan al mínimo cacheable
+PROMPT_CACHING = bool(ANALYSIS_SETTINGS.get("prompt_caching", False))
+
+# Pool compartido por todos los workers de análisis para las llamadas concurrentes
+# (un hilo por worker de análisis, con parallel_workers como tope)
+_llm_executor = None
+_llm_executor_lock = threading.Lock()
+
 log(f"Proveedor de IA inicializado: {ai_provider.get_provider_name()}")
 
 
@@ -152,42 +529,388 @@ def extraer_json_de_texto(texto: str) -> dict:
     return {"raw_response": texto}
 
 
-def analizar_transcripcion(call_text, archivo_original):
+def ruta_separacion(archivo_original):
+    """Ruta del JSON de separación Agente/Cliente que acompaña al audio"""
+    base, _ = os.path.splitext(archivo_original)
+    return f"{base};transcripcion.json"
+
+
+def cargar_separacion_por_canales(archivo_original):
     """
-    Analiza la transcripción usando el proveedor de IA configurado
+    Separación Agente/Cliente obtenida al transcribir por canales estéreo
     
     Returns:
-        dict: Evaluación con información de tokens usados
+        dict: {"transcription": [...]} o None si el audio no se transcribió por canales
+    """
+    ruta = ruta_separacion(archivo_original)
+    if not os.path.exists(ruta):
+        return None
+    
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            datos = json.load(f)
+    except Exception as e:
+        log(f"Error leyendo {ruta}: {e}")
+        return None
+    
+    if datos.get("metadata", {}).get("separacion") != SEPARACION_POR_CANALES:
+        return None
+    return {"transcription": datos.get("transcription", [])}
+
+
+def _criterios_de_plantilla():
+    """Claves de 'criterios' del JSON de ejemplo de PROMPT_TEMPLATE (lista vacía si no hay)"""
+    ejemplo = extraer_json_de_texto(PROMPT_TEMPLATE.replace("{call_text}", ""))
+    criterios = ejemplo.get("criterios")
+    return list(criterios) if isinstance(criterios, dict) else []
+
+
+def _esquema_combinado():
+    """
+    JSON Schema de la respuesta combinada: turnos Agente/Cliente y la
+    evaluación con los criterios de la rúbrica configurada
+    """
+    criterio = {
+        "type": "object",
+        "properties": {
+            "comentario": {"type": "string"},
+            "puntuacion": {"type": "number"}
+        },
+        "required": ["comentario", "puntuacion"]
+    }
+    criterios = _criterios_de_plantilla()
+    return {
+        "type": "object",
+        "properties": {
+            "transcription": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "type": {"type": "string", "description": "Agente o Cliente"},
+                        "message": {"type": "string"}
+                    },
+                    "required": ["type", "message"]
+                }
+            },
+            "criterios": {
+                "type": "object",
+                "properties": {nombre: criterio for nombre in criterios},
+                "required": criterios
+            },
+            "puntuacion_final": {"type": "number"},
+            "puntuacion_transcripcion": {"type": "number"},
+            "recomendacion": {"type": "string"}
+        },
+        "required": ["transcription", "criterios", "puntuacion_final", "puntuacion_transcripcion", "recomendacion"]
+    }
+
+
+def _dividir_plantilla(plantilla):
     """
+    Separa la plantilla en un prefijo estático (rúbrica y formato de salida)
+    y el párrafo final con la transcripción
     
-    total_tokens_in = 0
-    total_tokens_out = 0
+    Si {call_text} no está al final, en la rúbrica se sustituye por una
+    referencia y la transcripción se añade detrás: todo lo anterior queda
+    idéntico entre llamadas y el proveedor lo puede servir desde su caché.
+    
+    Returns:
+        tuple: (prefijo: str, parte_variable: str con {call_text})
+    """
+    cuerpo = plantilla.rstrip()
+    if cuerpo.endswith("{call_text}"):
+        antes = cuerpo[:-len("{call_text}")]
+        corte = antes.rfind("\n\n")
+        if corte < 0:
+            return "", cuerpo
+        return antes[:corte + 2], antes[corte + 2:] + "{call_text}"
     
-    # Paso 1: Separación Agente/Cliente
-    prompt_transcripcion = f"""
+    prefijo = plantilla.replace("{call_text}", "(se incluye al final del mensaje)")
+    return prefijo.rstrip() + "\n\n", "Transcripción de la llamada:\n{call_text}"
+
+
+PREFIJO_EVALUACION, VARIABLE_EVALUACION = _dividir_plantilla(PROMPT_TEMPLATE)
+
+PREFIJO_SEPARACION = """
 Transcribe y separa la conversación dada en bloques hablados por el Agente o el Cliente.
 Devuelve el resultado exclusivamente en formato JSON con esta estructura exacta:
 
-{{
+{
   "transcription": [
-    {{"type": "Agente", "message": "Texto del agente"}},
-    {{"type": "Cliente", "message": "Texto del cliente"}}
+    {"type": "Agente", "message": "Texto del agente"},
+    {"type": "Cliente", "message": "Texto del cliente"}
   ]
-}}
+}
+
+"""
+
+INSTRUCCION_COMBINADA = """
+
+Además de la evaluación, separa la conversación en bloques hablados por el Agente o el Cliente
+y devuélvelos en el campo "transcription" como una lista de {"type": "Agente" o "Cliente", "message": "texto"},
+en el orden de la llamada.
+
+"""
+
+ESQUEMA_COMBINADO = _esquema_combinado()
+PREFIJO_COMBINADO = PREFIJO_EVALUACION.rstrip() + INSTRUCCION_COMBINADA
+
+# Sin criterios en la plantilla el esquema exigiría un 'criterios' vacío y la
+# rúbrica se perdería: se evalúa con el prompt de texto libre
+if COMBINED_MODE and not ESQUEMA_COMBINADO["properties"]["criterios"]["required"]:
+    log(
+        "⚠ combined_mode desactivado: la plantilla no incluye un JSON de ejemplo con "
+        "'criterios'; separación y evaluación van en llamadas separadas"
+    )
+    COMBINED_MODE = False
+
+# Estimación de tokens sin tokenizador (texto en español)
+_CARACTERES_POR_TOKEN = 4
+
+
+def _minimo_cacheable():
+    """Tokens mínimos del prefijo para que el modelo configurado lo cachee"""
+    if AI_PROVIDER == "claude" and "haiku" in CLAUDE_MODEL.lower():
+        return 2048
+    return 1024
+
+
+def _avisar_cache_inactiva():
+    """Avisa al arrancar si algún prefijo estático no llega al mínimo cacheable"""
+    if not PROMPT_CACHING:
+        return
+    if COMBINED_MODE:
+        # El esquema de la herramienta también forma parte del prefijo
+        prefijos = {"combinado": len(PREFIJO_COMBINADO) + len(json.dumps(ESQUEMA_COMBINADO))}
+    else:
+        prefijos = {"separación": len(PREFIJO_SEPARACION), "evaluación": len(PREFIJO_EVALUACION)}
+    minimo = _minimo_cacheable()
+    modelo = CLAUDE_MODEL if AI_PROVIDER == 'claude' else GEMINI_MODEL
+    for etapa, caracteres in prefijos.items():
+        estimados = caracteres // _CARACTERES_POR_TOKEN
+        if estimados < minimo:
+            log(
+                f"⚠ Caché de prompts inactiva para {etapa}: el prefijo estático tiene ~{estimados} "
+                f"tokens y {modelo} solo cachea desde {minimo}; las llamadas se cobran completas"
+            )
+        else:
+            log(f"Caché de prompts activa para {etapa}: prefijo estático de ~{estimados} tokens (mínimo {minimo})")
+
+
+_avisar_cache_inactiva()
+
+
+def _tokens_llamada(tokens_in, tokens_out, tokens_cache):
+    """Entrada de tokens_used['calls'] para una llamada al proveedor"""
+    return {"input": tokens_in, "output": tokens_out, **tokens_cache}
+
+
+def _tamano_pool_llm():
+    """
+    Hilos del pool de llamadas concurrentes
+    
+    Cada análisis en curso deja como mucho una llamada en segundo plano,
+    así que basta un hilo por worker del AnalysisPoller; parallel_workers
+    limita el total.
+    """
+    workers = max(1, int(SQL_POLLING_CONFIG.get('analysis', {}).get('workers', 1)))
+    tope = max(1, int(ANALYSIS_SETTINGS.get("parallel_workers", workers)))
+    return min(workers, tope)
+
+
+def _en_segundo_plano(funcion, *args):
+    """
+    Ejecuta funcion(*args) en el pool compartido de llamadas al proveedor
+    
+    Las métricas de la tarea se atribuyen al poller del hilo que la lanza.
+    
+    Returns:
+        Future con el resultado de la función
+    """
+    global _llm_executor
+    with _llm_executor_lock:
+        if _llm_executor is None:
+            _llm_executor = ThreadPoolExecutor(
+                max_workers=_tamano_pool_llm(),
+                thread_name_prefix="llm"
+            )
+    
+    poller = metrics.poller_actual()
+    
+    def tarea():
+        with metrics.contexto_poller(poller):
+            return funcion(*args)
+    
+    return _llm_executor.submit(tarea)
+
+
+def huella_llamada(prompt, prefijo=None, esquema=None):
+    """
+    Hash de todo lo que se envía en una llamada (prefijo, prompt con la
+    transcripción y esquema): una respuesta en checkpoint solo vale para la
+    misma huella
+    """
+    contenido = json.dumps([prefijo or "", prompt, esquema], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+
+def checkpoint_vigente(transaction_id, etapa, huella):
+    """
+    Respuesta en checkpoint de la etapa si se generó con la misma huella
+    
+    Un checkpoint de otra huella (p. ej. la transcripción se regeneró tras un
+    reintento) se descarta para no reutilizar una evaluación que ya no corresponde.
+    
+    Returns:
+        dict: Datos del checkpoint o None
+    """
+    checkpoint_manager = get_checkpoint_manager()
+    previo = checkpoint_manager.obtener_etapa(transaction_id, etapa)
+    if not previo:
+        return None
+    if previo.get('huella') != huella:
+        log(f"Checkpoint de {transaction_id} (etapa {etapa}) descartado: la transcripción o el prompt cambiaron")
+        checkpoint_manager.limpiar(transaction_id, [etapa])
+        return None
+    return previo
+
+
+def _generar_con_checkpoint(transaction_id, etapa, prompt, max_tokens=4000, esquema=None, prefijo=None):
+    """
+    Llama al proveedor de IA reutilizando la respuesta en checkpoint si la
+    etapa ya se completó antes de una parada (evita pagar los tokens dos veces)
+    
+    Args:
+        esquema: JSON Schema de la respuesta; con él se usa generate_structured
+                 y el texto devuelto es el JSON serializado
+        prefijo: Instrucciones estáticas que preceden a prompt (cacheables
+                 si analysis_settings.prompt_caching está activo)
+    
+    Returns:
+        tuple: (response_text: str, tokens_in: int, tokens_out: int, tokens_cache: dict)
+    """
+    huella = huella_llamada(prompt, prefijo, esquema)
+    if transaction_id is not None:
+        previo = checkpoint_vigente(transaction_id, etapa, huella)
+        if previo:
+            log(f"↻ Reutilizando respuesta en checkpoint para {transaction_id} (etapa {etapa})")
+            return (
+                previo['texto'], previo['tokens_in'], previo['tokens_out'],
+                previo.get('tokens_cache', _tokens_cache())
+            )
+    
+    if prefijo and not PROMPT_CACHING:
+        prompt, prefijo = prefijo + prompt, None
+    
+    with metrics.medir('llm'):
+        llm_driver = get_llm_driver()
+        if llm_driver is not None:
+            # Cliente asíncrono: la espera no ocupa una conexión propia del hilo
+            respuesta, tokens_in, tokens_out, tokens_cache = llm_driver.generar(
+                prompt, max_tokens=max_tokens, esquema=esquema, cached_prefix=prefijo
+            )
+        elif esquema is None:
+            respuesta, tokens_in, tokens_out, tokens_cache = ai_provider.generate_response(
+                prompt, max_tokens=max_tokens, cached_prefix=prefijo
+            )
+        else:
+            respuesta, tokens_in, tokens_out, tokens_cache = ai_provider.generate_structured(
+                prompt, esquema, max_tokens=max_tokens, cached_prefix=prefijo
+            )
+    
+    texto = registrar_respuesta(
+        transaction_id, etapa, respuesta, tokens_in, tokens_out, tokens_cache,
+        estructurada=esquema is not None, huella=huella
+    )
+    return texto, tokens_in, tokens_out, tokens_cache
+
+
+def registrar_respuesta(transaction_id, etapa, respuesta, tokens_in, tokens_out, tokens_cache,
+                        estructurada=False, huella=None):
+    """
+    Guarda en checkpoint la respuesta de una etapa (también las que llegan
+    de un lote, que analizar_transcripcion reutiliza después)
+    
+    Args:
+        respuesta: Texto, o datos si la llamada fue estructurada
+        huella: huella_llamada de la petición que produjo la respuesta
+    
+    Returns:
+        str: Texto de la respuesta (JSON serializado si es estructurada)
+    """
+    if not estructurada:
+        texto = respuesta
+    else:
+        texto = json.dumps(respuesta, ensure_ascii=False) if respuesta else ""
+    
+    if transaction_id is not None and texto:
+        get_checkpoint_manager().guardar_etapa(
+            transaction_id,
+            etapa,
+            {
+                'texto': texto,
+                'tokens_in': tokens_in,
+                'tokens_out': tokens_out,
+                'tokens_cache': tokens_cache,
+                'huella': huella
+            }
+        )
+    
+    return texto
+
 
-Aquí está la transcripción original para analizar:
+def _llamada_separacion(call_text):
+    """Argumentos de _generar_con_checkpoint para la separación Agente/Cliente"""
+    prompt_transcripcion = f"""Aquí está la transcripción original para analizar:
 {call_text}
 """
+    return {'prompt': prompt_transcripcion, 'max_tokens': 4000, 'prefijo': PREFIJO_SEPARACION}
+
+
+def _llamada_evaluacion(call_text):
+    """Argumentos de _generar_con_checkpoint para la evaluación con la rúbrica"""
+    prompt = VARIABLE_EVALUACION.replace("{call_text}", call_text)
+    return {'prompt': prompt, 'max_tokens': 4000, 'prefijo': PREFIJO_EVALUACION}
+
+
+def _llamada_combinada(call_text):
+    """Argumentos de _generar_con_checkpoint para separación y evaluación en una llamada"""
+    prompt = VARIABLE_EVALUACION.replace("{call_text}", call_text)
+    return {'prompt': prompt, 'max_tokens': 8000, 'esquema': ESQUEMA_COMBINADO, 'prefijo': PREFIJO_COMBINADO}
+
+
+def llamadas_de_analisis(call_text, archivo_original):
+    """
+    Llamadas al proveedor que necesita analizar_transcripcion para este audio
+    (el modo lote las envía por adelantado y guarda sus respuestas en checkpoint)
     
+    Returns:
+        dict: {etapa: {'prompt', 'max_tokens', 'prefijo', 'esquema' (opcional)}}
+    """
+    llamadas = {}
+    if cargar_separacion_por_canales(archivo_original) is None:
+        if COMBINED_MODE:
+            return {'combinado': _llamada_combinada(call_text)}
+        llamadas['separacion'] = _llamada_separacion(call_text)
+    llamadas['evaluacion'] = _llamada_evaluacion(call_text)
+    return llamadas
+
+
+def _separar_conversacion(call_text, transaction_id=None):
+    """
+    Pide al proveedor de IA la separación de la conversación en turnos
+    
+    Returns:
+        tuple: (transcripcion_json: dict, tokens_in: int, tokens_out: int, tokens_cache: dict)
+    """
     log(f"Separando conversación con {ai_provider.get_provider_name()}...")
-    texto_transcripcion, tokens_in_1, tokens_out_1 = ai_provider.generate_response(
-        prompt_transcripcion,
-        max_tokens=4000
+    texto_transcripcion, tokens_in, tokens_out, tokens_cache = _generar_con_checkpoint(
+        transaction_id,
+        'separacion',
+        **_llamada_separacion(call_text)
     )
     
-    total_tokens_in += tokens_in_1
-    total_tokens_out += tokens_out_1
-    
     try:
         transcripcion_json = extraer_json_de_texto(texto_transcripcion)
         if "transcription" not in transcripcion_json:
@@ -196,14 +919,47 @@ Aquí está la transcripción original para analizar:
         log(f"Error al parsear la transcripción separada: {e}")
         transcripcion_json = {"transcription": [{"type": "Desconocido", "message": call_text}]}
     
-    # Paso 2: Evaluación de calidad
-    prompt = PROMPT_TEMPLATE.replace("{call_text}", call_text)
+    return transcripcion_json, tokens_in, tokens_out, tokens_cache
+
+
+def _evaluar_calidad(call_text, transaction_id=None):
+    """
+    Evalúa la llamada con la rúbrica de PROMPT_TEMPLATE (la rúbrica va como
+    prefijo estático y la transcripción al final)
     
+    Returns:
+        tuple: (analisis: dict, tokens_in: int, tokens_out: int, tokens_cache: dict)
+    """
     log(f"Evaluando calidad con {ai_provider.get_provider_name()}...")
-    texto, tokens_in_2, tokens_out_2 = ai_provider.generate_response(prompt, max_tokens=4000)
+    texto, tokens_in, tokens_out, tokens_cache = _generar_con_checkpoint(
+        transaction_id,
+        'evaluacion',
+        **_llamada_evaluacion(call_text)
+    )
+    
+    if not texto:
+        log("No se obtuvo respuesta del proveedor de IA")
+        analisis = {"raw_response": "Error: Sin respuesta"}
+    else:
+        analisis = extraer_json_de_texto(texto)
+    
+    return analisis, tokens_in, tokens_out, tokens_cache
+
+
+def _analizar_combinado(call_text, transaction_id=None):
+    """
+    Separación y evaluación en una sola llamada con salida estructurada
+    (la transcripción se envía una vez en lugar de dos)
     
-    total_tokens_in += tokens_in_2
-    total_tokens_out += tokens_out_2
+    Returns:
+        tuple: (transcripcion_json: dict, analisis: dict, tokens_in: int, tokens_out: int, tokens_cache: dict)
+    """
+    log(f"Separando y evaluando en una llamada con {ai_provider.get_provider_name()}...")
+    texto, tokens_in, tokens_out, tokens_cache = _generar_con_checkpoint(
+        transaction_id,
+        'combinado',
+        **_llamada_combinada(call_text)
+    )
     
     if not texto:
         log("No se obtuvo respuesta del proveedor de IA")
@@ -211,6 +967,68 @@ Aquí está la transcripción original para analizar:
     else:
         analisis = extraer_json_de_texto(texto)
     
+    turnos = analisis.pop("transcription", None)
+    if isinstance(turnos, list) and turnos:
+        transcripcion_json = {"transcription": turnos}
+    else:
+        log("La respuesta combinada no contiene turnos Agente/Cliente")
+        transcripcion_json = {"transcription": [{"type": "Desconocido", "message": call_text}]}
+    
+    return transcripcion_json, analisis, tokens_in, tokens_out, tokens_cache
+
+
+def analizar_transcripcion(call_text, archivo_original, transaction_id=None):
+    """
+    Analiza la transcripción usando el proveedor de IA configurado
+    
+    Con analysis_settings.combined_mode la separación Agente/Cliente y la
+    evaluación salen de una sola llamada con salida estructurada; si no,
+    con analysis_settings.parallel_calls ambas llamadas se lanzan a la vez.
+    Si la separación ya viene de los canales estéreo solo se pide la evaluación.
+    
+    Args:
+        call_text: Texto de la transcripción
+        archivo_original: Ruta del audio original
+        transaction_id: ID de la transacción (habilita checkpoints por etapa)
+    
+    Returns:
+        dict: Evaluación con información de tokens usados
+    """
+    
+    # Tokens de cada llamada: {etapa: {'input', 'output', 'cache_read', 'cache_write'}}
+    tokens_por_llamada = {}
+    analisis = None
+    
+    # Paso 1: Separación Agente/Cliente (ya disponible si se transcribió por canales)
+    transcripcion_json = cargar_separacion_por_canales(archivo_original)
+    if transcripcion_json is not None:
+        log("Separación Agente/Cliente tomada de los canales estéreo: se omite la llamada de separación")
+    elif COMBINED_MODE:
+        # Pasos 1 y 2 en una sola llamada
+        transcripcion_json, analisis, *tokens = _analizar_combinado(call_text, transaction_id)
+        tokens_por_llamada['combinado'] = _tokens_llamada(*tokens)
+    elif PARALLEL_CALLS:
+        # Pasos 1 y 2 a la vez: la evaluación en el pool, la separación en este hilo
+        futuro_evaluacion = _en_segundo_plano(_evaluar_calidad, call_text, transaction_id)
+        transcripcion_json, *tokens = _separar_conversacion(call_text, transaction_id)
+        tokens_por_llamada['separacion'] = _tokens_llamada(*tokens)
+        analisis, *tokens = futuro_evaluacion.result()
+        tokens_por_llamada['evaluacion'] = _tokens_llamada(*tokens)
+    else:
+        transcripcion_json, *tokens = _separar_conversacion(call_text, transaction_id)
+        tokens_por_llamada['separacion'] = _tokens_llamada(*tokens)
+    
+    # Paso 2: Evaluación de calidad
+    if analisis is None:
+        analisis, *tokens = _evaluar_calidad(call_text, transaction_id)
+        tokens_por_llamada['evaluacion'] = _tokens_llamada(*tokens)
+    
+    total_tokens_in = sum(tokens["input"] for tokens in tokens_por_llamada.values())
+    total_tokens_out = sum(tokens["output"] for tokens in tokens_por_llamada.values())
+    # Incluidos en total_tokens_in
+    total_cache_read = sum(tokens["cache_read"] for tokens in tokens_por_llamada.values())
+    total_cache_write = sum(tokens["cache_write"] for tokens in tokens_por_llamada.values())
+    
     # Paso 3: Estructura de salida estandarizada
     base, _ = os.path.splitext(archivo_original)
     nombre_base = os.path.basename(base)
@@ -231,7 +1049,10 @@ Aquí está la transcripción original para analizar:
         "tokens_used": {
             "input": total_tokens_in,
             "output": total_tokens_out,
-            "total": total_tokens_in + total_tokens_out
+            "total": total_tokens_in + total_tokens_out,
+            "cache_read": total_cache_read,
+            "cache_write": total_cache_write,
+            "calls": tokens_por_llamada
         }
     }
     
@@ -245,6 +1066,9 @@ Aquí está la transcripción original para analizar:
     except Exception as e:
         log(f"Error guardando {ruta_transcripcion_json}: {e}")
     
-    log(f"Total tokens usados en análisis: IN={total_tokens_in}, OUT={total_tokens_out}")
+    log(
+        f"Total tokens usados en análisis: IN={total_tokens_in}, OUT={total_tokens_out} "
+        f"(caché: {total_cache_read} leídos, {total_cache_write} escritos)"
+    )
     
     return evaluacion_estandar
\ No newline at end of file
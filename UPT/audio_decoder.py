@@ -0,0 +1,204 @@
+"""
+Decodificación de audio
+Los WAV PCM (la mayor parte del tráfico) se leen y remuestrean en proceso,
+sin lanzar ffmpeg; el resto de formatos pasan por ffmpeg. Las grabaciones
+largas se leen a través de un pipe de ffmpeg y se entregan en bloques de
+tamaño fijo, de modo que la memoria por worker no crece con su duración.
+"""
+import os
+import shutil
+import subprocess
+import tempfile
+import wave
+from pydub import AudioSegment
+from log import get_logger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+try:
+    import soxr
+except ImportError:
+    soxr = None
+
+logger = get_logger()
+
+# Bytes de datos sin declarar en la cabecera (fracción del archivo) a partir
+# de los cuales el WAV se considera sin finalizar
+_FRACCION_NO_DECLARADA = 0.1
+
+
+def ffmpeg_disponible():
+    """True si el binario de ffmpeg que usa pydub está accesible"""
+    converter = AudioSegment.converter
+    return bool(converter) and (os.path.isfile(converter) or shutil.which(converter) is not None)
+
+
+def decodificar_en_bloques(ruta, sample_rate=16000, chunk_seconds=30):
+    """
+    Decodifica y remuestrea el audio bloque a bloque
+    
+    Args:
+        ruta: Ruta del archivo original (cualquier formato que lea ffmpeg)
+        sample_rate: Frecuencia de salida
+        chunk_seconds: Duración de cada bloque entregado
+    
+    Yields:
+        bytes: PCM mono de 16 bits (el último bloque puede ser más corto).
+            El estéreo se mezcla a mono: no hay separación por canal
+    
+    Raises:
+        RuntimeError: Si ffmpeg termina con error
+    """
+    comando = [
+        AudioSegment.converter,
+        "-nostdin", "-loglevel", "error",
+        "-i", ruta,
+        "-f", "s16le", "-acodec", "pcm_s16le",
+        "-ac", "1", "-ar", str(sample_rate),
+        "pipe:1"
+    ]
+    bytes_por_bloque = int(chunk_seconds * sample_rate) * 2
+    
+    logger.debug(f"Decodificando en streaming ({chunk_seconds}s por bloque): {ruta}")
+    # stderr a un archivo: un pipe sin leer bloquearía a ffmpeg si se llena
+    with tempfile.TemporaryFile() as salida_errores:
+        proceso = subprocess.Popen(comando, stdout=subprocess.PIPE, stderr=salida_errores)
+        try:
+            while True:
+                bloque = proceso.stdout.read(bytes_por_bloque)
+                if not bloque:
+                    break
+                yield bloque
+            
+            if proceso.wait() != 0:
+                salida_errores.seek(0)
+                errores = salida_errores.read().decode('utf-8', errors='replace').strip()
+                raise RuntimeError(f"ffmpeg terminó con código {proceso.returncode}: {errores}")
+        finally:
+            # Si el consumidor abandona el generador, no dejar el proceso colgado
+            if proceso.poll() is None:
+                proceso.kill()
+                proceso.wait()
+            proceso.stdout.close()
+
+
+def _muestras_a_float(datos, sample_width):
+    """Muestras PCM little-endian a float32 en la escala de 16 bits"""
+    if sample_width == 1:
+        # WAV de 8 bits: sin signo, centrado en 128
+        return (np.frombuffer(datos, dtype=np.uint8).astype(np.float32) - 128) * 256
+    if sample_width == 2:
+        return np.frombuffer(datos, dtype='<i2').astype(np.float32)
+    if sample_width == 3:
+        bytes_muestra = np.frombuffer(datos, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        muestras = bytes_muestra[:, 0] | (bytes_muestra[:, 1] << 8) | (bytes_muestra[:, 2] << 16)
+        muestras = np.where(muestras & 0x800000, muestras - 0x1000000, muestras)
+        return muestras.astype(np.float32) / 256
+    if sample_width == 4:
+        return np.frombuffer(datos, dtype='<i4').astype(np.float32) / 65536
+    return None
+
+
+def _interpolar_entero(muestras, factor):
+    """Interpolación lineal para un aumento entero de frecuencia (8 kHz → 16 kHz)"""
+    diferencias = np.append(np.diff(muestras), np.float32(0))
+    salida = np.empty(len(muestras) * factor, dtype=np.float32)
+    for paso in range(factor):
+        salida[paso::factor] = muestras + diferencias * (paso / factor)
+    return salida
+
+
+def remuestrear(muestras, origen, destino):
+    """
+    Cambia la frecuencia de muestreo de un canal
+    
+    Usa soxr si está instalado. Si no, solo admite factores enteros de
+    subida (interpolación lineal); el resto pasa por ffmpeg (ver
+    remuestreo_rapido).
+    
+    Args:
+        muestras: Array float32 de un canal
+        origen: Frecuencia de entrada
+        destino: Frecuencia de salida
+    
+    Returns:
+        Array float32 remuestreado
+    
+    Raises:
+        ValueError: Sin soxr y con un factor que no es entero de subida
+    """
+    if origen == destino or len(muestras) == 0:
+        return muestras
+    if soxr is not None:
+        return soxr.resample(muestras, origen, destino)
+    if destino % origen:
+        raise ValueError(f"remuestreo {origen} → {destino} Hz requiere soxr o ffmpeg")
+    return _interpolar_entero(muestras, destino // origen)
+
+
+def remuestreo_rapido(origen, destino):
+    """True si el remuestreo en proceso es más rápido que pasar por ffmpeg"""
+    return soxr is not None or destino % origen == 0
+
+
+def decodificar_wav(ruta, sample_rate=16000, separar_canales=False):
+    """
+    Decodifica un WAV PCM en proceso, sin ffmpeg
+    
+    Sin soxr solo se decodifican en proceso los WAV cuya frecuencia divide
+    a sample_rate (8 kHz de la centralita, 16 kHz); bajar de 44,1 o 48 kHz
+    con el filtro en NumPy es más lento que ffmpeg. Un WAV cuya cabecera no
+    se finalizó (tamaño de 'data' a 0 o muy por debajo del archivo) también
+    pasa por ffmpeg, que lee los datos hasta el final.
+    
+    Args:
+        ruta: Ruta del archivo
+        sample_rate: Frecuencia de salida
+        separar_canales: Con True, un WAV estéreo devuelve cada canal por
+            separado; si no, todo se mezcla a mono
+    
+    Returns:
+        list: PCM de 16 bits por canal ([mono] o [canal_0, canal_1]), o None
+              si el archivo no es un WAV PCM legible (se debe usar ffmpeg)
+    """
+    if np is None:
+        return None
+    
+    try:
+        with wave.open(ruta, 'rb') as wav:
+            num_canales = wav.getnchannels()
+            sample_width = wav.getsampwidth()
+            origen = wav.getframerate()
+            if num_canales < 1 or origen < 1 or not remuestreo_rapido(origen, sample_rate):
+                return None
+            num_frames = wav.getnframes()
+            tamano = os.path.getsize(ruta)
+            no_declarado = tamano - num_frames * num_canales * sample_width
+            if num_frames == 0 or no_declarado > tamano * _FRACCION_NO_DECLARADA:
+                logger.debug(
+                    f"WAV con cabecera sin finalizar ({num_frames} frames declarados): se usa ffmpeg"
+                )
+                return None
+            datos = wav.readframes(num_frames)
+    except (wave.Error, EOFError, OSError) as e:
+        # Comprimido, IEEE float, WAVE_FORMAT_EXTENSIBLE o cabecera dañada
+        logger.debug(f"WAV no decodificable en proceso ({e}): se usa ffmpeg")
+        return None
+    
+    muestras = _muestras_a_float(datos, sample_width)
+    if muestras is None:
+        return None
+    
+    muestras = muestras[:len(muestras) // num_canales * num_canales].reshape(-1, num_canales)
+    if separar_canales and num_canales == 2:
+        canales = [np.ascontiguousarray(muestras[:, 0]), np.ascontiguousarray(muestras[:, 1])]
+    else:
+        canales = [muestras.mean(axis=1) if num_canales > 1 else muestras[:, 0]]
+    
+    return [
+        np.clip(np.round(remuestrear(canal, origen, sample_rate)), -32768, 32767).astype('<i2').tobytes()
+        for canal in canales
+    ]
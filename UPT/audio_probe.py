@@ -0,0 +1,355 @@
+"""
+Sondeo de audio por cabecera
+Lee duración, frecuencia, canales y códec de la cabecera del archivo sin
+decodificarlo (RIFF/WAVE y MP3; el resto se estima por tamaño) y guarda el
+resultado en caché por ruta, tamaño y mtime. Permite descartar archivos
+vacíos, muy cortos o con la cabecera dañada antes de cualquier trabajo caro
+y da al planificador la duración de cada trabajo.
+"""
+import os
+import struct
+import threading
+from collections import OrderedDict
+from log import get_logger
+
+logger = get_logger()
+
+# Bytes por segundo supuestos cuando no se puede leer el header (PBX 8 kHz, 16 bits)
+BYTES_POR_SEGUNDO_ESTIMADO = 16000
+# Bitrate más bajo habitual en grabaciones de voz comprimidas (8 kbps): acota
+# por arriba la duración de un formato desconocido (m4a, ogg, amr...)
+BYTES_POR_SEGUNDO_MINIMO = 1000
+
+# Bytes tras 'data' sin declarar en su tamaño (fracción del archivo) a partir
+# de los cuales la cabecera se considera sin finalizar
+_FRACCION_NO_DECLARADA = 0.1
+
+_CACHE_MAX = 5000
+# Bytes examinados buscando la primera trama MP3 tras las etiquetas ID3
+_BUSQUEDA_MP3 = 64 * 1024
+
+# Códecs de los códigos de formato WAVE más habituales en centralitas
+_CODECS_WAV = {
+    0x0003: "pcm_f32le",
+    0x0006: "pcm_alaw",
+    0x0007: "pcm_mulaw",
+    0x0011: "adpcm_ima_wav",
+    0x0031: "gsm_ms",
+    0x0055: "mp3",
+}
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# MP3 (Layer III): kbps por índice y versión, frecuencias por versión
+_BITRATES_MP3 = {
+    1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+_FRECUENCIAS_MP3 = {
+    0b11: (44100, 48000, 32000),  # MPEG-1
+    0b10: (22050, 24000, 16000),  # MPEG-2
+    0b00: (11025, 12000, 8000),   # MPEG-2.5
+}
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+_stats = {'hits': 0, 'misses': 0}
+
+
+class CabeceraInvalida(Exception):
+    """El archivo se identifica como WAV/MP3 pero su cabecera no es coherente"""
+    pass
+
+
+def _codec_wav(fmt):
+    """Nombre del códec a partir del chunk 'fmt '"""
+    codigo, _, _, _, _, bits = struct.unpack("<HHIIHH", fmt[:16])
+    if codigo == _WAVE_FORMAT_EXTENSIBLE and len(fmt) >= 26:
+        # El subformato GUID empieza por el código de formato real
+        codigo = struct.unpack("<H", fmt[24:26])[0]
+    if codigo == _WAVE_FORMAT_PCM:
+        return "pcm_u8" if bits == 8 else f"pcm_s{bits}le"
+    return _CODECS_WAV.get(codigo, f"wav_0x{codigo:04x}")
+
+
+def _sondear_wav(f, size):
+    """
+    Recorre los chunks de un RIFF/WAVE hasta 'data'
+    Funciona con cualquier códec WAV (PCM, mu-law, a-law, ...); en los
+    comprimidos (ADPCM, GSM) la duración sale del chunk 'fact', porque su
+    byte rate suele ser nominal. Si la cabecera no se finalizó (tamaño de
+    'data' a 0, 0xFFFFFFFF o muy por debajo del archivo) la duración sale de
+    los bytes hasta el final del archivo y se marca como estimada.
+    
+    Returns:
+        dict: duration, sample_rate, channels, codec (y estimated=True si
+              el tamaño de 'data' no es fiable)
+    
+    Raises:
+        CabeceraInvalida: Falta 'fmt ' o 'data', o sus valores no son válidos
+    """
+    fmt = None
+    num_muestras = None
+    while True:
+        chunk = f.read(8)
+        if len(chunk) < 8:
+            raise CabeceraInvalida("no se encontró el chunk 'data'")
+        chunk_id, chunk_size = struct.unpack("<4sI", chunk)
+        
+        if chunk_id == b"fmt ":
+            fmt = f.read(chunk_size)
+            if len(fmt) < 16:
+                raise CabeceraInvalida("chunk 'fmt ' truncado")
+            if chunk_size % 2:
+                f.seek(1, os.SEEK_CUR)
+        elif chunk_id == b"fact" and chunk_size >= 4:
+            num_muestras = struct.unpack("<I", f.read(4))[0]
+            f.seek(chunk_size - 4 + (chunk_size % 2), os.SEEK_CUR)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise CabeceraInvalida("chunk 'data' antes de 'fmt '")
+            _, channels, sample_rate, byte_rate, _, _ = struct.unpack("<HHIIHH", fmt[:16])
+            if not channels or not sample_rate or not byte_rate:
+                raise CabeceraInvalida(
+                    f"formato inválido ({channels} canales, {sample_rate} Hz, {byte_rate} B/s)"
+                )
+            codec = _codec_wav(fmt)
+            restante = size - f.tell()
+            # Grabación sin finalizar: el tamaño queda en 0, en 0xFFFFFFFF o
+            # en lo escrito al abrir el archivo
+            sin_finalizar = (
+                chunk_size in (0, 0xFFFFFFFF)
+                or restante - chunk_size > size * _FRACCION_NO_DECLARADA
+            )
+            if sin_finalizar:
+                datos = restante
+            else:
+                # Archivo truncado: solo cuentan los bytes presentes
+                datos = min(chunk_size, restante)
+            if num_muestras and not codec.startswith("pcm_") and not sin_finalizar:
+                duracion = num_muestras / sample_rate
+            else:
+                duracion = datos / byte_rate
+            leido = {
+                'duration': duracion,
+                'sample_rate': sample_rate,
+                'channels': channels,
+                'codec': codec
+            }
+            if sin_finalizar:
+                leido['estimated'] = True
+            return leido
+        else:
+            f.seek(chunk_size + (chunk_size % 2), os.SEEK_CUR)
+
+
+def _sondear_mp3(f, size, inicio):
+    """
+    Lee la primera trama MP3 (y la cabecera Xing/Info si es VBR)
+    
+    Args:
+        inicio: Offset tras las etiquetas ID3v2
+    
+    Returns:
+        dict: duration, sample_rate, channels, codec (None si no es Layer III)
+    """
+    f.seek(inicio)
+    bloque = f.read(_BUSQUEDA_MP3)
+    posicion = 0
+    while True:
+        posicion = bloque.find(b"\xff", posicion)
+        if posicion < 0 or posicion + 4 > len(bloque):
+            raise CabeceraInvalida("no se encontró ninguna trama MP3")
+        
+        cabecera = struct.unpack(">I", bloque[posicion:posicion + 4])[0]
+        version = (cabecera >> 19) & 0b11
+        layer = (cabecera >> 17) & 0b11
+        indice_bitrate = (cabecera >> 12) & 0xF
+        indice_frecuencia = (cabecera >> 10) & 0b11
+        if ((cabecera >> 21) & 0x7FF) == 0x7FF and version != 0b01 and layer != 0 \
+                and 0 < indice_bitrate < 15 and indice_frecuencia < 3:
+            break
+        posicion += 1
+    
+    if layer != 0b01:
+        # MPEG Layer I/II: poco habitual, se estima por tamaño
+        return None
+    
+    mpeg1 = version == 0b11
+    mono = ((cabecera >> 6) & 0b11) == 0b11
+    sample_rate = _FRECUENCIAS_MP3[version][indice_frecuencia]
+    bitrate = _BITRATES_MP3[1 if mpeg1 else 2][indice_bitrate] * 1000
+    muestras_por_trama = 1152 if mpeg1 else 576
+    
+    # VBR: la cabecera Xing/Info tras la side info indica el número de tramas
+    side_info = (17 if mono else 32) if mpeg1 else (9 if mono else 17)
+    xing = posicion + 4 + side_info
+    duracion = None
+    if bloque[xing:xing + 4] in (b"Xing", b"Info") and len(bloque) >= xing + 12:
+        flags, tramas = struct.unpack(">II", bloque[xing + 4:xing + 12])
+        if flags & 0x1 and tramas:
+            duracion = tramas * muestras_por_trama / sample_rate
+    if duracion is None:
+        duracion = (size - inicio - posicion) * 8 / bitrate
+    
+    return {
+        'duration': duracion,
+        'sample_rate': sample_rate,
+        'channels': 1 if mono else 2,
+        'codec': "mp3"
+    }
+
+
+def _offset_id3(cabecera):
+    """Bytes de etiquetas ID3v2 al inicio del archivo (0 si no hay)"""
+    if len(cabecera) < 10 or cabecera[:3] != b"ID3":
+        return 0
+    # Tamaño "synchsafe": 7 bits útiles por byte
+    tamano = 0
+    for byte in cabecera[6:10]:
+        tamano = (tamano << 7) | (byte & 0x7F)
+    pie = 10 if cabecera[5] & 0x10 else 0
+    return 10 + tamano + pie
+
+
+def _sondear(ruta, size):
+    """Sondeo sin caché (ver probar_audio)"""
+    info = {
+        'duration': size / BYTES_POR_SEGUNDO_ESTIMADO,
+        'sample_rate': None,
+        'channels': None,
+        'codec': None,
+        'size': size,
+        'estimated': True,
+        'valid': size > 0,
+        'error': None if size > 0 else "archivo vacío"
+    }
+    if size == 0:
+        return info
+    
+    try:
+        with open(ruta, "rb") as f:
+            cabecera = f.read(12)
+            if cabecera[:4] == b"RIFF" and cabecera[8:12] == b"WAVE":
+                leido = _sondear_wav(f, size)
+            else:
+                offset = _offset_id3(cabecera)
+                if offset or ruta.lower().endswith(".mp3"):
+                    leido = _sondear_mp3(f, size, offset)
+                else:
+                    leido = None
+    except CabeceraInvalida as e:
+        info['valid'] = False
+        info['error'] = f"cabecera dañada: {e}"
+        return info
+    except (OSError, struct.error) as e:
+        logger.debug(f"No se pudo leer header de {ruta}: {e}")
+        leido = None
+    
+    if leido:
+        info['estimated'] = False
+        info.update(leido)
+    return info
+
+
+def probar_audio(ruta):
+    """
+    Características del audio leyendo solo la cabecera (caché por path+mtime)
+    
+    Si el formato no es WAV ni MP3 la duración se estima por tamaño de archivo.
+    
+    Returns:
+        dict: {
+            'duration': float (segundos),
+            'sample_rate': int o None,
+            'channels': int o None,
+            'codec': str o None (p. ej. 'pcm_s16le', 'pcm_mulaw', 'mp3'),
+            'size': int (bytes),
+            'estimated': bool (duración estimada por tamaño: formato no
+                reconocido o WAV con la cabecera sin finalizar),
+            'valid': bool (False si está vacío o la cabecera está dañada),
+            'error': str o None
+        }
+        None si el archivo no existe
+    """
+    try:
+        stat = os.stat(ruta)
+    except OSError:
+        return None
+    
+    clave = (ruta, stat.st_size, stat.st_mtime)
+    with _cache_lock:
+        if clave in _cache:
+            _cache.move_to_end(clave)
+            _stats['hits'] += 1
+            return dict(_cache[clave])
+        _stats['misses'] += 1
+    
+    info = _sondear(ruta, stat.st_size)
+    
+    with _cache_lock:
+        _cache[clave] = info
+        if len(_cache) > _CACHE_MAX:
+            _cache.popitem(last=False)
+    return dict(info)
+
+
+def motivo_rechazo(info, min_duration_seconds=1.0):
+    """
+    Razón para descartar el audio sin decodificarlo
+    
+    Args:
+        info: Resultado de probar_audio
+        min_duration_seconds: Duración mínima (solo si la duración sale de una
+            cabecera fiable; la estimada se comprueba tras decodificar)
+    
+    Returns:
+        str: Motivo del descarte, o None si el audio se debe procesar
+    """
+    if not info['valid']:
+        return info['error']
+    if not info['estimated'] and info['duration'] < min_duration_seconds:
+        return f"audio muy corto ({info['duration']:.2f}s)"
+    return None
+
+
+def duracion_maxima(info):
+    """
+    Cota superior de la duración para decidir cómo decodificar
+    
+    Si el formato no se reconoció, la estimación por tamaño supone PCM y en
+    audio comprimido se queda corta varias veces; la cota supone el bitrate
+    más bajo habitual (BYTES_POR_SEGUNDO_MINIMO).
+    
+    Returns:
+        float: Segundos
+    """
+    if info['estimated'] and not info['codec']:
+        return info['size'] / BYTES_POR_SEGUNDO_MINIMO
+    return info['duration']
+
+
+def describir(info):
+    """Resumen legible para los logs: códec, frecuencia, canales y duración"""
+    if not info['valid']:
+        return info['error']
+    if info['estimated'] and not info['codec']:
+        return f"formato no reconocido, ~{info['duration']:.1f}s estimados por tamaño"
+    resumen = (
+        f"{info['codec']}, {info['sample_rate']} Hz, "
+        f"{info['channels']} canal(es), {info['duration']:.1f}s"
+    )
+    if info['estimated']:
+        resumen += " estimados (cabecera sin finalizar)"
+    return resumen
+
+
+def get_probe_stats():
+    """
+    Returns:
+        dict: hits, misses y entries de la caché de sondeos
+    """
+    with _cache_lock:
+        stats = dict(_stats)
+        stats['entries'] = len(_cache)
+    return stats
@@ -1,16 +1,35 @@
 from log import get_logger
-from transcripcion import transcribir_audio
-from analysis import analizar_transcripcion
+from transcripcion import transcribir_audio_con_detalle, get_transcription_engine
+from analysis import (
+    analizar_transcripcion,
+    ruta_separacion,
+    SEPARACION_POR_CANALES,
+    llamadas_de_analisis,
+    huella_llamada,
+    checkpoint_vigente,
+    registrar_respuesta,
+    PROMPT_CACHING
+)
+from llm_driver import get_llm_driver
 from sql_connection import guardar_transcripcion, guardar_analisis
 from connection_settings import AI_PROVIDER, PROCESSING_FEATURES
 from token_manager import get_token_manager
+from checkpoint_manager import get_checkpoint_manager
+from metrics import get_metrics
+from transcription_cache import get_transcription_cache
 import json
 import os
 import glob
+import time
 import traceback
 
 logger = get_logger()
 token_manager = get_token_manager()
+checkpoint_manager = get_checkpoint_manager()
+metrics = get_metrics()
+transcription_cache = get_transcription_cache()
+
+ENCODINGS_TRANSCRIPCION = ['utf-8', 'utf-16', 'utf-16-le', 'utf-16-be', 'latin-1', 'cp1252']
 
 
 def _leer_archivo_con_encodings(ruta, encodings_to_try):
@@ -92,7 +111,88 @@ def _crear_archivos_vacios(archivo_original, razon="Audio ininteligible"):
     return ruta_transcripcion, ruta_transcripcion_json
 
 
-def procesar_transcripcion(transaction_id, archivo_original):
+def _transcribir_con_cache(archivo_original):
+    """
+    Transcribe el audio reutilizando la caché por contenido si ya se
+    transcribió antes la misma grabación (reintentos, duplicados)
+    
+    Args:
+        archivo_original: Ruta del archivo de audio
+    
+    Returns:
+        tuple: (texto o None si no hay transcripción válida, detalle de fragmentos)
+    """
+    if transcription_cache is None:
+        return transcribir_audio_con_detalle(archivo_original)
+    
+    # Fuera del try: un motor mal configurado no debe pasar por caché no disponible
+    nombre_motor = get_transcription_engine().get_engine_name()
+    try:
+        # Cada motor y cada configuración ASR producen su propio texto
+        clave = transcription_cache.clave_transcripcion(nombre_motor, archivo_original)
+        en_cache = transcription_cache.buscar(clave)
+    except Exception as e:
+        logger.warning(f"⚠ Caché de transcripciones no disponible: {e}")
+        return transcribir_audio_con_detalle(archivo_original)
+    
+    if en_cache is not None:
+        texto, detalle = en_cache
+        logger.info(
+            f"⚡ Transcripción recuperada de caché sin ASR: "
+            f"{len(texto)} caracteres, {detalle.get('ok', 0)}/{detalle.get('fragments', 0)} fragmentos"
+        )
+        return texto or None, detalle
+    
+    transcripcion, detalle = transcribir_audio_con_detalle(archivo_original)
+    
+    # Con errores de conexión el resultado puede estar incompleto: no se cachea
+    if detalle['errors'] == 0:
+        transcription_cache.guardar(clave, transcripcion, detalle)
+    
+    return transcripcion, detalle
+
+
+def _guardar_separacion_por_canales(archivo_original, turnos):
+    """
+    Guarda la separación Agente/Cliente obtenida de los canales estéreo;
+    el análisis la reutiliza en lugar de pedirla al proveedor de IA
+    
+    Args:
+        archivo_original: Ruta del archivo de audio
+        turnos: Lista de {'type', 'message', 'start', 'end'} en orden cronológico
+    """
+    ruta_json = ruta_separacion(archivo_original)
+    separacion = {
+        "transcription": turnos,
+        "metadata": {
+            "separacion": SEPARACION_POR_CANALES,
+            "audio_procesado": True,
+            "transcripcion_valida": True
+        }
+    }
+    
+    try:
+        with metrics.medir('file_write'):
+            with open(ruta_json, "w", encoding="utf-8") as f:
+                json.dump(separacion, f, ensure_ascii=False, indent=4)
+        logger.info(f"✓ Separación por canales guardada: {ruta_json}")
+    except Exception as e:
+        # WARNING: El análisis pedirá la separación al proveedor de IA
+        logger.warning(f"⚠ WARNING: No se pudo guardar la separación por canales: {e}")
+
+
+def _escritura_cancelada(transaction_id, cancelado):
+    """True si el registro se abandonó al detener y no debe escribir en BD"""
+    if cancelado is None or not cancelado():
+        return False
+    logger.warning(
+        f"⏸ TransactionId {transaction_id} cancelado al detener: se omite la escritura "
+        f"en BD (sus etapas quedan en checkpoint)"
+    )
+    return True
+
+
+def procesar_transcripcion(transaction_id, archivo_original, cancelado=None):
     """
     Procesa solo la transcripción del audio
     MODIFICADO: Maneja audio ininteligible creando archivos vacíos
@@ -100,6 +200,8 @@ def procesar_transcripcion(transaction_id, archivo_original):
     Args:
         transaction_id: ID de la transacción
         archivo_original: Ruta del archivo de audio
+        cancelado: Función sin argumentos que devuelve True si el poller
+            abandonó el registro al detenerse (no se escribe en BD)
     
     Returns:
         tuple: (success: bool, tokens_in: int, tokens_out: int, transcription_path: str)
@@ -124,8 +226,21 @@ def procesar_transcripcion(transaction_id, archivo_original):
             logger.error(f"✗ ERROR CRÍTICO: Límite de tokens excedido - {reason}")
             raise RuntimeError(f"Límite de tokens excedido: {reason}")
         
-        # Realizar transcripción
-        transcripcion = transcribir_audio(archivo_original)
+        # Reanudar desde checkpoint si el ASR ya se completó antes de una parada
+        transcripcion = None
+        detalle = {}
+        checkpoint = checkpoint_manager.obtener_etapa(transaction_id, 'transcripcion')
+        if checkpoint and os.path.exists(checkpoint['ruta']):
+            transcripcion = _leer_archivo_con_encodings(checkpoint['ruta'], ENCODINGS_TRANSCRIPCION)
+            if transcripcion:
+                logger.info(
+                    f"↻ Reanudando {transaction_id} desde checkpoint: "
+                    f"transcripción ya generada en {checkpoint['ruta']}"
+                )
+        
+        # Realizar transcripción (o recuperarla de la caché por contenido)
+        if not transcripcion:
+            transcripcion, detalle = _transcribir_con_cache(archivo_original)
         
         # CAMBIO PRINCIPAL: Si no hay transcripción válida, crear archivos vacíos
         if not transcripcion:
@@ -143,6 +258,9 @@ def procesar_transcripcion(transaction_id, archivo_original):
             estimated_tokens_in = 10
             estimated_tokens_out = 5
             
+            if _escritura_cancelada(transaction_id, cancelado):
+                return False, 0, 0, None
+            
             # Guardar en BD como completado (con transcripción vacía)
             try:
                 nombre_transcripcion = os.path.basename(ruta_transcripcion)
@@ -181,27 +299,47 @@ def procesar_transcripcion(transaction_id, archivo_original):
         ruta_transcripcion = f"{base};transcripcion.txt"
         
         try:
-            with open(ruta_transcripcion, "w", encoding="utf-8") as f:
-                f.write(transcripcion)
+            with metrics.medir('file_write'):
+                with open(ruta_transcripcion, "w", encoding="utf-8") as f:
+                    f.write(transcripcion)
             logger.info(f"✓ Transcripción guardada: {ruta_transcripcion}")
         except Exception as e:
             logger.error(f"✗ ERROR CRÍTICO: No se pudo guardar transcripción: {e}")
             raise
         
+        # Estéreo por canales: la separación Agente/Cliente ya está hecha
+        if detalle.get('turns'):
+            _guardar_separacion_por_canales(archivo_original, detalle['turns'])
+        
+        checkpoint_manager.guardar_etapa(transaction_id, 'transcripcion', {'ruta': ruta_transcripcion})
+        
+        if _escritura_cancelada(transaction_id, cancelado):
+            return False, 0, 0, None
+        
         # Guardar en base de datos usando SetTranscription
         try:
             nombre_transcripcion = os.path.basename(ruta_transcripcion)
-            guardar_transcripcion(
-                transaction_id,
-                ruta_transcripcion,
-                nombre_transcripcion,
-                estimated_tokens_in,
-                estimated_tokens_out
-            )
+            with metrics.medir('db_write'):
+                guardado = guardar_transcripcion(
+                    transaction_id,
+                    ruta_transcripcion,
+                    nombre_transcripcion,
+                    estimated_tokens_in,
+                    estimated_tokens_out
+                )
         except Exception as e:
             logger.error(f"✗ ERROR CRÍTICO: No se pudo guardar en BD: {e}")
             raise
         
+        # Registro completo en BD: el checkpoint ya no hace falta
+        if guardado:
+            checkpoint_manager.limpiar(transaction_id, ['transcripcion'])
+        else:
+            logger.warning(
+                f"⚠ Guardado en BD no confirmado para {transaction_id}: "
+                f"se conserva el checkpoint de la transcripción"
+            )
+        
         # Registrar uso de tokens
         token_manager.log_token_usage(
             estimated_tokens_in,
@@ -270,7 +408,9 @@ def _crear_analisis_vacio(archivo_original, razon="Sin transcripción válida"):
         "tokens_used": {
             "input": 0,
             "output": 0,
-            "total": 0
+            "total": 0,
+            "cache_read": 0,
+            "cache_write": 0
         },
         "metadata": {
             "razon": razon,
@@ -296,7 +436,87 @@ def _crear_analisis_vacio(archivo_original, razon="Sin transcripción válida"):
         raise
 
 
-def procesar_analisis(transaction_id, archivo_original, ruta_transcripcion=None):
+def cargar_transcripcion(archivo_original, ruta_transcripcion=None):
+    """
+    Busca y lee la transcripción de un audio
+    
+    Prueba el path de BD, el path construido normalizando ':' → ';' y por
+    último un glob en el directorio del audio.
+    
+    Args:
+        archivo_original: Ruta del archivo de audio original
+        ruta_transcripcion: Ruta del archivo de transcripción (opcional)
+    
+    Returns:
+        tuple: (transcripcion: str o None si no se encontró, ruta_usada: str o None)
+    """
+    transcripcion = None
+    encodings_to_try = ENCODINGS_TRANSCRIPCION
+    ruta_usada = None
+    
+    # ESTRATEGIA 1: Usar path de BD si existe y es válido
+    if ruta_transcripcion and os.path.exists(ruta_transcripcion):
+        logger.info(f"Usando TranscriptionPath de BD: {ruta_transcripcion}")
+        transcripcion = _leer_archivo_con_encodings(ruta_transcripcion, encodings_to_try)
+        if transcripcion:
+            ruta_usada = ruta_transcripcion
+    
+    # ESTRATEGIA 2: Construir path normalizando : → ; (Windows hace esto)
+    if not transcripcion:
+        base, _ = os.path.splitext(archivo_original)
+        base_normalizado = base.replace(':', ';')
+        ruta_candidata = f"{base_normalizado};transcripcion.txt"
+        
+        if os.path.exists(ruta_candidata):
+            logger.info(f"Archivo encontrado con normalización: {ruta_candidata}")
+            transcripcion = _leer_archivo_con_encodings(ruta_candidata, encodings_to_try)
+            if transcripcion:
+                ruta_usada = ruta_candidata
+    
+    # ESTRATEGIA 3: Buscar con glob pattern en el directorio
+    if not transcripcion:
+        try:
+            directorio = os.path.dirname(base_normalizado if 'base_normalizado' in locals() else archivo_original)
+            patron = os.path.join(directorio, f"*transcripcion.txt")
+            
+            logger.debug(f"Buscando con glob: {patron}")
+            archivos = glob.glob(patron)
+            
+            if archivos:
+                nombre_audio = os.path.basename(archivo_original).replace(':', ';')
+                nombre_base = os.path.splitext(nombre_audio)[0]
+                
+                for archivo in archivos:
+                    if nombre_base in os.path.basename(archivo):
+                        logger.info(f"Archivo encontrado con glob: {archivo}")
+                        transcripcion = _leer_archivo_con_encodings(archivo, encodings_to_try)
+                        if transcripcion:
+                            ruta_usada = archivo
+                            break
+                
+                if not transcripcion and archivos:
+                    logger.debug(f"Usando primer archivo encontrado: {archivos[0]}")
+                    transcripcion = _leer_archivo_con_encodings(archivos[0], encodings_to_try)
+                    if transcripcion:
+                        ruta_usada = archivos[0]
+        except Exception as e:
+            logger.debug(f"Error en búsqueda glob: {e}")
+    
+    if not transcripcion:
+        logger.debug(f"  Audio original: {archivo_original}")
+        logger.debug(f"  Path de BD: {ruta_transcripcion}")
+        if 'ruta_candidata' in locals():
+            logger.debug(f"  Path esperado: {ruta_candidata}")
+    
+    return transcripcion, ruta_usada
+
+
+def transcripcion_vacia(transcripcion):
+    """True si la transcripción es el marcador de audio sin voz válida (o está vacía)"""
+    return "[NO HAY TRANSCRIPCIÓN VÁLIDA]" in transcripcion or not transcripcion.strip()
+
+
+def procesar_analisis(transaction_id, archivo_original, ruta_transcripcion=None, cancelado=None):
     """
     Procesa solo el análisis de la transcripción
     MODIFICADO: Maneja transcripciones vacías creando análisis vacío
@@ -305,6 +525,8 @@ def procesar_analisis(transaction_id, archivo_original, ruta_transcripcion=None)
         transaction_id: ID de la transacción
         archivo_original: Ruta del archivo de audio original
         ruta_transcripcion: Ruta del archivo de transcripción (opcional)
+        cancelado: Función sin argumentos que devuelve True si el poller
+            abandonó el registro al detenerse (no se escribe en BD)
     
     Returns:
         tuple: (success: bool, tokens_in: int, tokens_out: int)
@@ -317,58 +539,7 @@ def procesar_analisis(transaction_id, archivo_original, ruta_transcripcion=None)
         return False, 0, 0
     
     try:
-        # Cargar transcripción con búsqueda robusta
-        transcripcion = None
-        encodings_to_try = ['utf-8', 'utf-16', 'utf-16-le', 'utf-16-be', 'latin-1', 'cp1252']
-        ruta_usada = None
-        
-        # ESTRATEGIA 1: Usar path de BD si existe y es válido
-        if ruta_transcripcion and os.path.exists(ruta_transcripcion):
-            logger.info(f"Usando TranscriptionPath de BD: {ruta_transcripcion}")
-            transcripcion = _leer_archivo_con_encodings(ruta_transcripcion, encodings_to_try)
-            if transcripcion:
-                ruta_usada = ruta_transcripcion
-        
-        # ESTRATEGIA 2: Construir path normalizando : → ; (Windows hace esto)
-        if not transcripcion:
-            base, _ = os.path.splitext(archivo_original)
-            base_normalizado = base.replace(':', ';')
-            ruta_candidata = f"{base_normalizado};transcripcion.txt"
-            
-            if os.path.exists(ruta_candidata):
-                logger.info(f"Archivo encontrado con normalización: {ruta_candidata}")
-                transcripcion = _leer_archivo_con_encodings(ruta_candidata, encodings_to_try)
-                if transcripcion:
-                    ruta_usada = ruta_candidata
-        
-        # ESTRATEGIA 3: Buscar con glob pattern en el directorio
-        if not transcripcion:
-            try:
-                directorio = os.path.dirname(base_normalizado if 'base_normalizado' in locals() else archivo_original)
-                patron = os.path.join(directorio, f"*transcripcion.txt")
-                
-                logger.debug(f"Buscando con glob: {patron}")
-                archivos = glob.glob(patron)
-                
-                if archivos:
-                    nombre_audio = os.path.basename(archivo_original).replace(':', ';')
-                    nombre_base = os.path.splitext(nombre_audio)[0]
-                    
-                    for archivo in archivos:
-                        if nombre_base in os.path.basename(archivo):
-                            logger.info(f"Archivo encontrado con glob: {archivo}")
-                            transcripcion = _leer_archivo_con_encodings(archivo, encodings_to_try)
-                            if transcripcion:
-                                ruta_usada = archivo
-                                break
-                    
-                    if not transcripcion and archivos:
-                        logger.debug(f"Usando primer archivo encontrado: {archivos[0]}")
-                        transcripcion = _leer_archivo_con_encodings(archivos[0], encodings_to_try)
-                        if transcripcion:
-                            ruta_usada = archivos[0]
-            except Exception as e:
-                logger.debug(f"Error en búsqueda glob: {e}")
+        transcripcion, ruta_usada = cargar_transcripcion(archivo_original, ruta_transcripcion)
         
         # WARNING: No se encontró transcripción
         if not transcripcion:
@@ -376,16 +547,12 @@ def procesar_analisis(transaction_id, archivo_original, ruta_transcripcion=None)
                 f"⚠ WARNING: No se encontró transcripción para TransactionId {transaction_id}. "
                 f"Probablemente la transcripción aún no se ha completado."
             )
-            logger.debug(f"  Audio original: {archivo_original}")
-            logger.debug(f"  Path de BD: {ruta_transcripcion}")
-            if 'ruta_candidata' in locals():
-                logger.debug(f"  Path esperado: {ruta_candidata}")
             return False, 0, 0
         
         logger.info(f"✓ Transcripción cargada exitosamente desde: {ruta_usada}")
         
         # CAMBIO PRINCIPAL: Detectar transcripción vacía y crear análisis vacío
-        if "[NO HAY TRANSCRIPCIÓN VÁLIDA]" in transcripcion or not transcripcion.strip():
+        if transcripcion_vacia(transcripcion):
             logger.warning(f"⚠ Transcripción vacía detectada para {transaction_id}")
             
             # Crear análisis vacío
@@ -398,6 +565,9 @@ def procesar_analisis(transaction_id, archivo_original, ruta_transcripcion=None)
             tokens_in = 5
             tokens_out = 5
             
+            if _escritura_cancelada(transaction_id, cancelado):
+                return False, 0, 0
+            
             try:
                 nombre_analisis = os.path.basename(ruta_evaluacion_json)
                 guardar_analisis(
@@ -431,7 +601,7 @@ def procesar_analisis(transaction_id, archivo_original, ruta_transcripcion=None)
             raise RuntimeError(f"Límite de tokens excedido: {reason}")
         
         # Realizar análisis con el proveedor de IA
-        evaluacion = analizar_transcripcion(transcripcion, archivo_original)
+        evaluacion = analizar_transcripcion(transcripcion, archivo_original, transaction_id)
         
         # Obtener tokens reales del análisis
         tokens_in = evaluacion.get('tokens_used', {}).get('input', estimated_tokens_for_analysis // 2)
@@ -443,31 +613,45 @@ def procesar_analisis(transaction_id, archivo_original, ruta_transcripcion=None)
         ruta_evaluacion_json = f"{base};evaluacion.json"
         
         try:
-            with open(ruta_evaluacion_json, "w", encoding="utf-8") as f:
-                json.dump(evaluacion, f, ensure_ascii=False, indent=4)
-            
-            with open(ruta_evaluacion_txt, "w", encoding="utf-8") as f:
-                f.write(json.dumps(evaluacion, ensure_ascii=False, indent=4))
+            with metrics.medir('file_write'):
+                with open(ruta_evaluacion_json, "w", encoding="utf-8") as f:
+                    json.dump(evaluacion, f, ensure_ascii=False, indent=4)
+                
+                with open(ruta_evaluacion_txt, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(evaluacion, ensure_ascii=False, indent=4))
             
             logger.info(f"✓ Análisis guardado: {ruta_evaluacion_json}")
         except Exception as e:
             logger.error(f"✗ ERROR CRÍTICO: No se pudo guardar análisis: {e}")
             raise
         
+        if _escritura_cancelada(transaction_id, cancelado):
+            return False, 0, 0
+        
         # Guardar en base de datos usando SetAnalysis
         try:
             nombre_analisis = os.path.basename(ruta_evaluacion_json)
-            guardar_analisis(
-                transaction_id,
-                ruta_evaluacion_json,
-                nombre_analisis,
-                tokens_in,
-                tokens_out
-            )
+            with metrics.medir('db_write'):
+                guardado = guardar_analisis(
+                    transaction_id,
+                    ruta_evaluacion_json,
+                    nombre_analisis,
+                    tokens_in,
+                    tokens_out
+                )
         except Exception as e:
             logger.error(f"✗ ERROR CRÍTICO: No se pudo guardar análisis en BD: {e}")
             raise
         
+        # Registro completo en BD: los checkpoints de las llamadas al LLM ya no hacen falta
+        if guardado:
+            checkpoint_manager.limpiar(transaction_id, ['separacion', 'evaluacion', 'combinado', 'lote'])
+        else:
+            logger.warning(
+                f"⚠ Guardado en BD no confirmado para {transaction_id}: "
+                f"se conservan los checkpoints del análisis"
+            )
+        
         # Registrar uso de tokens
         token_manager.log_token_usage(tokens_in, tokens_out, "analysis")
         
@@ -484,6 +668,85 @@ def procesar_analisis(transaction_id, archivo_original, ruta_transcripcion=None)
         raise
 
 
+def adelantar_llamadas_analisis(registros):
+    """
+    Envía a la vez al driver asíncrono las llamadas de todos los análisis del
+    ciclo y espera sus respuestas, que quedan en checkpoint; procesar_analisis
+    las reutiliza después sin volver a llamar al proveedor. Así las peticiones
+    en vuelo no quedan limitadas por el número de hilos de análisis.
+    
+    Sin driver (analysis_settings.async_clients deshabilitado), o si el lote
+    de llamadas excedería el límite de tokens, no hace nada: cada registro
+    llama al proveedor al procesarse.
+    
+    Args:
+        registros: Diccionarios con transaction_id, audio_path y transcription_path
+    
+    Returns:
+        int: Llamadas enviadas
+    """
+    llm_driver = get_llm_driver()
+    if llm_driver is None or not registros:
+        return 0
+    
+    llamadas = []
+    tokens_estimados = 0
+    for registro in registros:
+        transaction_id = registro['transaction_id']
+        transcripcion, _ = cargar_transcripcion(registro['audio_path'], registro.get('transcription_path'))
+        if not transcripcion or transcripcion_vacia(transcripcion):
+            continue
+        
+        pendientes = 0
+        for etapa, llamada in llamadas_de_analisis(transcripcion, registro['audio_path']).items():
+            huella = huella_llamada(llamada['prompt'], llamada.get('prefijo'), llamada.get('esquema'))
+            if not checkpoint_vigente(transaction_id, etapa, huella):
+                llamadas.append((transaction_id, etapa, huella, llamada))
+                pendientes += 1
+        if pendientes:
+            tokens_estimados += len(transcripcion.split()) * 2
+    
+    if not llamadas:
+        return 0
+    
+    can_process, reason, _ = token_manager.can_process(estimated_tokens=tokens_estimados)
+    if not can_process:
+        # procesar_analisis registra el error de cada registro
+        logger.warning(f"⚠ Llamadas del ciclo no adelantadas: límite de tokens excedido - {reason}")
+        return 0
+    
+    poller = metrics.poller_actual()
+    futuros = []
+    for transaction_id, etapa, huella, llamada in llamadas:
+        prompt, prefijo = llamada['prompt'], llamada.get('prefijo')
+        if prefijo and not PROMPT_CACHING:
+            prompt, prefijo = prefijo + prompt, None
+        inicio = time.perf_counter()
+        futuro = llm_driver.submit(
+            prompt, max_tokens=llamada['max_tokens'], esquema=llamada.get('esquema'), cached_prefix=prefijo
+        )
+        # Latencia de cada llamada, no la del conjunto
+        futuro.add_done_callback(
+            lambda _, inicio=inicio: metrics.registrar('llm', time.perf_counter() - inicio, poller)
+        )
+        futuros.append((transaction_id, etapa, huella, llamada, futuro))
+    logger.info(f"⚡ {len(futuros)} llamadas de {len(registros)} análisis enviadas al driver asíncrono")
+    
+    for transaction_id, etapa, huella, llamada, futuro in futuros:
+        try:
+            respuesta, tokens_in, tokens_out, tokens_cache = futuro.result()
+        except Exception as e:
+            # Sin checkpoint: la llamada se repite al procesar el registro
+            logger.warning(f"⚠ Llamada adelantada de {transaction_id} (etapa {etapa}) fallida: {e}")
+            continue
+        registrar_respuesta(
+            transaction_id, etapa, respuesta, tokens_in, tokens_out, tokens_cache,
+            estructurada=llamada.get('esquema') is not None, huella=huella
+        )
+    
+    return len(futuros)
+
+
 def procesar_audio_completo(transaction_id, archivo_original):
     """
     Procesa transcripción + análisis (para compatibilidad con código anterior)
@@ -0,0 +1,405 @@
+"""
+Análisis por lotes con la API de lotes del proveedor (Message Batches)
+Con backlog, el AnalysisPoller reúne los análisis pendientes en un lote en
+lugar de hacer dos llamadas interactivas por registro. Al terminar el lote,
+las respuestas se guardan como checkpoints de sus etapas y cada registro
+pasa por procesar_analisis, que las reutiliza sin volver a llamar al
+proveedor y guarda el resultado con guardar_analisis. Las peticiones que
+fallan o expiran simplemente no dejan checkpoint: ese registro hace la
+llamada interactiva al procesarse.
+
+El lote de cada registro se guarda también en BD (sp_set_batch): si el
+registro vuelve a la cola mientras el lote sigue en curso, la instancia
+que lo reclame lo retoma desde ese lote en lugar de pagarlo otra vez.
+"""
+import threading
+import time
+from log import get_logger
+from connection_settings import ANALYSIS_SETTINGS, SQL_POLLING_CONFIG
+from analysis import (
+    ai_provider,
+    llamadas_de_analisis,
+    registrar_respuesta,
+    huella_llamada,
+    checkpoint_vigente,
+    PROMPT_CACHING
+)
+from audio_process import cargar_transcripcion, transcripcion_vacia
+from checkpoint_manager import get_checkpoint_manager
+from token_manager import get_token_manager
+from sql_connection import registrar_lote
+
+logger = get_logger()
+
+# Etapa de checkpoint con el lote al que se envió el registro (para retomarlo tras un reinicio)
+ETAPA_LOTE = 'lote'
+# Caracteres de la huella de la petición incluidos en su custom_id
+_HUELLA_CORTA = 16
+
+
+def _custom_id(transaction_id, etapa, huella):
+    """
+    ID de la petición dentro del lote (la API solo admite [a-zA-Z0-9_-]);
+    lleva el inicio de la huella para validar la respuesta sin el checkpoint local
+    """
+    return f"{transaction_id}-{etapa}-{huella[:_HUELLA_CORTA]}"
+
+
+def _desde_custom_id(custom_id):
+    """
+    Returns:
+        tuple: (transaction_id, etapa, huella corta o None)
+    """
+    partes = custom_id.rsplit("-", 2)
+    if len(partes) < 3:
+        partes.append(None)
+    transaction_id, etapa, huella = partes
+    return int(transaction_id) if transaction_id.isdigit() else transaction_id, etapa, huella
+
+
+def _llamadas_con_huella(registro):
+    """
+    Llamadas de análisis del registro con su huella
+    
+    Returns:
+        tuple: (transcripción, {etapa: llamada con 'huella'}), o (None, None)
+               si no hay transcripción válida
+    """
+    transcripcion, _ = cargar_transcripcion(registro['audio_path'], registro.get('transcription_path'))
+    if not transcripcion or transcripcion_vacia(transcripcion):
+        return None, None
+    return transcripcion, {
+        etapa: dict(llamada, huella=huella_llamada(llamada['prompt'], llamada.get('prefijo'), llamada.get('esquema')))
+        for etapa, llamada in llamadas_de_analisis(transcripcion, registro['audio_path']).items()
+    }
+
+
+class BatchAnalyzer:
+    """Envía análisis en lote, consulta su estado y devuelve los registros terminados"""
+    
+    def __init__(self, provider, min_records=20, max_records=500, poll_interval=60, sp_set_batch=None):
+        """
+        Args:
+            provider: AIProvider con supports_batch
+            min_records: Registros pendientes a partir de los cuales se usa un lote
+            max_records: Máximo de registros por lote
+            poll_interval: Segundos entre consultas del estado de cada lote
+            sp_set_batch: SP que guarda en BD el lote de cada registro (None = solo checkpoint local)
+        """
+        self.provider = provider
+        self.min_records = max(1, int(min_records))
+        self.max_records = max(self.min_records, int(max_records))
+        self.poll_interval = poll_interval
+        self.sp_set_batch = sp_set_batch
+        self._lock = threading.Lock()
+        # Lotes en curso: {batch_id: {'registros': {transaction_id: registro}, 'enviado': epoch, 'consultado': epoch}}
+        self._lotes = {}
+        self.stats = {
+            'batches_submitted': 0,
+            'batches_completed': 0,
+            'requests_submitted': 0,
+            'requests_succeeded': 0,
+            'requests_failed': 0,
+            'records_resumed': 0
+        }
+    
+    def lote_en_bd(self):
+        """True si el lote de cada registro queda registrado en BD"""
+        return bool(self.sp_set_batch)
+    
+    def _registrar_en_bd(self, transaction_id, batch_id):
+        """Guarda (o borra, con batch_id None) el lote del registro en BD"""
+        if not self.sp_set_batch:
+            return
+        if not registrar_lote(self.sp_set_batch, transaction_id, batch_id):
+            logger.warning(
+                f"⚠ SP '{self.sp_set_batch}' no disponible: el lote solo queda en el checkpoint "
+                f"local y otra instancia que reclame el registro lo volvería a enviar"
+            )
+            self.sp_set_batch = None
+    
+    def _retomar(self, batch_id, registro, checkpoint):
+        """
+        Asocia un registro a un lote enviado antes (por esta instancia o
+        antes de un reinicio)
+        """
+        with self._lock:
+            lote = self._lotes.get(batch_id)
+            if lote is None:
+                lote = self._lotes[batch_id] = {
+                    'registros': {},
+                    'enviado': checkpoint.get('enviado', time.time()),
+                    'consultado': 0
+                }
+            if registro['transaction_id'] not in lote['registros']:
+                self.stats['records_resumed'] += 1
+            lote['registros'][registro['transaction_id']] = registro
+        logger.debug(f"↻ TransactionId {registro['transaction_id']} ya está en el lote {batch_id}")
+    
+    def retomar_en_curso(self, registros):
+        """
+        Retoma los registros que ya están en un lote (checkpoint local o
+        BatchId en BD), haya o no backlog para enviar uno nuevo
+        
+        Returns:
+            list: Registros que no están en ningún lote
+        """
+        checkpoint_manager = get_checkpoint_manager()
+        restantes = []
+        for registro in registros:
+            previo = checkpoint_manager.obtener_etapa(registro['transaction_id'], ETAPA_LOTE)
+            if previo:
+                self._retomar(previo['batch_id'], registro, previo)
+            elif registro.get('batch_id'):
+                # Enviado por otra instancia (o antes de perder el checkpoint local)
+                self._retomar(registro['batch_id'], registro, {})
+            else:
+                restantes.append(registro)
+        return restantes
+    
+    def enviar(self, registros):
+        """
+        Envía los registros en un lote
+        
+        Los que ya están en un lote se retoman sin reenviarlos (ver
+        retomar_en_curso). Quedan fuera (vía interactiva) los registros
+        sin transcripción aún, con transcripción vacía o sin llamadas
+        pendientes; si el envío falla o se excedería el límite de tokens, se
+        devuelven todos.
+        
+        Returns:
+            list: Registros que no entraron al lote
+        """
+        checkpoint_manager = get_checkpoint_manager()
+        rechazados = []
+        incluidos = []
+        peticiones = []
+        huellas = {}
+        tokens_estimados = 0
+        
+        for registro in self.retomar_en_curso(registros):
+            transaction_id = registro['transaction_id']
+            transcripcion, llamadas = _llamadas_con_huella(registro)
+            if llamadas is None:
+                rechazados.append(registro)
+                continue
+            
+            # Etapas ya en checkpoint para esta misma transcripción no se vuelven a pedir
+            llamadas = {
+                etapa: llamada for etapa, llamada in llamadas.items()
+                if not checkpoint_vigente(transaction_id, etapa, llamada['huella'])
+            }
+            if not llamadas:
+                rechazados.append(registro)
+                continue
+            huellas[transaction_id] = {etapa: llamada['huella'] for etapa, llamada in llamadas.items()}
+            
+            for etapa, llamada in llamadas.items():
+                prompt, prefijo = llamada['prompt'], llamada.get('prefijo')
+                if prefijo and not PROMPT_CACHING:
+                    prompt, prefijo = prefijo + prompt, None
+                peticiones.append({
+                    'custom_id': _custom_id(transaction_id, etapa, llamada['huella']),
+                    'prompt': prompt,
+                    'max_tokens': llamada['max_tokens'],
+                    'schema': llamada.get('esquema'),
+                    'cached_prefix': prefijo
+                })
+            tokens_estimados += len(transcripcion.split()) * 2
+            incluidos.append(registro)
+        
+        if not incluidos:
+            return rechazados
+        
+        can_process, reason, _ = get_token_manager().can_process(estimated_tokens=tokens_estimados)
+        if not can_process:
+            # La vía interactiva registra el error y programa los reintentos
+            logger.error(f"✗ Lote no enviado: límite de tokens excedido - {reason}")
+            return rechazados + incluidos
+        
+        try:
+            batch_id = self.provider.submit_batch(peticiones)
+        except Exception as e:
+            logger.error(f"✗ Error enviando lote de {len(incluidos)} análisis: {e}. Se usa la vía interactiva")
+            return rechazados + incluidos
+        
+        enviado = time.time()
+        for registro in incluidos:
+            checkpoint_manager.guardar_etapa(
+                registro['transaction_id'],
+                ETAPA_LOTE,
+                {'batch_id': batch_id, 'enviado': enviado, 'huellas': huellas[registro['transaction_id']]}
+            )
+            self._registrar_en_bd(registro['transaction_id'], batch_id)
+        
+        with self._lock:
+            self._lotes[batch_id] = {
+                'registros': {registro['transaction_id']: registro for registro in incluidos},
+                'enviado': enviado,
+                'consultado': enviado
+            }
+            self.stats['batches_submitted'] += 1
+            self.stats['requests_submitted'] += len(peticiones)
+        
+        logger.info(
+            f"📦 Lote {batch_id} enviado: {len(incluidos)} análisis, {len(peticiones)} peticiones "
+            f"({len(rechazados)} por la vía interactiva)"
+        )
+        return rechazados
+    
+    def recoger(self):
+        """
+        Consulta los lotes en curso (cada poll_interval) y guarda en
+        checkpoint las respuestas de los que terminaron
+        
+        Returns:
+            list: Registros listos para procesar_analisis
+        """
+        ahora = time.time()
+        with self._lock:
+            por_consultar = [
+                (batch_id, lote) for batch_id, lote in self._lotes.items()
+                if ahora - lote['consultado'] >= self.poll_interval
+            ]
+            for _, lote in por_consultar:
+                lote['consultado'] = ahora
+        
+        listos = []
+        for batch_id, lote in por_consultar:
+            try:
+                if not self.provider.batch_ended(batch_id):
+                    logger.debug(
+                        f"Lote {batch_id} en curso ({len(lote['registros'])} análisis, "
+                        f"{ahora - lote['enviado']:.0f}s)"
+                    )
+                    continue
+                correctas, fallidas = self._guardar_resultados(batch_id, lote['registros'])
+            except Exception as e:
+                logger.warning(f"⚠ No se pudo consultar el lote {batch_id}: {e}")
+                continue
+            
+            with self._lock:
+                self._lotes.pop(batch_id, None)
+                registros = list(lote['registros'].values())
+                self.stats['batches_completed'] += 1
+                self.stats['requests_succeeded'] += correctas
+                self.stats['requests_failed'] += fallidas
+            
+            checkpoint_manager = get_checkpoint_manager()
+            for registro in registros:
+                checkpoint_manager.limpiar(registro['transaction_id'], [ETAPA_LOTE])
+                self._registrar_en_bd(registro['transaction_id'], None)
+            
+            logger.info(
+                f"✓ Lote {batch_id} terminado en {ahora - lote['enviado']:.0f}s: "
+                f"{correctas} respuestas, {fallidas} sin respuesta (se piden en interactivo)"
+            )
+            listos.extend(registros)
+        
+        return listos
+    
+    def _guardar_resultados(self, batch_id, registros):
+        """
+        Guarda cada respuesta del lote como checkpoint de su etapa
+        
+        Args:
+            registros: {transaction_id: registro} del lote
+        
+        Returns:
+            tuple: (correctas, fallidas)
+        """
+        checkpoint_manager = get_checkpoint_manager()
+        correctas = fallidas = 0
+        for custom_id, resultado in self.provider.batch_results(batch_id):
+            if resultado is None:
+                fallidas += 1
+                continue
+            transaction_id, etapa, huella_corta = _desde_custom_id(custom_id)
+            respuesta, tokens_in, tokens_out, tokens_cache = resultado
+            # Huella de lo que se envió, para que la respuesta no valga si la transcripción cambió
+            lote = checkpoint_manager.obtener_etapa(transaction_id, ETAPA_LOTE) or {}
+            huella = lote.get('huellas', {}).get(etapa)
+            if huella is None and huella_corta and transaction_id in registros:
+                # Lote retomado desde BD: vale si la petición actual es la misma que se envió
+                _, llamadas = _llamadas_con_huella(registros[transaction_id])
+                actual = (llamadas or {}).get(etapa, {}).get('huella')
+                if actual and actual.startswith(huella_corta):
+                    huella = actual
+            texto = registrar_respuesta(
+                transaction_id, etapa, respuesta, tokens_in, tokens_out, tokens_cache,
+                estructurada=not isinstance(respuesta, str),
+                huella=huella
+            )
+            if texto:
+                correctas += 1
+            else:
+                fallidas += 1
+        return correctas, fallidas
+    
+    def olvidar_pendientes(self):
+        """
+        Deja de seguir los lotes en curso (al detener el poller)
+        Sus registros conservan el lote en checkpoint (y en BD con sp_set_batch)
+        y se retoman al reclamarlos de nuevo
+        
+        Returns:
+            list: Registros que estaban en lote
+        """
+        with self._lock:
+            registros = [
+                registro
+                for lote in self._lotes.values()
+                for registro in lote['registros'].values()
+            ]
+            self._lotes.clear()
+        return registros
+    
+    def get_stats(self):
+        """
+        Returns:
+            dict: Contadores de lotes y peticiones, con lotes y registros en curso
+        """
+        with self._lock:
+            stats = self.stats.copy()
+            stats['batches_in_flight'] = len(self._lotes)
+            stats['records_in_flight'] = sum(len(lote['registros']) for lote in self._lotes.values())
+        return stats
+
+
+# Instancia global
+_batch_analyzer = None
+_batch_analyzer_lock = threading.Lock()
+
+
+def get_batch_analyzer():
+    """Obtiene el analizador por lotes (None si batch_mode está deshabilitado o el proveedor no tiene API de lotes)"""
+    global _batch_analyzer
+    with _batch_analyzer_lock:
+        if _batch_analyzer is None:
+            batch_cfg = ANALYSIS_SETTINGS.get('batch_mode', {})
+            if not batch_cfg.get('enabled', False):
+                return None
+            if not ai_provider.supports_batch:
+                logger.warning(
+                    f"⚠ {ai_provider.get_provider_name()} no tiene API de lotes: "
+                    f"batch_mode se ignora y el análisis sigue siendo interactivo"
+                )
+                return None
+            _batch_analyzer = BatchAnalyzer(
+                ai_provider,
+                min_records=batch_cfg.get('min_records', 20),
+                max_records=batch_cfg.get('max_records', 500),
+                poll_interval=batch_cfg.get('poll_interval_seconds', 60),
+                sp_set_batch=SQL_POLLING_CONFIG.get('analysis', {}).get('sp_set_batch')
+            )
+            logger.info(
+                f"✓ Análisis por lotes habilitado ({ai_provider.get_provider_name()}, "
+                f"desde {_batch_analyzer.min_records} pendientes, máx. {_batch_analyzer.max_records} por lote)"
+            )
+    return _batch_analyzer
+
+
+def get_batch_stats():
+    """Estadísticas del analizador por lotes, o None si no se ha creado"""
+    with _batch_analyzer_lock:
+        return _batch_analyzer.get_stats() if _batch_analyzer is not None else None
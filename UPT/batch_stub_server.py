@@ -0,0 +1,218 @@
+"""
+Servidor local que imita la API de Message Batches de Anthropic
+Permite probar el modo lote (analysis_settings.batch_mode) sin coste ni red:
+con base_url apuntando a este servidor, los lotes se aceptan, quedan "en
+curso" durante --delay segundos y devuelven respuestas de ejemplo (JSON con
+la estructura de separación/evaluación, o el tool_use forzado si la petición
+lleva herramientas). Con --fail-ratio una parte de las peticiones termina
+con error, para probar la vuelta a la vía interactiva.
+
+Uso:
+    python batch_stub_server.py --port 8765 --delay 20
+    (config.json: "batch_mode": {"enabled": true, "base_url": "http://127.0.0.1:8765", ...})
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+RUTA_LOTES = "/v1/messages/batches"
+
+# Texto de ejemplo: sirve tanto para la separación como para la evaluación
+TEXTO_EJEMPLO = json.dumps({
+    "transcription": [
+        {"type": "Agente", "message": "Buenos días, ¿en qué puedo ayudarle?"},
+        {"type": "Cliente", "message": "Llamo por una consulta."}
+    ],
+    "criterios": {},
+    "puntuacion_final": 0,
+    "puntuacion_transcripcion": 0,
+    "recomendacion": "Respuesta del servidor de pruebas"
+}, ensure_ascii=False)
+
+_lotes = {}
+_lock = threading.Lock()
+
+
+def _ahora_iso():
+    return datetime.now(timezone.utc).isoformat().replace("+00:00", "Z")
+
+
+def _valor_de_ejemplo(esquema):
+    """Valor mínimo que cumple un JSON Schema (objetos, listas, textos y números)"""
+    tipo = esquema.get("type")
+    if tipo == "object":
+        return {
+            nombre: _valor_de_ejemplo(propiedad)
+            for nombre, propiedad in esquema.get("properties", {}).items()
+        }
+    if tipo == "array":
+        return [_valor_de_ejemplo(esquema.get("items", {}))]
+    if tipo in ("number", "integer"):
+        return 0
+    if tipo == "boolean":
+        return False
+    return "ejemplo"
+
+
+def _respuesta(params, fail_ratio):
+    """Resultado de una petición del lote en el formato de la API"""
+    if random.random() < fail_ratio:
+        return {
+            "type": "errored",
+            "error": {"type": "error", "error": {"type": "api_error", "message": "Fallo simulado"}}
+        }
+    
+    if params.get("tools"):
+        herramienta = params["tools"][0]
+        contenido = [{
+            "type": "tool_use",
+            "id": f"toolu_{uuid.uuid4().hex[:24]}",
+            "name": herramienta["name"],
+            "input": _valor_de_ejemplo(herramienta["input_schema"])
+        }]
+        stop_reason = "tool_use"
+    else:
+        contenido = [{"type": "text", "text": TEXTO_EJEMPLO}]
+        stop_reason = "end_turn"
+    
+    # El prefijo con cache_control cuenta como leído de caché
+    cacheado = sum(
+        len(bloque.get("text", "")) // 4
+        for bloque in params.get("system", [])
+        if isinstance(bloque, dict) and bloque.get("cache_control")
+    )
+    mensajes = json.dumps(params.get("messages", []), ensure_ascii=False)
+    return {
+        "type": "succeeded",
+        "message": {
+            "id": f"msg_{uuid.uuid4().hex[:24]}",
+            "type": "message",
+            "role": "assistant",
+            "model": params.get("model", "stub"),
+            "content": contenido,
+            "stop_reason": stop_reason,
+            "stop_sequence": None,
+            "usage": {
+                "input_tokens": len(mensajes) // 4,
+                "output_tokens": 50,
+                "cache_read_input_tokens": cacheado,
+                "cache_creation_input_tokens": 0
+            }
+        }
+    }
+
+
+class ManejadorLotes(BaseHTTPRequestHandler):
+    """Endpoints create, retrieve y results de Message Batches"""
+    
+    delay = 10
+    fail_ratio = 0.0
+    
+    def _json(self, codigo, cuerpo):
+        datos = json.dumps(cuerpo, ensure_ascii=False).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(datos)))
+        self.end_headers()
+        self.wfile.write(datos)
+    
+    def _lote_publico(self, lote):
+        terminado = time.time() >= lote["termina"]
+        total = len(lote["resultados"])
+        errores = sum(1 for r in lote["resultados"] if r["result"]["type"] != "succeeded")
+        host = self.headers.get("Host", "127.0.0.1")
+        return {
+            "id": lote["id"],
+            "type": "message_batch",
+            "processing_status": "ended" if terminado else "in_progress",
+            "request_counts": {
+                "processing": 0 if terminado else total,
+                "succeeded": total - errores if terminado else 0,
+                "errored": errores if terminado else 0,
+                "canceled": 0,
+                "expired": 0
+            },
+            "created_at": lote["created_at"],
+            "expires_at": lote["created_at"],
+            "ended_at": _ahora_iso() if terminado else None,
+            "cancel_initiated_at": None,
+            "archived_at": None,
+            "results_url": f"http://{host}{RUTA_LOTES}/{lote['id']}/results" if terminado else None
+        }
+    
+    def do_POST(self):
+        if self.path.split("?")[0].rstrip("/") != RUTA_LOTES:
+            return self._json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+        
+        longitud = int(self.headers.get("Content-Length", 0))
+        cuerpo = json.loads(self.rfile.read(longitud) or b"{}")
+        lote = {
+            "id": f"msgbatch_{uuid.uuid4().hex[:24]}",
+            "created_at": _ahora_iso(),
+            "termina": time.time() + self.delay,
+            "resultados": [
+                {"custom_id": peticion["custom_id"], "result": _respuesta(peticion["params"], self.fail_ratio)}
+                for peticion in cuerpo.get("requests", [])
+            ]
+        }
+        with _lock:
+            _lotes[lote["id"]] = lote
+        print(f"Lote {lote['id']} recibido: {len(lote['resultados'])} peticiones")
+        self._json(200, self._lote_publico(lote))
+    
+    def do_GET(self):
+        partes = self.path.split("?")[0].rstrip("/")
+        if not partes.startswith(RUTA_LOTES + "/"):
+            return self._json(404, {"type": "error", "error": {"type": "not_found_error", "message": self.path}})
+        
+        resto = partes[len(RUTA_LOTES) + 1:].split("/")
+        with _lock:
+            lote = _lotes.get(resto[0])
+        if lote is None:
+            return self._json(404, {"type": "error", "error": {"type": "not_found_error", "message": resto[0]}})
+        
+        if len(resto) == 1:
+            return self._json(200, self._lote_publico(lote))
+        
+        if resto[1] == "results" and time.time() >= lote["termina"]:
+            datos = "\n".join(json.dumps(r, ensure_ascii=False) for r in lote["resultados"]).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/binary")
+            self.send_header("Content-Length", str(len(datos)))
+            self.end_headers()
+            self.wfile.write(datos)
+            return
+        
+        self._json(404, {"type": "error", "error": {"type": "not_found_error", "message": "Resultados no disponibles"}})
+    
+    def log_message(self, formato, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor local de pruebas para Message Batches")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--delay", type=float, default=10, help="Segundos que cada lote queda en curso")
+    parser.add_argument("--fail-ratio", type=float, default=0.0, help="Fracción de peticiones que terminan con error")
+    args = parser.parse_args()
+    
+    ManejadorLotes.delay = args.delay
+    ManejadorLotes.fail_ratio = args.fail_ratio
+    servidor = ThreadingHTTPServer((args.host, args.port), ManejadorLotes)
+    print(f"Servidor de lotes en http://{args.host}:{args.port} (delay {args.delay}s, fallos {args.fail_ratio:.0%})")
+    try:
+        servidor.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        servidor.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+Checkpoints por etapa de cada TransactionId
+Guarda en un SQLite local el resultado de las etapas costosas ya completadas
+(ASR, llamadas al LLM) para que, si el proceso se detiene a mitad de un
+registro, el reinicio continúe desde la última etapa y no desde cero.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from log import get_logger
+
+logger = get_logger()
+
+
+class CheckpointManager:
+    """Persiste y recupera etapas completadas por TransactionId"""
+    
+    def __init__(self, db_path, retention_days=7):
+        """
+        Args:
+            db_path: Ruta del archivo SQLite
+            retention_days: Checkpoints más antiguos se purgan al iniciar
+        """
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        
+        directorio = os.path.dirname(db_path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS checkpoints (
+                    transaction_id INTEGER NOT NULL,
+                    etapa TEXT NOT NULL,
+                    datos TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (transaction_id, etapa)
+                )
+                """
+            )
+            purgados = self._conn.execute(
+                "DELETE FROM checkpoints WHERE created_at < ?",
+                (time.time() - retention_days * 86400,)
+            ).rowcount
+        
+        if purgados:
+            logger.info(f"CheckpointManager - {purgados} checkpoints antiguos purgados")
+    
+    def guardar_etapa(self, transaction_id, etapa, datos):
+        """
+        Registra una etapa completada
+        
+        Args:
+            transaction_id: ID de la transacción
+            etapa: Nombre de la etapa (p.ej. 'transcripcion', 'separacion')
+            datos: Dict serializable a JSON con el resultado de la etapa
+        """
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?)",
+                    (transaction_id, etapa, json.dumps(datos, ensure_ascii=False), time.time())
+                )
+            logger.debug(f"Checkpoint guardado - ID:{transaction_id} etapa={etapa}")
+        except Exception as e:
+            # Un checkpoint fallido no debe detener el procesamiento
+            logger.warning(f"⚠ No se pudo guardar checkpoint {etapa} de {transaction_id}: {e}")
+    
+    def obtener_etapa(self, transaction_id, etapa):
+        """
+        Returns:
+            dict: Datos de la etapa o None si no hay checkpoint
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT datos FROM checkpoints WHERE transaction_id = ? AND etapa = ?",
+                (transaction_id, etapa)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def obtener_etapas(self, transaction_id):
+        """
+        Returns:
+            list: Nombres de las etapas completadas del registro
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT etapa FROM checkpoints WHERE transaction_id = ? ORDER BY created_at",
+                (transaction_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+    
+    def limpiar(self, transaction_id, etapas=None):
+        """
+        Elimina checkpoints del registro una vez persistido el resultado final
+        
+        Args:
+            transaction_id: ID de la transacción
+            etapas: Lista de etapas a eliminar (None = todas)
+        """
+        with self._lock, self._conn:
+            if etapas is None:
+                self._conn.execute(
+                    "DELETE FROM checkpoints WHERE transaction_id = ?",
+                    (transaction_id,)
+                )
+            else:
+                self._conn.executemany(
+                    "DELETE FROM checkpoints WHERE transaction_id = ? AND etapa = ?",
+                    [(transaction_id, etapa) for etapa in etapas]
+                )
+
+
+# Instancia global
+_checkpoint_manager = None
+
+
+def get_checkpoint_manager():
+    """Obtiene la instancia del gestor de checkpoints"""
+    global _checkpoint_manager
+    if _checkpoint_manager is None:
+        from connection_settings import BASE_DIR, SQL_POLLING_CONFIG
+        checkpoint_cfg = SQL_POLLING_CONFIG.get('checkpoints', {})
+        db_path = checkpoint_cfg.get('db_path', os.path.join('state', 'checkpoints.db'))
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(BASE_DIR, db_path)
+        _checkpoint_manager = CheckpointManager(
+            db_path=db_path,
+            retention_days=checkpoint_cfg.get('retention_days', 7)
+        )
+    return _checkpoint_manager
@@ -1,5 +1,6 @@
 import json
 import os
+import socket
 import sys
 
 # Detectar la carpeta donde se encuentra el exe o el script
@@ -47,22 +48,63 @@ PROCESSING_FEATURES = config.get("processing_features", {
     "analysis_enabled": True
 })
 
+# Configuración de las llamadas de análisis al proveedor de IA
+ANALYSIS_SETTINGS = config.get("analysis_settings", {
+    "combined_mode": False,
+    "parallel_calls": False,
+    "parallel_workers": 8,
+    "prompt_caching": False,
+    "batch_mode": {
+        "enabled": False,
+        "min_records": 20,
+        "max_records": 500,
+        "poll_interval_seconds": 60,
+        "base_url": None
+    },
+    "async_clients": {
+        "enabled": False,
+        "max_in_flight": 32,
+        "max_connections": 32
+    }
+})
+
+# Configuración del reconocimiento de voz (ASR)
+ASR_CONFIG = config.get("asr", {
+    "engine": "google",
+    "language": "es-ES",
+    "max_concurrent_fragments": 4,
+    "max_requests_per_host": 8,
+    "max_segment_seconds": 58,
+    "vad": {"enabled": True},
+    "silence_prescreen": {"enabled": True},
+    "streaming": {"enabled": True, "threshold_seconds": 1800, "chunk_seconds": 30},
+    "stereo_split": {"enabled": True, "agent_channel": 0},
+    "wav_fast_path": {"enabled": True},
+    "probe": {"enabled": True, "min_duration_seconds": 1.0}
+})
+
 # Configuración de SQL Polling
 SQL_POLLING_CONFIG = config.get("sql_polling", {
     "enabled": False,
     "transcription": {
         "sp_get_pending": "GetPendingTranscriptions",
+        "sp_claim_pending": "ClaimPendingTranscriptions",
         "sp_set_result": "SetTranscription",
         "poll_interval_seconds": 30,
         "max_records_per_batch": 2,
-        "max_retries": 3
+        "max_retries": 3,
+        "workers": 1
     },
     "analysis": {
         "sp_get_pending": "GetPendingAnalysis",
+        "sp_claim_pending": "ClaimPendingAnalysis",
+        "sp_defer": "DeferTransaction",
+        "sp_set_batch": "SetTransactionBatch",
         "sp_set_result": "SetAnalysis",
         "poll_interval_seconds": 30,
         "max_records_per_batch": 2,
-        "max_retries": 3
+        "max_retries": 3,
+        "deferral_timeout_seconds": 600
     },
     "sp_get_monthly_tokens": "GetMonthlyTokenUsage",
     "table_name": "AudioQueue",
@@ -76,6 +118,12 @@ SQL_POLLING_CONFIG = config.get("sql_polling", {
     "status_error": "Error"
 })
 
+# Identidad de esta instancia para el claim de registros
+WORKER_ID = SQL_POLLING_CONFIG.get("worker_id") or f"{socket.gethostname()}-{os.getpid()}"
+
+# Modo pipeline: la transcripción terminada pasa directo al análisis
+PIPELINE_MODE = bool(SQL_POLLING_CONFIG.get("pipeline_mode", False))
+
 # Validación según el proveedor seleccionado
 if AI_PROVIDER == "claude":
     if not CLAUDE_API_KEY or CLAUDE_API_KEY.strip() == "" or CLAUDE_API_KEY == "xxxxxxxxxxxx":
@@ -90,4 +138,6 @@ print(f"[CONFIG] Proveedor de IA seleccionado: {AI_PROVIDER.upper()}")
 print(f"[CONFIG] SQL Polling: {'HABILITADO' if SQL_POLLING_CONFIG.get('enabled') else 'DESHABILITADO'}")
 print(f"[CONFIG] Transcripción: {'HABILITADA' if PROCESSING_FEATURES.get('transcription_enabled') else 'DESHABILITADA'}")
 print(f"[CONFIG] Análisis: {'HABILITADO' if PROCESSING_FEATURES.get('analysis_enabled') else 'DESHABILITADO'}")
+print(f"[CONFIG] Worker ID: {WORKER_ID}")
+print(f"[CONFIG] Pipeline transcripción→análisis: {'HABILITADO' if PIPELINE_MODE else 'DESHABILITADO'}")
 print(f"[CONFIG] Límite tokens/mes: {TOKEN_LIMITS.get('monthly_limit'):,} (Check: {'ON' if TOKEN_LIMITS.get('check_enabled') else 'OFF'})")
\ No newline at end of file
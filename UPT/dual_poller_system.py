@@ -1,24 +1,47 @@
+import queue
 import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 from log import get_logger
 from sql_connection import (
     obtener_registros_pendientes, 
+    reclamar_registros_pendientes,
+    liberar_registro,
+    diferir_registro,
     actualizar_estado,
     marcar_como_error
 )
-from audio_process import procesar_transcripcion, procesar_analisis
-from connection_settings import SQL_POLLING_CONFIG, PROCESSING_FEATURES
+from audio_process import procesar_transcripcion, procesar_analisis, adelantar_llamadas_analisis
+from transcripcion import get_transcription_engine
+from connection_settings import SQL_POLLING_CONFIG, PROCESSING_FEATURES, PIPELINE_MODE, WORKER_ID
 from token_manager import get_token_manager
+from lease_manager import get_lease_manager
+from retry_scheduler import get_retry_scheduler
+from checkpoint_manager import get_checkpoint_manager
+from metrics import get_metrics
+from transcription_cache import get_transcription_cache
+from audio_probe import get_probe_stats
+from llm_driver import get_llm_driver_stats, stop_llm_driver
+from batch_analysis import get_batch_analyzer, get_batch_stats
+from scheduling import (
+    POLITICAS,
+    ordenar_registros,
+    leer_duracion_audio,
+    simular_esperas,
+    resumir_esperas
+)
 
 logger = get_logger()
 token_manager = get_token_manager()
+metrics = get_metrics()
 
 
 class BasePoller:
-    """Clase base para pollers con tracking interno de reintentos"""
+    """Clase base para pollers con reintentos diferidos persistentes"""
     
-    def __init__(self, name, config):
+    def __init__(self, name, config, default_interval=15, default_batch=5):
         self.name = name
         self.config = config
         self.is_running = False
@@ -31,57 +54,448 @@ class BasePoller:
             'warnings': 0,  # Nuevo: contador de warnings
             'last_run': None
         }
-        # Tracking de reintentos en memoria: {transaction_id: retry_count}
-        self.retry_tracker = {}
+        # Reintentos con backoff persistidos en SQLite local
+        self.retry_scheduler = get_retry_scheduler()
         self.max_retries = config.get('max_retries', 3)
+        # Registros reclamados que esperan su reintento: {transaction_id: registro}
+        self._aparcados = {}
+        # Registros en proceso ahora mismo (para el drenado al detener)
+        self._en_proceso = {}
+        # En proceso que stop() abandonó al vencer el drenado: no escriben resultados
+        self._cancelados = set()
+        # Número de workers concurrentes por poller
+        self.workers = max(1, int(config.get('workers', 1)))
+        # Protege stats y aparcados cuando varios workers los actualizan
+        self._lock = threading.Lock()
+        # Intervalo de polling adaptativo según el backlog
+        self.poll_interval = config.get('poll_interval_seconds', default_interval)
+        self.max_records_per_batch = config.get('max_records_per_batch', default_batch)
+        adaptive_cfg = config.get('adaptive_polling', {})
+        self.adaptive_enabled = adaptive_cfg.get('enabled', False)
+        self.max_poll_interval = adaptive_cfg.get('max_interval_seconds', self.poll_interval * 10)
+        self.backoff_factor = adaptive_cfg.get('backoff_factor', 2)
+        self.current_interval = self.poll_interval
+        # Claim atómico de registros (si el SP existe en BD)
+        self.sp_get_pending = None
+        self.sp_claim_pending = config.get('sp_claim_pending')
+        self._claim_available = bool(self.sp_claim_pending)
+        # Leases con heartbeat sobre los registros reclamados (None = deshabilitado)
+        self.lease_manager = get_lease_manager()
+        # Política de orden del trabajo (fifo / sjf con envejecimiento)
+        scheduling_cfg = config.get('scheduling', {})
+        self.scheduling_policy = scheduling_cfg.get('policy', 'fifo')
+        if self.scheduling_policy not in POLITICAS:
+            logger.warning(f"⚠ {name} - Política '{self.scheduling_policy}' no soportada, usando fifo")
+            self.scheduling_policy = 'fifo'
+        self.aging_factor = scheduling_cfg.get('aging_factor', 1.0)
+        if self.scheduling_policy == 'sjf' and self._claim_available:
+            logger.info(
+                f"{name} - sjf con SP de claim: solo reordena dentro de cada batch reclamado "
+                f"({self.max_records_per_batch} registros); el orden entre batches lo fija el SP. "
+                f"Sin SP de claim se ordena toda la cola pendiente"
+            )
+        # Momento en que se vio cada registro por primera vez, si la BD no
+        # trae FechaEncolado: {transaction_id: epoch}
+        self._primera_vez = {}
+        # Esperas en cola reales y simuladas por política (últimos registros)
+        self._esperas_reales = deque(maxlen=500)
+        self._esperas_simuladas = {politica: deque(maxlen=500) for politica in POLITICAS}
+    
+    def _obtener_registros(self, tipo_proceso, extra=0, limite=None):
+        """
+        Obtiene el siguiente batch de registros respetando max_records_per_batch
+        
+        Usa el SP de claim (registros pasan a 'Procesando' para este worker);
+        si no existe en BD, cae al SP de pendientes sin claim. Primero se
+        retoman los reintentos aparcados que ya tocan, y los registros cuyo
+        reintento aún no toca no entran al batch.
+        
+        Args:
+            tipo_proceso: "transcription" o "analysis"
+            extra: Registros adicionales a pedir sobre el batch (el llamador
+                descarta y recorta lo que no vaya a procesar)
+            limite: Tamaño del batch si es menor que max_records_per_batch
+                (workers libres)
+        
+        Returns:
+            list: Registros a procesar en este ciclo
+        """
+        tope = self.max_records_per_batch if limite is None else limite
+        registros = self._retomar_aparcados(tope)
+        cupo = tope + extra - len(registros)
+        if cupo <= 0:
+            return registros
+        
+        if self._claim_available:
+            try:
+                reclamados = reclamar_registros_pendientes(
+                    self.sp_claim_pending,
+                    cupo,
+                    WORKER_ID,
+                    tipo_proceso=tipo_proceso,
+                    lease_seconds=self.lease_manager.lease_seconds if self.lease_manager else None
+                )
+            except Exception:
+                # Los reintentos retomados siguen siendo nuestros: vuelven a aparcados
+                for registro in registros:
+                    self._aparcar(registro)
+                raise
+            if reclamados is not None:
+                if self.lease_manager:
+                    for registro in reclamados:
+                        self.lease_manager.adquirir(registro['transaction_id'], self.name)
+                
+                # Reclamados tras un reinicio cuyo reintento aún no toca
+                listos, diferidos = self.retry_scheduler.separar_no_vencidos(self.name, reclamados)
+                for registro in diferidos:
+                    self._aparcar(registro)
+                return self._ordenar(registros + listos)
+            
+            logger.warning(
+                f"⚠ {self.name} - SP de claim '{self.sp_claim_pending}' no existe. "
+                f"Usando {self.sp_get_pending} sin claim (solo una instancia es segura)"
+            )
+            self._claim_available = False
+        
+        pendientes = obtener_registros_pendientes(self.sp_get_pending, tipo_proceso=tipo_proceso)
+        self._olvidar_no_pendientes(pendientes)
+        listos, diferidos = self.retry_scheduler.separar_no_vencidos(self.name, pendientes)
+        if diferidos:
+            logger.debug(f"{self.name} - {len(diferidos)} registros esperando su reintento")
+        # Sin claim se ve toda la cola: se ordena completa antes de recortar el batch
+        return self._ordenar(registros + self._ordenar(listos, simular=False)[:cupo])
+    
+    def _ordenar(self, registros, simular=True):
+        """
+        Aplica la política de scheduling y registra la espera simulada del
+        batch bajo cada política para poder compararlas
+        
+        Args:
+            registros: Registros en orden FIFO
+            simular: Si se registra la simulación (solo para el batch final)
+        
+        Returns:
+            list: Registros en el orden en que se procesarán
+        """
+        if not registros:
+            return registros
+        
+        ahora = time.time()
+        with self._lock:
+            for registro in registros:
+                if not registro.get('enqueued_at'):
+                    self._primera_vez.setdefault(registro['transaction_id'], ahora)
+            esperas = {
+                registro['transaction_id']: ahora - self._llegada(registro)
+                for registro in registros
+            }
+        
+        ordenados = ordenar_registros(
+            registros,
+            politica=self.scheduling_policy,
+            aging_factor=self.aging_factor,
+            esperas=esperas
+        )
+        
+        if simular:
+            for politica in POLITICAS:
+                orden = ordenar_registros(registros, politica, self.aging_factor, esperas)
+                duraciones = [
+                    r.setdefault('audio_duration', leer_duracion_audio(r['audio_path']))
+                    for r in orden
+                ]
+                simuladas = simular_esperas(duraciones, self.workers)
+                with self._lock:
+                    self._esperas_simuladas[politica].extend(simuladas)
+        
+        return ordenados
+    
+    def _llegada(self, registro):
+        """Momento en que el registro entró a la cola (FechaEncolado, o cuando se vio por primera vez)"""
+        return registro.get('enqueued_at') or self._primera_vez.get(registro['transaction_id'], time.time())
+    
+    def _olvidar_no_pendientes(self, pendientes):
+        """Descarta marcas de llegada de registros que ya no están en la cola"""
+        ids = {registro['transaction_id'] for registro in pendientes}
+        with self._lock:
+            for transaction_id in list(self._primera_vez):
+                if transaction_id not in ids:
+                    del self._primera_vez[transaction_id]
+    
+    def _aparcar(self, registro):
+        """Retiene un registro reclamado (con su lease) hasta que toque reintentarlo"""
+        with self._lock:
+            self._aparcados[registro['transaction_id']] = registro
+    
+    def _retomar_aparcados(self, limite):
+        """
+        Saca de aparcados los registros cuyo reintento ya toca
+        
+        Args:
+            limite: Máximo de registros a retomar
+        
+        Returns:
+            list: Registros listos para reintentar
+        """
+        with self._lock:
+            aparcados = list(self._aparcados.values())
+        if not aparcados:
+            return []
+        
+        listos, _ = self.retry_scheduler.separar_no_vencidos(self.name, aparcados)
+        listos = listos[:limite]
+        with self._lock:
+            for registro in listos:
+                self._aparcados.pop(registro['transaction_id'], None)
+        
+        if listos:
+            logger.info(f"↻ {self.name} - Retomando {len(listos)} reintentos programados")
+        return listos
+    
+    def _reclamar_registro(self, registro, tipo_proceso):
+        """
+        Reclama un registro concreto con el SP de claim (hand-off del pipeline)
+        
+        Args:
+            registro: Registro conocido en memoria (transaction_id, audio_path...)
+            tipo_proceso: "transcription" o "analysis"
+        
+        Returns:
+            dict: El registro reclamado, o None si otra instancia lo tiene, ya
+                no está pendiente o el claim falló. Sin SP de claim se devuelve tal cual.
+        """
+        if not self._claim_available:
+            return registro
+        
+        try:
+            reclamados = reclamar_registros_pendientes(
+                self.sp_claim_pending,
+                1,
+                WORKER_ID,
+                tipo_proceso=tipo_proceso,
+                lease_seconds=self.lease_manager.lease_seconds if self.lease_manager else None,
+                transaction_id=registro['transaction_id']
+            )
+        except Exception as e:
+            logger.error(f"✗ {self.name} - No se pudo reclamar {registro['transaction_id']}: {e}")
+            return None
+        if reclamados is None:
+            logger.warning(
+                f"⚠ {self.name} - SP de claim '{self.sp_claim_pending}' no existe. "
+                f"Usando {self.sp_get_pending} sin claim (solo una instancia es segura)"
+            )
+            self._claim_available = False
+            return registro
+        if not reclamados:
+            return None
+        
+        reclamado = reclamados[0]
+        if self.lease_manager:
+            self.lease_manager.adquirir(reclamado['transaction_id'], self.name)
+        # Lo que ya se sabe en memoria completa lo que no traiga la BD
+        for clave, valor in registro.items():
+            if reclamado.get(clave) is None:
+                reclamado[clave] = valor
+        return reclamado
+    
+    def _retenido(self, transaction_id):
+        """Si el registro sigue reclamado por este poller sin estar en proceso (llamar con _lock)"""
+        return transaction_id in self._aparcados
+    
+    def _cancelado(self, transaction_id):
+        """True si stop() abandonó el registro mientras su worker seguía en curso"""
+        with self._lock:
+            return transaction_id in self._cancelados
+    
+    def _soltar_lease(self, registro):
+        """Deja de renovar el lease del registro (terminado o liberado)"""
+        if not self.lease_manager or not registro.get('claimed_by'):
+            return
+        with self._lock:
+            if self._retenido(registro['transaction_id']):
+                # Aparcado para reintento: el lease se sigue renovando
+                return
+        self.lease_manager.soltar(registro['transaction_id'], owner=self.name)
+    
+    def _liberar_si_reclamado(self, registro, retry_count=None):
+        """Devuelve a 'Pendiente' un registro reclamado que no se completó"""
+        if not registro.get('claimed_by'):
+            return
+        self._soltar_lease(registro)
+        try:
+            liberado = liberar_registro(registro['transaction_id'], retry_count=retry_count)
+        except Exception as e:
+            logger.error(f"No se pudo liberar {registro['transaction_id']}: {e}")
+            return
+        if not liberado:
+            logger.error(
+                f"✗ {self.name} - No se pudo liberar {registro['transaction_id']}: "
+                f"queda reclamado hasta que venza su lease"
+            )
+    
+    def _increment_stat(self, key, amount=1):
+        """Incrementa un contador de stats de forma thread-safe"""
+        with self._lock:
+            self.stats[key] += amount
+    
+    def _next_poll_interval(self, num_registros, pedidos=None):
+        """
+        Calcula la espera hasta el siguiente ciclo según el último batch
+        
+        - Batch lleno: hay backlog, volver a consultar de inmediato
+        - Batch vacío: alejar la consulta multiplicando por backoff_factor
+          hasta max_interval_seconds
+        - Batch parcial: intervalo base
+        
+        Args:
+            num_registros: Registros obtenidos en el último ciclo
+            pedidos: Registros pedidos en ese ciclo (None = max_records_per_batch)
+        
+        Returns:
+            float: Segundos a esperar
+        """
+        if not self.adaptive_enabled:
+            return self.poll_interval
+        
+        if pedidos is None:
+            pedidos = self.max_records_per_batch
+        if pedidos and num_registros >= pedidos:
+            nuevo = 0
+            motivo = "batch lleno, hay backlog"
+        elif num_registros == 0:
+            if self.current_interval < self.poll_interval:
+                nuevo = self.poll_interval
+            else:
+                nuevo = min(self.current_interval * self.backoff_factor, self.max_poll_interval)
+            motivo = "cola vacía"
+        else:
+            nuevo = self.poll_interval
+            motivo = "batch parcial"
+        
+        if nuevo != self.current_interval:
+            logger.info(
+                f"⏱ {self.name} - Intervalo de polling {self.current_interval}s → {nuevo}s ({motivo})"
+            )
+            self.current_interval = nuevo
+        
+        return nuevo
+    
+    def _ejecutar_registro(self, registro):
+        """Procesa un registro y suelta su lease al terminar, sea cual sea el resultado"""
+        transaction_id = registro['transaction_id']
+        with self._lock:
+            llegada = self._primera_vez.pop(transaction_id, None)
+            if registro.get('enqueued_at'):
+                llegada = registro['enqueued_at']
+            if llegada is not None:
+                self._esperas_reales.append(time.time() - llegada)
+            self._en_proceso[transaction_id] = registro
+        try:
+            # Las etapas medidas durante el registro se atribuyen a este poller
+            with metrics.contexto_poller(self.name):
+                self._procesar_registro(registro)
+        finally:
+            with self._lock:
+                self._en_proceso.pop(transaction_id, None)
+                cancelado = transaction_id in self._cancelados
+                self._cancelados.discard(transaction_id)
+            # Un cancelado ya no tiene lease: sigue reclamado hasta que venza
+            if not cancelado:
+                self._soltar_lease(registro)
+    
+    def _procesar_registro(self, registro):
+        """Implementado por subclases"""
+        raise NotImplementedError
     
-    def _update_retry_count(self, transaction_id):
+    def _update_retry_count(self, transaction_id, registro=None, error=""):
         """
-        Maneja reintentos internamente con tracker en memoria
-        Marca como error si excede el máximo
+        Registra el fallo en la cola persistente y programa el reintento con
+        backoff exponencial. Marca como error si excede el máximo.
         
         Args:
             transaction_id: ID de la transacción
+            registro: Registro procesado (aporta ReintentoCount de BD y el claim)
+            error: Descripción del error
         
         Returns:
             bool: True si debe marcarse como error y no reintentar
         """
-        # Obtener conteo actual del tracker interno
-        current_count = self.retry_tracker.get(transaction_id, 0)
-        new_count = current_count + 1
+        if self._cancelado(transaction_id):
+            # Abandonado por stop(): el fallo no se escribe, el lease vencido lo devuelve
+            logger.info(f"{self.name} - Fallo de {transaction_id} tras cancelarse: no se registra")
+            return False
         
-        # Actualizar tracker
-        self.retry_tracker[transaction_id] = new_count
+        # El mayor entre lo registrado localmente y el ReintentoCount de BD
+        # (otra instancia pudo haber fallado antes con este registro)
+        attempts, next_attempt_at = self.retry_scheduler.registrar_fallo(
+            self.name,
+            transaction_id,
+            error=error,
+            min_attempts=registro.get('retry_count', 0) if registro else 0
+        )
         
-        if new_count >= self.max_retries:
+        if attempts >= self.max_retries:
             logger.error(
                 f"✗✗✗ {self.name} - TransactionId {transaction_id} excedió "
                 f"{self.max_retries} reintentos. Marcando como ERROR."
             )
+            self.retry_scheduler.limpiar(self.name, transaction_id)
             try:
                 # Marcar como error en la BD
                 marcar_como_error(
                     transaction_id, 
                     f"{self.name}: Máximo de {self.max_retries} reintentos alcanzado"
                 )
-                # Limpiar del tracker
-                del self.retry_tracker[transaction_id]
             except Exception as e:
                 logger.error(f"No se pudo marcar como ERROR para {transaction_id}: {e}")
             return True
-        else:
-            # Solo logear - el conteo está en memoria
-            logger.warning(
-                f"⚠ {self.name} - TransactionId {transaction_id} falló. "
-                f"Intento {new_count}/{self.max_retries}"
-            )
-            return False
+        
+        espera = max(0, next_attempt_at - time.time())
+        logger.warning(
+            f"⚠ {self.name} - TransactionId {transaction_id} falló. "
+            f"Intento {attempts}/{self.max_retries} - Próximo intento en {espera:.0f}s"
+        )
+        
+        if registro and registro.get('claimed_by'):
+            # Se conserva el claim (y su lease) hasta que toque reintentar;
+            # el conteo queda en BD por si otra instancia lo retoma
+            registro['retry_count'] = attempts
+            self._aparcar(registro)
+            try:
+                actualizar_estado(transaction_id, 'Procesando', retry_count=attempts)
+            except Exception as e:
+                logger.debug(f"No se pudo actualizar ReintentoCount de {transaction_id}: {e}")
+        return False
+    
+    def _registrar_completado(self, registro):
+        """Suma el registro y los minutos de audio que cubría a las tasas del poller"""
+        try:
+            audio_segundos = registro.get('audio_duration')
+            if audio_segundos is None:
+                audio_segundos = leer_duracion_audio(registro['audio_path'])
+        except Exception:
+            audio_segundos = 0
+        metrics.registrar_completado(self.name, audio_segundos)
     
     def _clear_retry_on_success(self, transaction_id):
-        """Limpia el contador de reintentos cuando un proceso tiene éxito"""
-        if transaction_id in self.retry_tracker:
-            logger.debug(f"Limpiando retry tracker para {transaction_id}")
-            del self.retry_tracker[transaction_id]
+        """Limpia los reintentos programados cuando un proceso tiene éxito"""
+        if self.retry_scheduler.limpiar(self.name, transaction_id):
+            logger.debug(f"Limpiando reintentos programados para {transaction_id}")
+    
+    def _liberar_aparcados(self):
+        """Devuelve a la cola los registros aparcados (al detener el poller)"""
+        with self._lock:
+            aparcados = list(self._aparcados.values())
+            self._aparcados.clear()
+        
+        for registro in aparcados:
+            self._liberar_si_reclamado(registro, retry_count=registro.get('retry_count'))
+        
+        if aparcados:
+            logger.info(
+                f"{self.name} - {len(aparcados)} reintentos aparcados devueltos a la cola "
+                f"(su próximo intento sigue programado)"
+            )
     
     def start(self):
         """Inicia el polling"""
@@ -101,20 +515,80 @@ class BasePoller:
         
         logger.info(f"✓ {self.name} iniciado")
     
-    def stop(self):
-        """Detiene el polling"""
+    def request_stop(self):
+        """Deja de reclamar registros nuevos; los que están en curso siguen"""
         if not self.is_running:
             return
         
         logger.info(f"Deteniendo {self.name}...")
         self.stop_event.set()
         self.is_running = False
+    
+    def stop(self, drain_timeout=None):
+        """
+        Detiene el polling
+        
+        Args:
+            drain_timeout: Segundos para que terminen los trabajos en curso
+                (None = espera corta de 10s). Los que no terminen a tiempo se
+                cancelan y quedan reclamados hasta que venza su lease; sus
+                etapas completadas quedan en checkpoint.
+        """
+        if self.polling_thread is None:
+            return
+        
+        self.request_stop()
+        
+        with self._lock:
+            en_curso = len(self._en_proceso)
+        if drain_timeout is not None and en_curso:
+            logger.info(
+                f"{self.name} - Drenando {en_curso} trabajos en curso (máx {drain_timeout:.0f}s)"
+            )
         
         if self.polling_thread:
-            self.polling_thread.join(timeout=10)
+            self.polling_thread.join(timeout=10 if drain_timeout is None else drain_timeout)
+        
+        self._liberar_en_proceso()
+        self._liberar_aparcados()
         
         logger.info(f"✓ {self.name} detenido")
     
+    def _liberar_en_proceso(self):
+        """
+        Cancela los trabajos que no terminaron dentro del plazo de drenado
+        
+        Sus hilos siguen vivos, así que no se devuelven a 'Pendiente' (otra
+        instancia los tomaría mientras este worker aún puede escribir): se
+        marcan cancelados, el worker omite sus escrituras finales en BD, y
+        quedan reclamados sin renovar el lease. Al vencer, el SP de claim
+        los entrega de nuevo y se reanudan desde su checkpoint.
+        """
+        with self._lock:
+            pendientes = list(self._en_proceso.values())
+            self._cancelados.update(registro['transaction_id'] for registro in pendientes)
+        
+        if not pendientes:
+            return
+        
+        checkpoint_manager = get_checkpoint_manager()
+        for registro in pendientes:
+            transaction_id = registro['transaction_id']
+            etapas = checkpoint_manager.obtener_etapas(transaction_id)
+            logger.warning(
+                f"⚠ {self.name} - TransactionId {transaction_id} no terminó a tiempo: "
+                f"cancelado, queda reclamado hasta que venza su lease. "
+                f"Etapas en checkpoint: {', '.join(etapas) if etapas else 'ninguna'}"
+            )
+            if self.lease_manager and registro.get('claimed_by'):
+                self.lease_manager.soltar(transaction_id, owner=self.name)
+    
+    def _describir_politica(self):
+        """Línea de arranque con la política de scheduling activa"""
+        if self.scheduling_policy == 'sjf':
+            return f"Política SJF - Los más cortos primero (envejecimiento x{self.aging_factor})"
+        return "Política FIFO - Los más antiguos primero"
+    
     def is_healthy(self):
         """Health check"""
         return (
@@ -125,7 +599,18 @@ class BasePoller:
     
     def get_stats(self):
         """Retorna estadísticas"""
-        return self.stats.copy()
+        with self._lock:
+            stats = self.stats.copy()
+            stats['parked'] = len(self._aparcados)
+            stats['scheduling_policy'] = self.scheduling_policy
+            stats['queue_wait'] = resumir_esperas(self._esperas_reales)
+            stats['queue_wait_simulated'] = {
+                politica: resumir_esperas(esperas)
+                for politica, esperas in self._esperas_simuladas.items()
+            }
+        stats.update(self.retry_scheduler.get_stats(self.name))
+        stats['metrics'] = metrics.get_stats(self.name)
+        return stats
     
     def _polling_loop(self):
         """Implementado por subclases"""
@@ -133,215 +618,690 @@ class BasePoller:
 
 
 class TranscriptionPoller(BasePoller):
-    """Poller para transcripciones pendientes (FIFO)"""
+    """
+    Poller para transcripciones pendientes con pool de workers
+    
+    Mantiene hasta `workers` transcripciones en curso: en cuanto termina
+    una se reclama la siguiente, sin esperar a que acabe todo el batch.
+    """
     
     def __init__(self):
         config = SQL_POLLING_CONFIG.get('transcription', {})
-        super().__init__("TranscriptionPoller", config)
+        super().__init__("TranscriptionPoller", config, default_interval=15, default_batch=5)
         self.sp_get_pending = config.get('sp_get_pending', 'GetPendingTranscription')
     
+    def _procesar_registro(self, registro):
+        """
+        Procesa una transcripción dentro de un worker del pool
+        
+        Args:
+            registro: Diccionario con transaction_id y audio_path
+        """
+        transaction_id = registro['transaction_id']
+        audio_path = registro['audio_path']
+        
+        # Si se pidió detener, no iniciar registros nuevos
+        if self.stop_event.is_set():
+            logger.debug(f"{self.name} - Omitiendo {transaction_id}: poller deteniéndose")
+            self._liberar_si_reclamado(registro)
+            return
+        
+        logger.info(f"▶Procesando transcripción: {transaction_id}")
+        
+        # Procesar con manejo de errores críticos vs warnings
+        try:
+            success, tokens_in, tokens_out, transcription_path = procesar_transcripcion(
+                transaction_id,
+                audio_path,
+                cancelado=lambda: self._cancelado(transaction_id)
+            )
+            
+            if self._cancelado(transaction_id):
+                # Abandonado por stop(): sin escrituras finales
+                return
+            
+            if success:
+                self._increment_stat('processed')
+                self._clear_retry_on_success(transaction_id)
+                self._registrar_completado(registro)
+                logger.info(
+                    f"✓ Transcripción {transaction_id} completada - "
+                    f"Tokens: IN={tokens_in} OUT={tokens_out}"
+                )
+                self._entregar_a_analisis(transaction_id, audio_path, transcription_path)
+            else:
+                # WARNING: No se obtuvo transcripción (audio sin voz, ininteligible, etc.)
+                # No cuenta como fallo que requiera reintento
+                self._increment_stat('warnings')
+                self._clear_retry_on_success(transaction_id)
+                logger.warning(
+                    f"⚠ WARNING: TransactionId {transaction_id} - "
+                    f"No se obtuvo transcripción válida (audio sin voz/ininteligible)"
+                )
+                # Marcar como completado de todas formas (es un warning, no error)
+                try:
+                    actualizar_estado(transaction_id, 'Completado')
+                except Exception as e:
+                    logger.error(f"No se pudo actualizar estado: {e}")
+        
+        except FileNotFoundError as e:
+            # ERROR CRÍTICO: Archivo no existe
+            self._increment_stat('failed')
+            logger.error(f"✗ ERROR CRÍTICO: {e}")
+            is_error = self._update_retry_count(transaction_id, registro, error=e)
+            if is_error:
+                self._increment_stat('errors')
+        
+        except RuntimeError as e:
+            # ERROR CRÍTICO: Límite de tokens excedido
+            self._increment_stat('failed')
+            logger.error(f"✗ ERROR CRÍTICO: {e}")
+            is_error = self._update_retry_count(transaction_id, registro, error=e)
+            if is_error:
+                self._increment_stat('errors')
+        
+        except Exception as e:
+            # ERROR CRÍTICO: Excepción inesperada
+            self._increment_stat('failed')
+            logger.error(f"✗ ERROR CRÍTICO inesperado: {e}", exc_info=True)
+            is_error = self._update_retry_count(transaction_id, registro, error=e)
+            if is_error:
+                self._increment_stat('errors')
+    
+    def _entregar_a_analisis(self, transaction_id, audio_path, transcription_path):
+        """
+        Avisa al AnalysisPoller de la transcripción terminada: reactiva el
+        análisis si estaba diferido y, en modo pipeline, se lo pasa directo
+        """
+        analysis_poller = _analysis_poller
+        if analysis_poller is None:
+            return
+        
+        analysis_poller.despertar(transaction_id)
+        
+        if not PIPELINE_MODE or not PROCESSING_FEATURES.get('analysis_enabled', True):
+            return
+        if not analysis_poller.is_running:
+            return
+        
+        analysis_poller.encolar_analisis(transaction_id, audio_path, transcription_path)
+    
+    def _esperar_hueco(self, en_curso, timeout):
+        """
+        Espera hasta el siguiente ciclo retirando los registros que terminan
+        
+        Vence el plazo y hay un worker libre, o se pide detener. Con todos los
+        workers ocupados se sigue esperando aunque el plazo haya vencido
+        (con backlog el plazo es 0: se reclama en cuanto termina uno).
+        
+        Args:
+            en_curso: Dict {future: registro} de los enviados al pool
+            timeout: Segundos hasta el siguiente ciclo de polling
+        """
+        deadline = time.monotonic() + timeout
+        
+        while not self.stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and len(en_curso) < self.workers:
+                return
+            if not en_curso:
+                self.stop_event.wait(remaining)
+                continue
+            
+            done, _ = wait(
+                list(en_curso),
+                timeout=min(remaining, 1) if remaining > 0 else 1,
+                return_when=FIRST_COMPLETED
+            )
+            for future in done:
+                en_curso.pop(future, None)
+    
+    def _cancelar_no_iniciados(self, en_curso):
+        """Al detener, cancela (y libera) los enviados al pool que aún no iniciaron"""
+        # Cancelados antes de iniciar: _ejecutar_registro no los libera
+        cancelados = [f for f in en_curso if f.cancel()]
+        for future in cancelados:
+            self._liberar_si_reclamado(en_curso[future])
+        if cancelados:
+            logger.info(f"{self.name} - {len(cancelados)} registros no iniciados cancelados")
+        # Los que ya están en curso terminan por su cuenta
+    
     def _polling_loop(self):
         logger.info("=" * 60)
         logger.info(f"{self.name} iniciado")
         logger.info(f"SP: {self.sp_get_pending}")
-        logger.info(f"Intervalo: {self.config.get('poll_interval_seconds', 15)}s")
-        logger.info(f"Máx por batch: {self.config.get('max_records_per_batch', 5)}")
+        logger.info(f"Intervalo: {self.poll_interval}s")
+        if self.adaptive_enabled:
+            logger.info(f"Intervalo adaptativo: 0s - {self.max_poll_interval}s")
+        logger.info(f"Máx por batch: {self.max_records_per_batch}")
         logger.info(f"Reintentos: {self.max_retries}")
-        logger.info("Sistema FIFO - Los más antiguos primero")
+        logger.info(f"Workers: {self.workers}")
+        logger.info(self._describir_politica())
         logger.info("=" * 60)
         
         cycle = 0
+        # Enviados al pool y aún sin terminar: {future: registro}
+        en_curso = {}
         
-        while not self.stop_event.is_set():
-            cycle += 1
-            self.stats['last_run'] = datetime.now()
-            
-            try:
-                if not PROCESSING_FEATURES.get('transcription_enabled', True):
-                    logger.debug(f"{self.name} - Transcripción deshabilitada, esperando...")
-                    self.stop_event.wait(self.config.get('poll_interval_seconds', 15))
-                    continue
+        with ThreadPoolExecutor(
+            max_workers=self.workers,
+            thread_name_prefix=f"{self.name}Worker"
+        ) as executor:
+            while not self.stop_event.is_set():
+                cycle += 1
+                with self._lock:
+                    self.stats['last_run'] = datetime.now()
+                num_registros = None
+                pedidos = None
                 
-                # Obtener registros pendientes
-                registros = obtener_registros_pendientes(
-                    self.sp_get_pending,
-                    tipo_proceso="transcription"
-                )
-                
-                if registros:
-                    logger.info(
-                        f"🎤 {self.name} - {len(registros)} transcripciones procesables (ciclo {cycle})"
-                    )
+                try:
+                    if not PROCESSING_FEATURES.get('transcription_enabled', True):
+                        logger.debug(f"{self.name} - Transcripción deshabilitada, esperando...")
+                        self._esperar_hueco(en_curso, self.poll_interval)
+                        continue
                     
-                    for registro in registros:
-                        if self.stop_event.is_set():
-                            break
-                        
-                        transaction_id = registro['transaction_id']
-                        audio_path = registro['audio_path']
-                        
-                        logger.info(f"▶Procesando transcripción: {transaction_id}")
-                        
-                        # Procesar con manejo de errores críticos vs warnings
-                        try:
-                            success, tokens_in, tokens_out, _ = procesar_transcripcion(
-                                transaction_id,
-                                audio_path
-                            )
-                            
-                            if success:
-                                self.stats['processed'] += 1
-                                self._clear_retry_on_success(transaction_id)
-                                logger.info(
-                                    f"✓ Transcripción {transaction_id} completada - "
-                                    f"Tokens: IN={tokens_in} OUT={tokens_out}"
-                                )
-                            else:
-                                # WARNING: No se obtuvo transcripción (audio sin voz, ininteligible, etc.)
-                                # No cuenta como fallo que requiera reintento
-                                self.stats['warnings'] += 1
-                                self._clear_retry_on_success(transaction_id)
-                                logger.warning(
-                                    f"⚠ WARNING: TransactionId {transaction_id} - "
-                                    f"No se obtuvo transcripción válida (audio sin voz/ininteligible)"
-                                )
-                                # Marcar como completado de todas formas (es un warning, no error)
-                                try:
-                                    actualizar_estado(transaction_id, 'Completado')
-                                except Exception as e:
-                                    logger.error(f"No se pudo actualizar estado: {e}")
-                        
-                        except FileNotFoundError as e:
-                            # ERROR CRÍTICO: Archivo no existe
-                            self.stats['failed'] += 1
-                            logger.error(f"✗ ERROR CRÍTICO: {e}")
-                            is_error = self._update_retry_count(transaction_id)
-                            if is_error:
-                                self.stats['errors'] += 1
-                        
-                        except RuntimeError as e:
-                            # ERROR CRÍTICO: Límite de tokens excedido
-                            self.stats['failed'] += 1
-                            logger.error(f"✗ ERROR CRÍTICO: {e}")
-                            is_error = self._update_retry_count(transaction_id)
-                            if is_error:
-                                self.stats['errors'] += 1
-                        
-                        except Exception as e:
-                            # ERROR CRÍTICO: Excepción inesperada
-                            self.stats['failed'] += 1
-                            logger.error(f"✗ ERROR CRÍTICO inesperado: {e}", exc_info=True)
-                            is_error = self._update_retry_count(transaction_id)
-                            if is_error:
-                                self.stats['errors'] += 1
+                    # Solo se reclama lo que cabe en los workers libres
+                    pedidos = min(self.workers - len(en_curso), self.max_records_per_batch)
+                    registros = self._obtener_registros("transcription", limite=pedidos)
+                    num_registros = len(registros)
+                    
+                    if registros:
+                        logger.info(
+                            f"🎤 {self.name} - {len(registros)} transcripciones procesables (ciclo {cycle})"
+                        )
                         
-                        time.sleep(2)  # Pausa entre procesos
-                else:
-                    logger.debug(f"{self.name} - Sin transcripciones pendientes (ciclo {cycle})")
+                        # El pool toma las tareas en el orden de envío (el de la política)
+                        for registro in registros:
+                            en_curso[executor.submit(self._ejecutar_registro, registro)] = registro
+                    else:
+                        logger.debug(f"{self.name} - Sin transcripciones pendientes (ciclo {cycle})")
+                    
+                except Exception as e:
+                    logger.error(f"Error en {self.name} (ciclo {cycle}): {e}", exc_info=True)
                 
-            except Exception as e:
-                logger.error(f"Error en {self.name} (ciclo {cycle}): {e}", exc_info=True)
-            
-            # Cada 20 ciclos, mostrar resumen
-            if cycle % 20 == 0:
-                logger.info("\n" + token_manager.get_usage_summary())
+                # Cada 20 ciclos, mostrar resumen
+                if cycle % 20 == 0:
+                    logger.info("\n" + token_manager.get_usage_summary())
+                
+                # Si el ciclo falló se usa el intervalo base
+                if num_registros is None:
+                    self._esperar_hueco(en_curso, self.poll_interval)
+                else:
+                    self._esperar_hueco(en_curso, self._next_poll_interval(num_registros, pedidos))
             
-            self.stop_event.wait(self.config.get('poll_interval_seconds', 15))
+            self._cancelar_no_iniciados(en_curso)
         
         logger.info(f"{self.name} detenido")
 
 
 class AnalysisPoller(BasePoller):
-    """Poller para análisis pendientes (FIFO)"""
+    """
+    Poller para análisis pendientes
+    
+    En modo pipeline también atiende una cola en memoria que alimenta el
+    TranscriptionPoller al terminar cada transcripción. El polling a BD
+    sigue activo como red de seguridad para lo que la cola no cubra.
+    
+    Los análisis cuya transcripción aún no existe quedan diferidos: vuelven
+    a 'Pendiente' con un no-antes-de (sp_defer) para que el SP de claim no
+    los entregue, hasta que el TranscriptionPoller la termina o vence
+    deferral_timeout_seconds (transcripción hecha en otra instancia). Si el
+    SP no existe se retienen reclamados (con su lease) en lugar de liberarlos.
+    
+    Con analysis_settings.batch_mode, cuando hay al menos min_records
+    pendientes se reclaman hasta max_records y se envían en un lote del
+    proveedor; al terminar el lote cada registro se procesa con sus
+    respuestas ya en checkpoint. El lote completo solo se reclama cuando el
+    claim anterior llegó lleno (hay backlog); si el envío del lote falla, lo
+    que excede max_records_per_batch vuelve a la cola.
+    """
     
     def __init__(self):
         config = SQL_POLLING_CONFIG.get('analysis', {})
-        super().__init__("AnalysisPoller", config)
+        super().__init__("AnalysisPoller", config, default_interval=30, default_batch=2)
         self.sp_get_pending = config.get('sp_get_pending', 'GetPendingAnalisys')
+        self.stats['pipeline'] = 0
+        # Cola de hand-off desde transcripción: registros con su transcription_path
+        self.handoff_queue = queue.Queue()
+        # Registros en cola o en proceso por la vía pipeline: {transaction_id: registro}
+        self._handoff_registros = {}
+        # Análisis esperando su transcripción: {transaction_id: epoch límite}
+        self.deferral_timeout = config.get('deferral_timeout_seconds', 600)
+        self.sp_defer = config.get('sp_defer', 'DeferTransaction')
+        self._defer_available = bool(self.sp_defer)
+        self._diferidos = {}
+        # Diferidos devueltos a la cola con no-antes-de en BD
+        self._diferidos_en_bd = set()
+        # Diferidos que se retienen reclamados (sin SP de diferir): {transaction_id: registro}
+        self._retenidos = {}
+        self.stats['deferred'] = 0
+        # Análisis por lotes del proveedor (None = solo interactivo)
+        self.batch_analyzer = get_batch_analyzer()
+        self.stats['batched'] = 0
+        # El último claim trajo todo lo pedido: hay backlog para intentar un lote
+        self._claim_lleno = False
+    
+    def _diferir(self, registro):
+        """
+        Aparta un análisis hasta que termine su transcripción o venza el plazo
+        
+        Si está reclamado vuelve a la cola con no-antes-de, así el SP de claim
+        no lo entrega en cada ciclo; sin SP de diferir se retiene reclamado.
+        """
+        transaction_id = registro['transaction_id']
+        en_bd = False
+        if registro.get('claimed_by') and self._defer_available:
+            en_bd = diferir_registro(self.sp_defer, transaction_id, self.deferral_timeout)
+            if not en_bd:
+                logger.warning(
+                    f"⚠ {self.name} - SP '{self.sp_defer}' no disponible: los análisis sin "
+                    f"transcripción se retienen reclamados hasta que llegue"
+                )
+                self._defer_available = False
+        
+        with self._lock:
+            nuevo = transaction_id not in self._diferidos
+            self._diferidos[transaction_id] = time.time() + self.deferral_timeout
+            if en_bd:
+                self._diferidos_en_bd.add(transaction_id)
+            elif registro.get('claimed_by'):
+                self._retenidos[transaction_id] = registro
+        
+        if nuevo:
+            self._increment_stat('deferred')
+        logger.info(
+            f"⏸ {self.name} - TransactionId {transaction_id} diferido hasta que termine "
+            f"su transcripción (máx {self.deferral_timeout}s)"
+        )
+    
+    def despertar(self, transaction_id):
+        """
+        Reactiva un análisis diferido (su transcripción acaba de terminar)
+        
+        Returns:
+            bool: True si estaba diferido
+        """
+        with self._lock:
+            estaba = self._diferidos.pop(transaction_id, None) is not None
+            en_bd = transaction_id in self._diferidos_en_bd
+            self._diferidos_en_bd.discard(transaction_id)
+        if en_bd:
+            # Que el SP de claim lo entregue ya, sin esperar al no-antes-de
+            diferir_registro(self.sp_defer, transaction_id, 0)
+        if estaba:
+            logger.info(f"▶ {self.name} - TransactionId {transaction_id} reactivado: transcripción lista")
+        return estaba
+    
+    def _retenido(self, transaction_id):
+        """Los diferidos retenidos también conservan su lease"""
+        return super()._retenido(transaction_id) or transaction_id in self._retenidos
+    
+    def _retomar_aparcados(self, limite):
+        """
+        Además de los reintentos que ya tocan, retoma los diferidos retenidos
+        cuya transcripción llegó o cuyo plazo venció
+        """
+        ahora = time.time()
+        with self._lock:
+            listos = [
+                registro for transaction_id, registro in self._retenidos.items()
+                if ahora >= self._diferidos.get(transaction_id, 0)
+            ][:limite]
+            for registro in listos:
+                self._retenidos.pop(registro['transaction_id'], None)
+                self._diferidos.pop(registro['transaction_id'], None)
+        return listos + super()._retomar_aparcados(limite - len(listos))
+    
+    def _separar_diferidos(self, registros):
+        """
+        Separa los registros que siguen esperando su transcripción
+        
+        Solo aplica a la vía sin claim, que ve toda la cola: los reclamados
+        ya vienen filtrados por el SP de claim (no entrega un diferido antes
+        de su no-antes-de), así que se procesan. Los diferidos cuyo plazo
+        venció vuelven a procesarse (se reintenta la búsqueda de la
+        transcripción) y las entradas muy viejas de registros que ya no
+        aparecen se olvidan.
+        
+        Returns:
+            tuple: (listos, diferidos sin reclamar)
+        """
+        ahora = time.time()
+        listos, diferidos = [], []
+        with self._lock:
+            for registro in registros:
+                transaction_id = registro['transaction_id']
+                limite = self._diferidos.get(transaction_id)
+                if registro.get('claimed_by'):
+                    self._diferidos.pop(transaction_id, None)
+                    self._diferidos_en_bd.discard(transaction_id)
+                    listos.append(registro)
+                elif limite is None:
+                    listos.append(registro)
+                elif ahora >= limite:
+                    del self._diferidos[transaction_id]
+                    listos.append(registro)
+                    logger.info(
+                        f"⏱ {self.name} - TransactionId {transaction_id} sin aviso de "
+                        f"transcripción tras {self.deferral_timeout}s, reintentando"
+                    )
+                else:
+                    diferidos.append(registro)
+            
+            for transaction_id, limite in list(self._diferidos.items()):
+                if ahora - limite > self.deferral_timeout and transaction_id not in self._retenidos:
+                    del self._diferidos[transaction_id]
+                    self._diferidos_en_bd.discard(transaction_id)
+        
+        return listos, diferidos
+    
+    def encolar_analisis(self, transaction_id, audio_path, transcription_path):
+        """
+        Encola un análisis recién transcrito para procesarlo sin esperar al
+        siguiente ciclo de polling
+        
+        El registro se reclama en BD (con su lease) antes de encolarlo, así
+        ninguna otra instancia lo analiza a la vez.
+        
+        Returns:
+            bool: True si se encoló, False si ya estaba en cola o no se pudo reclamar
+        """
+        registro = {
+            'transaction_id': transaction_id,
+            'audio_path': audio_path,
+            'transcription_path': transcription_path
+        }
+        self.despertar(transaction_id)
+        with self._lock:
+            if transaction_id in self._handoff_registros:
+                return False
+            self._handoff_registros[transaction_id] = registro
+            # Si estaba retenido ya es nuestro: no hay que reclamarlo
+            retenido = self._retenidos.pop(transaction_id, None)
+        
+        reclamado = retenido or self._reclamar_registro(registro, "analysis")
+        if reclamado is None:
+            with self._lock:
+                self._handoff_registros.pop(transaction_id, None)
+            logger.debug(
+                f"{self.name} - TransactionId {transaction_id} no reclamado para pipeline "
+                f"(ya lo tiene otro worker); queda para el polling"
+            )
+            return False
+        
+        with self._lock:
+            self._handoff_registros[transaction_id] = reclamado
+        self.handoff_queue.put(reclamado)
+        logger.debug(f"{self.name} - TransactionId {transaction_id} encolado en pipeline")
+        return True
+    
+    def _procesar_registro(self, registro):
+        """
+        Procesa un análisis (llega por polling o por la cola de pipeline)
+        
+        Args:
+            registro: Diccionario con transaction_id, audio_path y transcription_path
+        """
+        transaction_id = registro['transaction_id']
+        audio_path = registro['audio_path']
+        transcription_path = registro.get('transcription_path')
+        
+        logger.info(f"▶Procesando análisis: {transaction_id}")
+        
+        # Procesar con manejo de errores críticos vs warnings
+        try:
+            success, tokens_in, tokens_out = procesar_analisis(
+                transaction_id,
+                audio_path,
+                transcription_path,
+                cancelado=lambda: self._cancelado(transaction_id)
+            )
+            
+            if self._cancelado(transaction_id):
+                # Abandonado por stop(): sin escrituras finales
+                return
+            
+            if success:
+                self._increment_stat('processed')
+                self._clear_retry_on_success(transaction_id)
+                self._registrar_completado(registro)
+                logger.info(
+                    f"✓ Análisis {transaction_id} completado - "
+                    f"Tokens: IN={tokens_in} OUT={tokens_out}"
+                )
+            else:
+                # WARNING: No se encontró transcripción (probablemente aún no se creó)
+                # Esto es esperable - el TranscriptionPoller está trabajando en ello
+                self._increment_stat('warnings')
+                logger.warning(
+                    f"⚠ WARNING: TransactionId {transaction_id} - "
+                    f"Transcripción no disponible (esperando que se complete)"
+                )
+                # No limpiar retry tracker - se difiere hasta que llegue la transcripción
+                self._diferir(registro)
+        
+        except RuntimeError as e:
+            # ERROR CRÍTICO: Límite de tokens excedido
+            self._increment_stat('failed')
+            logger.error(f"✗ ERROR CRÍTICO: {e}")
+            is_error = self._update_retry_count(transaction_id, registro, error=e)
+            if is_error:
+                self._increment_stat('errors')
+        
+        except Exception as e:
+            # ERROR CRÍTICO: Excepción inesperada
+            self._increment_stat('failed')
+            logger.error(f"✗ ERROR CRÍTICO inesperado: {e}", exc_info=True)
+            is_error = self._update_retry_count(transaction_id, registro, error=e)
+            if is_error:
+                self._increment_stat('errors')
+    
+    def _enviar_a_lote(self, registros):
+        """
+        Envía los registros a un lote del proveedor
+        
+        Returns:
+            list: Registros que siguen por la vía interactiva
+        """
+        interactivos = self.batch_analyzer.enviar(registros)
+        self._increment_stat('batched', len(registros) - len(interactivos))
+        return interactivos
+    
+    def _procesar_lotes_terminados(self):
+        """Procesa los registros de los lotes que ya terminaron (respuestas en checkpoint)"""
+        for registro in self.batch_analyzer.recoger():
+            if self.stop_event.is_set():
+                self._liberar_si_reclamado(registro)
+                continue
+            self._ejecutar_registro(registro)
+    
+    def stop(self, drain_timeout=None):
+        """
+        Detiene el polling y devuelve a la cola los diferidos retenidos y los
+        registros que esperan su lote
+        """
+        super().stop(drain_timeout=drain_timeout)
+        
+        with self._lock:
+            retenidos = list(self._retenidos.values())
+            self._retenidos.clear()
+        for registro in retenidos:
+            self._liberar_si_reclamado(registro)
+        
+        if not self.batch_analyzer:
+            return
+        
+        en_lote = self.batch_analyzer.olvidar_pendientes()
+        for registro in en_lote:
+            self._liberar_si_reclamado(registro)
+        if en_lote and self.batch_analyzer.lote_en_bd():
+            logger.info(
+                f"{self.name} - {len(en_lote)} análisis en lotes en curso devueltos a la cola "
+                f"(cualquier instancia los retoma desde el lote registrado en BD)"
+            )
+        elif en_lote:
+            logger.warning(
+                f"⚠ {self.name} - {len(en_lote)} análisis en lotes en curso devueltos a la cola "
+                f"sin lote en BD: solo esta instancia los retoma desde su checkpoint"
+            )
+    
+    def get_stats(self):
+        """Retorna estadísticas, con los análisis diferidos en este momento"""
+        stats = super().get_stats()
+        with self._lock:
+            stats['deferred_now'] = len(self._diferidos)
+            stats['deferred_held'] = len(self._retenidos)
+        return stats
+    
+    def _atender_cola(self, timeout):
+        """
+        Espera hasta el siguiente ciclo de polling procesando mientras tanto
+        los análisis que lleguen por la cola de pipeline
+        
+        Args:
+            timeout: Segundos hasta el siguiente ciclo de polling
+        """
+        deadline = time.monotonic() + timeout
+        
+        while not self.stop_event.is_set():
+            remaining = deadline - time.monotonic()
+            
+            # Aunque el plazo sea 0 (backlog) se atiende lo que ya está en cola
+            try:
+                registro = self.handoff_queue.get(timeout=min(max(remaining, 0), 1))
+            except queue.Empty:
+                if remaining <= 0:
+                    break
+                continue
+            
+            transaction_id = registro['transaction_id']
+            try:
+                logger.info(f"⚡ {self.name} - Análisis vía pipeline: {transaction_id}")
+                self._increment_stat('pipeline')
+                self._ejecutar_registro(registro)
+            finally:
+                with self._lock:
+                    self._handoff_registros.pop(transaction_id, None)
+        
+        if self.stop_event.is_set() and not self.handoff_queue.empty():
+            # Se devuelven a 'Pendiente': el polling los retomará al reiniciar
+            sin_procesar = 0
+            while True:
+                try:
+                    registro = self.handoff_queue.get_nowait()
+                except queue.Empty:
+                    break
+                self._liberar_si_reclamado(registro)
+                with self._lock:
+                    self._handoff_registros.pop(registro['transaction_id'], None)
+                sin_procesar += 1
+            logger.info(
+                f"{self.name} - {sin_procesar} análisis en cola de pipeline "
+                f"devueltos a la cola para el siguiente arranque"
+            )
     
     def _polling_loop(self):
         logger.info("=" * 60)
         logger.info(f"{self.name} iniciado")
         logger.info(f"SP: {self.sp_get_pending}")
-        logger.info(f"Intervalo: {self.config.get('poll_interval_seconds', 30)}s")
-        logger.info(f"Máx por batch: {self.config.get('max_records_per_batch', 2)}")
+        logger.info(f"Intervalo: {self.poll_interval}s")
+        if self.adaptive_enabled:
+            logger.info(f"Intervalo adaptativo: 0s - {self.max_poll_interval}s")
+        logger.info(f"Máx por batch: {self.max_records_per_batch}")
         logger.info(f"Reintentos: {self.max_retries}")
-        logger.info("Sistema FIFO - Los más antiguos primero")
+        logger.info(f"Pipeline: {'✔ HABILITADO' if PIPELINE_MODE else '✖ DESHABILITADO'}")
+        logger.info(f"Diferido sin transcripción: máx {self.deferral_timeout}s")
+        if self.batch_analyzer:
+            logger.info(
+                f"Lotes: desde {self.batch_analyzer.min_records} pendientes "
+                f"(máx {self.batch_analyzer.max_records} por lote)"
+            )
+        logger.info(self._describir_politica())
         logger.info("=" * 60)
         
         cycle = 0
         
         while not self.stop_event.is_set():
             cycle += 1
-            self.stats['last_run'] = datetime.now()
+            with self._lock:
+                self.stats['last_run'] = datetime.now()
+            num_registros = None
             
             try:
                 if not PROCESSING_FEATURES.get('analysis_enabled', True):
                     logger.debug(f"{self.name} - Análisis deshabilitado, esperando...")
-                    self.stop_event.wait(self.config.get('poll_interval_seconds', 30))
+                    self.stop_event.wait(self.poll_interval)
                     continue
                 
-                # Obtener registros pendientes
-                registros = obtener_registros_pendientes(
-                    self.sp_get_pending,
-                    tipo_proceso="analysis"
-                )
+                if self.batch_analyzer:
+                    self._procesar_lotes_terminados()
+                
+                # Los diferidos no llegan en el claim (no-antes-de en BD): no se piden de más por ellos
+                extra = 0
+                if self.batch_analyzer and self._claim_lleno:
+                    # El claim anterior llegó lleno: hay backlog, se pide hasta un lote completo
+                    extra = max(0, self.batch_analyzer.max_records - self.max_records_per_batch)
+                registros = self._obtener_registros("analysis", extra=extra)
+                self._claim_lleno = len(registros) >= self.max_records_per_batch + extra
+                registros, diferidos = self._separar_diferidos(registros)
+                if self.batch_analyzer:
+                    # Los que ya están en un lote esperan su resultado, no se repiten en interactivo
+                    registros = self.batch_analyzer.retomar_en_curso(registros)
+                en_lote = bool(self.batch_analyzer) and len(registros) >= self.batch_analyzer.min_records
+                limite = self.batch_analyzer.max_records if en_lote else self.max_records_per_batch
+                sobrantes = registros[limite:]
+                registros = registros[:limite]
+                for registro in sobrantes:
+                    self._liberar_si_reclamado(registro)
+                if diferidos:
+                    logger.debug(
+                        f"{self.name} - {len(diferidos)} análisis diferidos esperando transcripción"
+                    )
+                num_registros = len(registros)
+                
+                # Omitir los que ya van por la vía pipeline; si el poll los
+                # reclamó, el claim pasa al registro en cola para liberarlo si falla
+                with self._lock:
+                    pendientes = []
+                    for registro in registros:
+                        en_cola = self._handoff_registros.get(registro['transaction_id'])
+                        if en_cola is None:
+                            pendientes.append(registro)
+                        elif registro.get('claimed_by'):
+                            en_cola['claimed_by'] = registro['claimed_by']
+                registros = pendientes
+                
+                if registros and en_lote:
+                    logger.info(
+                        f"📦 {self.name} - {len(registros)} análisis pendientes: envío en lote (ciclo {cycle})"
+                    )
+                    registros = self._enviar_a_lote(registros)
+                    # Lote fallido: solo se procesa en interactivo lo de un ciclo normal
+                    sobrantes = registros[self.max_records_per_batch:]
+                    registros = registros[:self.max_records_per_batch]
+                    for registro in sobrantes:
+                        self._liberar_si_reclamado(registro)
+                    if sobrantes:
+                        # El siguiente ciclo no vuelve a reclamar un lote completo de inmediato
+                        self._claim_lleno = False
+                        logger.info(
+                            f"{self.name} - {len(sobrantes)} análisis fuera del lote devueltos a la cola"
+                        )
                 
                 if registros:
                     logger.info(
                         f"📊 {self.name} - {len(registros)} análisis procesables (ciclo {cycle})"
                     )
                     
+                    # Con el driver asíncrono, las llamadas de todo el ciclo van a la vez
+                    adelantar_llamadas_analisis(registros)
+                    
                     for registro in registros:
                         if self.stop_event.is_set():
-                            break
-                        
-                        transaction_id = registro['transaction_id']
-                        audio_path = registro['audio_path']
-                        transcription_path = registro.get('transcription_path')
+                            self._liberar_si_reclamado(registro)
+                            continue
                         
-                        logger.info(f"▶Procesando análisis: {transaction_id}")
-                        
-                        # Procesar con manejo de errores críticos vs warnings
-                        try:
-                            success, tokens_in, tokens_out = procesar_analisis(
-                                transaction_id,
-                                audio_path,
-                                transcription_path
-                            )
-                            
-                            if success:
-                                self.stats['processed'] += 1
-                                self._clear_retry_on_success(transaction_id)
-                                logger.info(
-                                    f"✓ Análisis {transaction_id} completado - "
-                                    f"Tokens: IN={tokens_in} OUT={tokens_out}"
-                                )
-                            else:
-                                # WARNING: No se encontró transcripción (probablemente aún no se creó)
-                                # Esto es esperable - el TranscriptionPoller está trabajando en ello
-                                self.stats['warnings'] += 1
-                                logger.warning(
-                                    f"⚠ WARNING: TransactionId {transaction_id} - "
-                                    f"Transcripción no disponible (esperando que se complete)"
-                                )
-                                # No limpiar retry tracker - intentar de nuevo en el próximo ciclo
-                        
-                        except RuntimeError as e:
-                            # ERROR CRÍTICO: Límite de tokens excedido
-                            self.stats['failed'] += 1
-                            logger.error(f"✗ ERROR CRÍTICO: {e}")
-                            is_error = self._update_retry_count(transaction_id)
-                            if is_error:
-                                self.stats['errors'] += 1
-                        
-                        except Exception as e:
-                            # ERROR CRÍTICO: Excepción inesperada
-                            self.stats['failed'] += 1
-                            logger.error(f"✗ ERROR CRÍTICO inesperado: {e}", exc_info=True)
-                            is_error = self._update_retry_count(transaction_id)
-                            if is_error:
-                                self.stats['errors'] += 1
+                        self._ejecutar_registro(registro)
                         
                         time.sleep(2)  # Pausa entre procesos
                 else:
@@ -354,7 +1314,11 @@ class AnalysisPoller(BasePoller):
             if cycle % 20 == 0:
                 logger.info("\n" + token_manager.get_usage_summary())
             
-            self.stop_event.wait(self.config.get('poll_interval_seconds', 30))
+            # Si el ciclo falló se usa el intervalo base
+            if num_registros is None:
+                self._atender_cola(self.poll_interval)
+            else:
+                self._atender_cola(self._next_poll_interval(num_registros))
         
         logger.info(f"{self.name} detenido")
 
@@ -381,7 +1345,21 @@ def get_analysis_poller():
 
 
 def start_all_pollers():
-    """Inicia todos los pollers habilitados"""
+    """
+    Inicia todos los pollers habilitados
+    
+    Raises:
+        ConfiguracionASRInvalida: Si la transcripción está habilitada y el
+            motor de ASR configurado no se puede crear
+    """
+    if PROCESSING_FEATURES.get('transcription_enabled', True):
+        # Crear el motor antes de reclamar nada: una configuración inválida falla aquí
+        get_transcription_engine()
+    
+    lease_manager = get_lease_manager()
+    if lease_manager:
+        lease_manager.start()
+    
     if PROCESSING_FEATURES.get('transcription_enabled', True):
         get_transcription_poller().start()
     
@@ -389,13 +1367,31 @@ def start_all_pollers():
         get_analysis_poller().start()
 
 
-def stop_all_pollers():
-    """Detiene todos los pollers"""
-    if _transcription_poller:
-        _transcription_poller.stop()
+def stop_all_pollers(drain_timeout=None):
+    """
+    Detiene todos los pollers
     
-    if _analysis_poller:
-        _analysis_poller.stop()
+    Args:
+        drain_timeout: Plazo total (segundos) para drenar trabajos en curso
+    """
+    pollers = [poller for poller in (_transcription_poller, _analysis_poller) if poller]
+    
+    # Primero ninguno reclama más, luego se espera a cada uno con el plazo restante
+    for poller in pollers:
+        poller.request_stop()
+    
+    deadline = time.monotonic() + drain_timeout if drain_timeout is not None else None
+    for poller in pollers:
+        restante = None if deadline is None else max(0, deadline - time.monotonic())
+        poller.stop(drain_timeout=restante)
+    
+    # Sin workers de análisis ya no quedan llamadas al proveedor en vuelo
+    stop_llm_driver()
+    
+    # Los leases que queden activos vencerán en BD y otra instancia los retomará
+    lease_manager = get_lease_manager()
+    if lease_manager:
+        lease_manager.stop()
 
 
 def get_all_stats():
@@ -408,4 +1404,22 @@ def get_all_stats():
     if _analysis_poller:
         stats['analysis'] = _analysis_poller.get_stats()
     
+    lease_manager = get_lease_manager()
+    if lease_manager:
+        stats['leases'] = lease_manager.get_stats()
+    
+    transcription_cache = get_transcription_cache()
+    if transcription_cache:
+        stats['transcription_cache'] = transcription_cache.get_stats()
+    
+    stats['audio_probe'] = get_probe_stats()
+    
+    driver_stats = get_llm_driver_stats()
+    if driver_stats:
+        stats['llm_driver'] = driver_stats
+    
+    batch_stats = get_batch_stats()
+    if batch_stats:
+        stats['batch_analysis'] = batch_stats
+    
     return stats
\ No newline at end of file
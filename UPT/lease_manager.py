@@ -0,0 +1,145 @@
+"""
+Leases de registros reclamados para operar varias instancias sobre la misma cola
+Cada TransactionId reclamado tiene un vencimiento en BD que este worker renueva
+mientras lo procesa; si la instancia cae, el lease vence y el registro vuelve
+a la cola sin intervención manual.
+"""
+import threading
+from datetime import datetime
+from log import get_logger
+from sql_connection import renovar_lease, liberar_leases_expirados
+
+logger = get_logger()
+
+
+class LeaseManager:
+    """Mantiene vivos (heartbeat) los leases de los registros en proceso"""
+    
+    def __init__(self, worker_id, lease_seconds=300, heartbeat_seconds=60,
+                 sp_renew="RenewTransactionLease", sp_release_expired="ReleaseExpiredLeases"):
+        """
+        Args:
+            worker_id: Identidad de esta instancia
+            lease_seconds: Duración del lease en BD
+            heartbeat_seconds: Cada cuánto se renuevan los leases
+            sp_renew: SP que extiende el lease (@TransactionId, @WorkerId, @LeaseSeconds)
+            sp_release_expired: SP que devuelve a 'Pendiente' los leases vencidos
+        """
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+        self.sp_renew = sp_renew
+        self.sp_release_expired = sp_release_expired
+        # Leases activos: {transaction_id: {'owner': str, 'since': datetime}}
+        self._leases = {}
+        self._lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.heartbeat_thread = None
+        self.stats = {
+            'renewed': 0,
+            'renew_failures': 0,
+            'last_heartbeat': None
+        }
+    
+    def adquirir(self, transaction_id, owner):
+        """Registra un lease recién obtenido por el SP de claim"""
+        with self._lock:
+            self._leases[transaction_id] = {'owner': owner, 'since': datetime.now()}
+    
+    def soltar(self, transaction_id, owner=None):
+        """
+        Deja de renovar el lease (registro completado o liberado)
+        
+        Args:
+            owner: Si se indica, solo se suelta si el lease es suyo (el mismo
+                TransactionId puede pasar de transcripción a análisis en el pipeline)
+        """
+        with self._lock:
+            lease = self._leases.get(transaction_id)
+            if lease is not None and (owner is None or lease['owner'] == owner):
+                del self._leases[transaction_id]
+    
+    def get_active(self):
+        """Retorna los TransactionIds con lease activo"""
+        with self._lock:
+            return list(self._leases)
+    
+    def _heartbeat(self):
+        """Renueva todos los leases activos y recupera los vencidos de otras instancias"""
+        for transaction_id in self.get_active():
+            if renovar_lease(self.sp_renew, transaction_id, self.worker_id, self.lease_seconds):
+                self.stats['renewed'] += 1
+            else:
+                self.stats['renew_failures'] += 1
+                logger.warning(
+                    f"⚠ [{self.worker_id}] No se pudo renovar el lease de {transaction_id}"
+                )
+        
+        liberar_leases_expirados(self.sp_release_expired)
+        self.stats['last_heartbeat'] = datetime.now()
+    
+    def _heartbeat_loop(self):
+        logger.info(
+            f"LeaseManager iniciado - Worker: {self.worker_id} | "
+            f"Lease: {self.lease_seconds}s | Heartbeat: {self.heartbeat_seconds}s"
+        )
+        
+        while not self.stop_event.wait(self.heartbeat_seconds):
+            try:
+                self._heartbeat()
+            except Exception as e:
+                logger.error(f"Error en heartbeat de leases: {e}", exc_info=True)
+        
+        logger.info("LeaseManager detenido")
+    
+    def start(self):
+        """Inicia el heartbeat"""
+        if self.heartbeat_thread and self.heartbeat_thread.is_alive():
+            return
+        
+        self.stop_event.clear()
+        self.heartbeat_thread = threading.Thread(
+            target=self._heartbeat_loop,
+            daemon=True,
+            name="LeaseHeartbeatThread"
+        )
+        self.heartbeat_thread.start()
+    
+    def stop(self):
+        """Detiene el heartbeat"""
+        self.stop_event.set()
+        if self.heartbeat_thread:
+            self.heartbeat_thread.join(timeout=10)
+    
+    def get_stats(self):
+        """Retorna estadísticas de leases"""
+        stats = self.stats.copy()
+        stats['active'] = len(self.get_active())
+        return stats
+
+
+# Instancia global
+_lease_manager = None
+
+
+def get_lease_manager():
+    """
+    Obtiene la instancia del lease manager
+    
+    Returns:
+        LeaseManager o None si los leases están deshabilitados
+    """
+    global _lease_manager
+    if _lease_manager is None:
+        from connection_settings import SQL_POLLING_CONFIG, WORKER_ID
+        lease_cfg = SQL_POLLING_CONFIG.get('leases', {})
+        if not lease_cfg.get('enabled', False):
+            return None
+        _lease_manager = LeaseManager(
+            worker_id=WORKER_ID,
+            lease_seconds=lease_cfg.get('lease_seconds', 300),
+            heartbeat_seconds=lease_cfg.get('heartbeat_seconds', 60),
+            sp_renew=lease_cfg.get('sp_renew', 'RenewTransactionLease'),
+            sp_release_expired=lease_cfg.get('sp_release_expired', 'ReleaseExpiredLeases')
+        )
+    return _lease_manager
@@ -0,0 +1,147 @@
+"""
+Driver asíncrono de llamadas al proveedor de IA
+Un único hilo con un bucle asyncio mantiene en vuelo muchas peticiones a la
+vez sobre el cliente asíncrono del proveedor (un pool de conexiones HTTP
+compartido), en lugar de ocupar un hilo bloqueado por cada llamada. Un
+semáforo limita las peticiones en vuelo; los workers envían desde sus
+propios hilos y reciben un Future.
+"""
+import asyncio
+import threading
+from log import get_logger
+
+logger = get_logger()
+
+
+class AsyncLLMDriver:
+    """Bucle asyncio en segundo plano que atiende las llamadas de todos los workers"""
+    
+    def __init__(self, crear_proveedor, max_in_flight=32):
+        """
+        Args:
+            crear_proveedor: Función sin argumentos que devuelve un AsyncAIProvider;
+                se llama dentro del bucle porque el cliente HTTP queda ligado a él
+            max_in_flight: Máximo de peticiones simultáneas al proveedor
+        """
+        self.max_in_flight = max(1, int(max_in_flight))
+        self._lock = threading.Lock()
+        self.stats = {'submitted': 0, 'completed': 0, 'failed': 0, 'in_flight': 0, 'peak_in_flight': 0}
+        
+        self._loop = asyncio.new_event_loop()
+        self._hilo = threading.Thread(target=self._loop.run_forever, name="llm-async", daemon=True)
+        self._hilo.start()
+        
+        async def iniciar():
+            return crear_proveedor(), asyncio.Semaphore(self.max_in_flight)
+        
+        self.provider, self._semaforo = asyncio.run_coroutine_threadsafe(iniciar(), self._loop).result()
+        logger.info(
+            f"✓ Driver asíncrono de IA iniciado ({self.provider.get_provider_name()}, "
+            f"máx. {self.max_in_flight} en vuelo)"
+        )
+    
+    async def _llamar(self, prompt, max_tokens, esquema, cached_prefix):
+        async with self._semaforo:
+            with self._lock:
+                self.stats['in_flight'] += 1
+                self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.stats['in_flight'])
+            try:
+                if esquema is None:
+                    return await self.provider.generate_response(
+                        prompt, max_tokens=max_tokens, cached_prefix=cached_prefix
+                    )
+                return await self.provider.generate_structured(
+                    prompt, esquema, max_tokens=max_tokens, cached_prefix=cached_prefix
+                )
+            finally:
+                with self._lock:
+                    self.stats['in_flight'] -= 1
+    
+    def _contar(self, futuro):
+        with self._lock:
+            if futuro.cancelled() or futuro.exception() is not None:
+                self.stats['failed'] += 1
+            else:
+                self.stats['completed'] += 1
+    
+    def submit(self, prompt, max_tokens=4000, esquema=None, cached_prefix=None):
+        """
+        Encola una llamada sin bloquear (seguro desde cualquier hilo)
+        
+        Args:
+            esquema: JSON Schema de la respuesta; con él se usa generate_structured
+            cached_prefix: Prefijo estático cacheable (ver AsyncAIProvider)
+        
+        Returns:
+            concurrent.futures.Future con (respuesta, tokens_in, tokens_out, tokens_cache)
+        """
+        with self._lock:
+            self.stats['submitted'] += 1
+        futuro = asyncio.run_coroutine_threadsafe(
+            self._llamar(prompt, max_tokens, esquema, cached_prefix), self._loop
+        )
+        futuro.add_done_callback(self._contar)
+        return futuro
+    
+    def generar(self, prompt, max_tokens=4000, esquema=None, cached_prefix=None):
+        """Igual que submit, pero espera el resultado"""
+        return self.submit(prompt, max_tokens=max_tokens, esquema=esquema, cached_prefix=cached_prefix).result()
+    
+    def get_stats(self):
+        """
+        Returns:
+            dict: submitted, completed, failed, in_flight, peak_in_flight, max_in_flight
+        """
+        with self._lock:
+            stats = self.stats.copy()
+        stats['max_in_flight'] = self.max_in_flight
+        return stats
+    
+    def close(self, timeout=10):
+        """Cierra el pool de conexiones y detiene el bucle"""
+        if not self._loop.is_running():
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self.provider.close(), self._loop).result(timeout)
+        except Exception as e:
+            logger.warning(f"⚠ Error cerrando el cliente asíncrono de IA: {e}")
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._hilo.join(timeout)
+
+
+# Instancia global
+_llm_driver = None
+_llm_driver_lock = threading.Lock()
+
+
+def get_llm_driver():
+    """Obtiene el driver asíncrono (None si analysis_settings.async_clients está deshabilitado)"""
+    global _llm_driver
+    with _llm_driver_lock:
+        if _llm_driver is None:
+            from connection_settings import ANALYSIS_SETTINGS
+            async_cfg = ANALYSIS_SETTINGS.get('async_clients', {})
+            if not async_cfg.get('enabled', False):
+                return None
+            from analysis import get_async_ai_provider
+            max_connections = async_cfg.get('max_connections', 32)
+            _llm_driver = AsyncLLMDriver(
+                lambda: get_async_ai_provider(max_connections=max_connections),
+                max_in_flight=async_cfg.get('max_in_flight', 32)
+            )
+    return _llm_driver
+
+
+def get_llm_driver_stats():
+    """Estadísticas del driver, o None si no se ha creado"""
+    with _llm_driver_lock:
+        return _llm_driver.get_stats() if _llm_driver is not None else None
+
+
+def stop_llm_driver():
+    """Detiene el driver si se llegó a crear"""
+    global _llm_driver
+    with _llm_driver_lock:
+        if _llm_driver is not None:
+            _llm_driver.close()
+            _llm_driver = None
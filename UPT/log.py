@@ -4,6 +4,19 @@ import os
 from datetime import datetime
 import traceback
 
+
+class WorkerFilter(logging.Filter):
+    """Agrega la identidad del worker a cada registro de log"""
+    
+    def __init__(self):
+        super().__init__()
+        self.worker_id = "-"
+    
+    def filter(self, record):
+        record.worker_id = self.worker_id
+        return True
+
+
 class LogManager:
     """Sistema de logging mejorado con rotación diaria"""
     
@@ -14,6 +27,7 @@ class LogManager:
         # Logger principal
         self.logger = logging.getLogger("AIEvaluator")
         self.logger.setLevel(logging.DEBUG)
+        self.worker_filter = WorkerFilter()
         
         # Evitar duplicados
         if self.logger.handlers:
@@ -36,15 +50,21 @@ class LogManager:
         
         # Formato de logs
         formatter = logging.Formatter(
-            '[%(asctime)s] [%(levelname)s] [%(funcName)s] %(message)s',
+            '[%(asctime)s] [%(levelname)s] [%(worker_id)s] [%(funcName)s] %(message)s',
             datefmt='%Y-%m-%d %H:%M:%S'
         )
         file_handler.setFormatter(formatter)
         console_handler.setFormatter(formatter)
+        file_handler.addFilter(self.worker_filter)
+        console_handler.addFilter(self.worker_filter)
         
         self.logger.addHandler(file_handler)
         self.logger.addHandler(console_handler)
     
+    def set_worker_id(self, worker_id):
+        """Define la identidad del worker que aparece en cada línea de log"""
+        self.worker_filter.worker_id = worker_id
+    
     def info(self, msg):
         """Registra información general"""
         self.logger.info(msg)
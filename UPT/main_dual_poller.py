@@ -1,5 +1,4 @@
 import threading
-import time
 import sys
 
 from dual_poller_system import (
@@ -11,10 +10,11 @@ from dual_poller_system import (
 )
 from debug_mode import run_debug_once
 from signals_handler import register_signals
-from connection_settings import SQL_POLLING_CONFIG, PROCESSING_FEATURES
+from connection_settings import SQL_POLLING_CONFIG, PROCESSING_FEATURES, WORKER_ID
 from log import get_logger
 from recovery_system import get_watchdog
 from token_manager import get_token_manager
+from metrics import ETAPAS
 
 logger = get_logger()
 token_manager = get_token_manager()
@@ -31,9 +31,13 @@ def main():
         logger.error("=" * 60)
         return 1
     
+    # Identidad de la instancia en cada línea de log
+    logger.set_worker_id(WORKER_ID)
+    
     logger.info("=" * 60)
     logger.info("AI EVALUATOR - SISTEMA DUAL DE POLLING")
     logger.info("=" * 60)
+    logger.info(f"Worker: {WORKER_ID}")
     logger.info(f"Transcripción: {'✔ HABILITADA' if PROCESSING_FEATURES.get('transcription_enabled') else '✖ DESHABILITADA'}")
     logger.info(f"Análisis: {'✔ HABILITADO' if PROCESSING_FEATURES.get('analysis_enabled') else '✖ DESHABILITADO'}")
     logger.info("=" * 60)
@@ -90,8 +94,8 @@ def main():
     
     try:
         cycle = 0
-        while not main_stop.is_set():
-            time.sleep(60)  # Cada minuto
+        # Cada minuto (despierta de inmediato si llega una señal de parada)
+        while not main_stop.wait(60):
             cycle += 1
             
             # Cada 10 minutos, mostrar estadísticas
@@ -102,6 +106,11 @@ def main():
                 
                 # Estadísticas de pollers
                 stats = get_all_stats()
+                lease_stats = stats.pop('leases', None)
+                cache_stats = stats.pop('transcription_cache', None)
+                probe_stats = stats.pop('audio_probe', None)
+                driver_stats = stats.pop('llm_driver', None)
+                batch_stats = stats.pop('batch_analysis', None)
                 for poller_name, data in stats.items():
                     logger.info(
                         f"  {poller_name.upper()}: "
@@ -110,6 +119,66 @@ def main():
                         f"Errores={data.get('errors', 0)} | "
                         f"Warnings={data.get('warnings', 0)}"
                     )
+                    espera = data.get('queue_wait', {})
+                    simulada = data.get('queue_wait_simulated', {})
+                    logger.info(
+                        f"    Espera en cola ({data.get('scheduling_policy', 'fifo')}): "
+                        f"media={espera.get('mean', 0)}s p95={espera.get('p95', 0)}s | "
+                        + " | ".join(
+                            f"simulada {politica}: media={r['mean']}s p95={r['p95']}s"
+                            for politica, r in simulada.items()
+                        )
+                    )
+                    metricas = data.get('metrics', {})
+                    etapas = metricas.get('stages', {})
+                    logger.info(
+                        f"    Ritmo: {metricas.get('records_per_minute', 0)} reg/min | "
+                        f"{metricas.get('audio_minutes_per_minute', 0)} min audio/min"
+                        + "".join(
+                            f" | {etapa}: p50={etapas[etapa]['p50']}s "
+                            f"p95={etapas[etapa]['p95']}s p99={etapas[etapa]['p99']}s"
+                            for etapa in ETAPAS if etapa in etapas
+                        )
+                    )
+                
+                if lease_stats:
+                    logger.info(
+                        f"  LEASES: Activos={lease_stats['active']} | "
+                        f"Renovados={lease_stats['renewed']} | "
+                        f"Fallos de renovación={lease_stats['renew_failures']}"
+                    )
+                
+                if cache_stats:
+                    logger.info(
+                        f"  CACHÉ TRANSCRIPCIONES: Aciertos={cache_stats['hits']} | "
+                        f"Fallos={cache_stats['misses']} | "
+                        f"Tasa={cache_stats['hit_rate']:.1%} | "
+                        f"Entradas={cache_stats['entries']}"
+                    )
+                
+                if probe_stats:
+                    logger.info(
+                        f"  SONDEO DE AUDIO: Aciertos={probe_stats['hits']} | "
+                        f"Fallos={probe_stats['misses']} | "
+                        f"Entradas={probe_stats['entries']}"
+                    )
+                
+                if driver_stats:
+                    logger.info(
+                        f"  DRIVER IA ASÍNCRONO: Enviadas={driver_stats['submitted']} | "
+                        f"Completadas={driver_stats['completed']} | "
+                        f"En vuelo={driver_stats['in_flight']} | "
+                        f"Pico={driver_stats['peak_in_flight']}/{driver_stats['max_in_flight']}"
+                    )
+                
+                if batch_stats:
+                    logger.info(
+                        f"  LOTES DE ANÁLISIS: Enviados={batch_stats['batches_submitted']} | "
+                        f"Terminados={batch_stats['batches_completed']} | "
+                        f"En curso={batch_stats['batches_in_flight']} ({batch_stats['records_in_flight']} registros) | "
+                        f"Peticiones OK={batch_stats['requests_succeeded']} | "
+                        f"Sin respuesta={batch_stats['requests_failed']}"
+                    )
                 
                 # Estadísticas de watchdog
                 watchdog_stats = watchdog.get_stats()
@@ -134,11 +203,17 @@ def main():
         logger.info("=" * 60)
         
         watchdog.stop()
-        stop_all_pollers()
+        # Drenado: sin nuevos claims, los trabajos en curso terminan hasta el plazo
+        drain_timeout = SQL_POLLING_CONFIG.get('drain_timeout_seconds', 120)
+        logger.info(f"Esperando trabajos en curso (máx {drain_timeout}s)...")
+        stop_all_pollers(drain_timeout=drain_timeout)
         
         # Mostrar estadísticas finales
         logger.info("\nESTADÍSTICAS FINALES:")
         stats = get_all_stats()
+        # Secciones auxiliares que no son pollers (como en el resumen periódico)
+        for clave in ('leases', 'transcription_cache', 'audio_probe', 'llm_driver', 'batch_analysis'):
+            stats.pop(clave, None)
         for poller_name, data in stats.items():
             logger.info(
                 f"  {poller_name.upper()}:"
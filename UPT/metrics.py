@@ -0,0 +1,153 @@
+"""
+Métricas de rendimiento por poller y por etapa
+Latencias en ventana móvil (p50/p95/p99) de cada etapa del procesamiento
+(conversión de audio, también por vía: WAV en proceso o ffmpeg; ASR, LLM,
+escritura de archivos y de BD) y tasas de registros y minutos de audio por
+minuto de reloj.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+ETAPAS = ("conversion", "conversion_wav", "conversion_ffmpeg", "asr", "llm", "file_write", "db_write")
+POLLER_GENERAL = "general"
+
+
+def _percentil(ordenadas, p):
+    """Percentil por rango más cercano sobre una lista ya ordenada"""
+    indice = min(len(ordenadas) - 1, int(round(p * (len(ordenadas) - 1))))
+    return ordenadas[indice]
+
+
+class MetricsRegistry:
+    """Registro thread-safe de latencias por etapa y throughput por poller"""
+    
+    def __init__(self, window_seconds=600, max_samples=1000):
+        """
+        Args:
+            window_seconds: Ventana de las tasas por minuto
+            max_samples: Muestras de latencia retenidas por poller y etapa
+        """
+        self.window_seconds = window_seconds
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._inicio = time.time()
+        # {poller: {etapa: deque[segundos]}}
+        self._latencias = defaultdict(dict)
+        # {poller: deque[(epoch, segundos_de_audio)]}
+        self._completados = defaultdict(deque)
+        # Poller al que se atribuyen las etapas medidas en cada hilo
+        self._contexto = threading.local()
+    
+    @contextmanager
+    def contexto_poller(self, poller):
+        """Atribuye a 'poller' las etapas medidas en este hilo mientras dure el bloque"""
+        anterior = getattr(self._contexto, 'poller', None)
+        self._contexto.poller = poller
+        try:
+            yield
+        finally:
+            self._contexto.poller = anterior
+    
+    def poller_actual(self):
+        """Poller asociado al hilo actual"""
+        return getattr(self._contexto, 'poller', None) or POLLER_GENERAL
+    
+    def registrar(self, etapa, segundos, poller=None):
+        """Registra la latencia de una etapa"""
+        poller = poller or self.poller_actual()
+        with self._lock:
+            muestras = self._latencias[poller].get(etapa)
+            if muestras is None:
+                muestras = self._latencias[poller][etapa] = deque(maxlen=self.max_samples)
+            muestras.append(segundos)
+    
+    @contextmanager
+    def medir(self, etapa, poller=None):
+        """
+        Mide la duración del bloque como una muestra de la etapa
+        
+        Uso:
+            with metrics.medir('asr'):
+                texto = recognizer.recognize_google(audio_data)
+        """
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.registrar(etapa, time.perf_counter() - inicio, poller)
+    
+    def registrar_completado(self, poller, audio_segundos=0):
+        """Registra un registro terminado y la duración del audio que cubría"""
+        ahora = time.time()
+        with self._lock:
+            completados = self._completados[poller]
+            completados.append((ahora, audio_segundos or 0))
+            self._purgar(completados, ahora)
+    
+    def _purgar(self, completados, ahora):
+        """Descarta completados fuera de la ventana (requiere _lock)"""
+        limite = ahora - self.window_seconds
+        while completados and completados[0][0] < limite:
+            completados.popleft()
+    
+    def get_stats(self, poller):
+        """
+        Returns:
+            dict: {
+                'stages': {etapa: {'count', 'mean', 'p50', 'p95', 'p99'}},
+                'records_per_minute': float,
+                'audio_minutes_per_minute': float
+            }
+        """
+        ahora = time.time()
+        with self._lock:
+            latencias = {
+                etapa: sorted(muestras)
+                for etapa, muestras in self._latencias.get(poller, {}).items()
+            }
+            completados = self._completados.get(poller)
+            if completados is not None:
+                self._purgar(completados, ahora)
+                completados = list(completados)
+            else:
+                completados = []
+        
+        etapas = {}
+        for etapa, ordenadas in latencias.items():
+            if not ordenadas:
+                continue
+            etapas[etapa] = {
+                'count': len(ordenadas),
+                'mean': round(sum(ordenadas) / len(ordenadas), 3),
+                'p50': round(_percentil(ordenadas, 0.50), 3),
+                'p95': round(_percentil(ordenadas, 0.95), 3),
+                'p99': round(_percentil(ordenadas, 0.99), 3)
+            }
+        
+        # Con menos tiempo en marcha que la ventana, la tasa se calcula sobre lo transcurrido
+        minutos = max(min(self.window_seconds, ahora - self._inicio), 1) / 60
+        audio_minutos = sum(audio for _, audio in completados) / 60
+        return {
+            'stages': etapas,
+            'records_per_minute': round(len(completados) / minutos, 2),
+            'audio_minutes_per_minute': round(audio_minutos / minutos, 2)
+        }
+
+
+# Instancia global
+_metrics = None
+
+
+def get_metrics():
+    """Obtiene la instancia global del registro de métricas"""
+    global _metrics
+    if _metrics is None:
+        from connection_settings import SQL_POLLING_CONFIG
+        cfg = SQL_POLLING_CONFIG.get('metrics', {})
+        _metrics = MetricsRegistry(
+            window_seconds=cfg.get('window_seconds', 600),
+            max_samples=cfg.get('max_samples', 1000)
+        )
+    return _metrics
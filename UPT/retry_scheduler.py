@@ -0,0 +1,175 @@
+"""
+Cola persistente de reintentos diferidos con backoff exponencial
+Guarda en un SQLite local los intentos fallidos y el momento del próximo
+intento, de modo que sobrevive a reinicios y no reintenta en ciclos seguidos.
+"""
+import os
+import random
+import sqlite3
+import threading
+import time
+from log import get_logger
+
+logger = get_logger()
+
+
+class RetryScheduler:
+    """Programa reintentos con backoff exponencial + jitter en SQLite"""
+    
+    def __init__(self, db_path, base_delay_seconds=60, max_delay_seconds=3600,
+                 jitter=0.25, retention_days=7):
+        """
+        Args:
+            db_path: Ruta del archivo SQLite
+            base_delay_seconds: Espera tras el primer fallo
+            max_delay_seconds: Tope de espera entre intentos
+            jitter: Variación aleatoria relativa (0.25 = ±25%)
+            retention_days: Entradas sin actividad más antiguas se purgan
+        """
+        self.db_path = db_path
+        self.base_delay_seconds = base_delay_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self.jitter = jitter
+        self._lock = threading.Lock()
+        
+        directorio = os.path.dirname(db_path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS retry_queue (
+                    poller TEXT NOT NULL,
+                    transaction_id INTEGER NOT NULL,
+                    attempts INTEGER NOT NULL,
+                    next_attempt_at REAL NOT NULL,
+                    last_error TEXT,
+                    updated_at REAL NOT NULL,
+                    PRIMARY KEY (poller, transaction_id)
+                )
+                """
+            )
+            purgados = self._conn.execute(
+                "DELETE FROM retry_queue WHERE updated_at < ?",
+                (time.time() - retention_days * 86400,)
+            ).rowcount
+        
+        if purgados:
+            logger.info(f"RetryScheduler - {purgados} reintentos antiguos purgados")
+    
+    def _calcular_espera(self, attempts):
+        """Backoff exponencial con jitter para el intento N"""
+        espera = min(self.base_delay_seconds * (2 ** (attempts - 1)), self.max_delay_seconds)
+        return espera * (1 + random.uniform(-self.jitter, self.jitter))
+    
+    def registrar_fallo(self, poller, transaction_id, error="", min_attempts=0):
+        """
+        Registra un fallo y programa el siguiente intento
+        
+        Args:
+            poller: Nombre del poller
+            transaction_id: ID de la transacción
+            error: Descripción del error
+            min_attempts: Intentos ya conocidos por otra fuente (p.ej. ReintentoCount de BD)
+        
+        Returns:
+            tuple: (attempts: int, next_attempt_at: float epoch)
+        """
+        ahora = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT attempts FROM retry_queue WHERE poller = ? AND transaction_id = ?",
+                (poller, transaction_id)
+            ).fetchone()
+            attempts = max(row[0] if row else 0, min_attempts) + 1
+            next_attempt_at = ahora + self._calcular_espera(attempts)
+            
+            self._conn.execute(
+                """
+                INSERT OR REPLACE INTO retry_queue
+                    (poller, transaction_id, attempts, next_attempt_at, last_error, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                (poller, transaction_id, attempts, next_attempt_at, str(error)[:500], ahora)
+            )
+        return attempts, next_attempt_at
+    
+    def separar_no_vencidos(self, poller, registros):
+        """
+        Separa los registros cuyo reintento aún no toca
+        
+        Args:
+            poller: Nombre del poller
+            registros: Lista de registros con 'transaction_id'
+        
+        Returns:
+            tuple: (listos: list, diferidos: list)
+        """
+        if not registros:
+            return [], []
+        
+        ids = [r['transaction_id'] for r in registros]
+        placeholders = ", ".join(["?"] * len(ids))
+        with self._lock:
+            rows = self._conn.execute(
+                f"""
+                SELECT transaction_id FROM retry_queue
+                WHERE poller = ? AND next_attempt_at > ? AND transaction_id IN ({placeholders})
+                """,
+                [poller, time.time(), *ids]
+            ).fetchall()
+        no_vencidos = {row[0] for row in rows}
+        
+        listos = [r for r in registros if r['transaction_id'] not in no_vencidos]
+        diferidos = [r for r in registros if r['transaction_id'] in no_vencidos]
+        return listos, diferidos
+    
+    def limpiar(self, poller, transaction_id):
+        """
+        Elimina el registro de la cola (éxito o error definitivo)
+        
+        Returns:
+            bool: True si había reintentos registrados
+        """
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "DELETE FROM retry_queue WHERE poller = ? AND transaction_id = ?",
+                (poller, transaction_id)
+            ).rowcount > 0
+    
+    def get_stats(self, poller):
+        """Retorna cuántos registros esperan reintento y cuántos ya tocan"""
+        with self._lock:
+            total, vencidos = self._conn.execute(
+                """
+                SELECT COUNT(*), COALESCE(SUM(CASE WHEN next_attempt_at <= ? THEN 1 ELSE 0 END), 0)
+                FROM retry_queue WHERE poller = ?
+                """,
+                (time.time(), poller)
+            ).fetchone()
+        return {'retry_scheduled': total, 'retry_due': vencidos}
+
+
+# Instancia global
+_retry_scheduler = None
+
+
+def get_retry_scheduler():
+    """Obtiene la instancia del scheduler de reintentos"""
+    global _retry_scheduler
+    if _retry_scheduler is None:
+        from connection_settings import BASE_DIR, SQL_POLLING_CONFIG
+        retry_cfg = SQL_POLLING_CONFIG.get('retry_queue', {})
+        db_path = retry_cfg.get('db_path', os.path.join('state', 'retry_queue.db'))
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(BASE_DIR, db_path)
+        _retry_scheduler = RetryScheduler(
+            db_path=db_path,
+            base_delay_seconds=retry_cfg.get('base_delay_seconds', 60),
+            max_delay_seconds=retry_cfg.get('max_delay_seconds', 3600),
+            jitter=retry_cfg.get('jitter', 0.25),
+            retention_days=retry_cfg.get('retention_days', 7)
+        )
+    return _retry_scheduler
@@ -0,0 +1,107 @@
+"""
+Políticas de orden para el trabajo reclamado por los pollers
+- fifo: orden de llegada (comportamiento original)
+- sjf: más corto primero según la duración del audio, con envejecimiento
+  para que las llamadas largas no esperen indefinidamente
+
+Con SP de claim la BD entrega los registros en orden de llegada y sjf solo
+reordena dentro de cada batch reclamado (max_records_per_batch), que además
+se espera completo antes del siguiente claim; el efecto sobre la espera
+global es pequeño. Sobre toda la cola solo actúa en la vía sin claim. La
+espera usada para el envejecimiento sale de FechaEncolado cuando la BD la
+entrega.
+"""
+import heapq
+from audio_probe import probar_audio
+from log import get_logger
+
+logger = get_logger()
+
+POLITICAS = ("fifo", "sjf")
+
+
+def leer_duracion_audio(ruta):
+    """
+    Duración del audio leyendo solo la cabecera (ver audio_probe.probar_audio)
+    Si el formato no se reconoce se estima por tamaño de archivo.
+    
+    Returns:
+        float: Duración en segundos (None si el archivo no existe)
+    """
+    info = probar_audio(ruta)
+    return info['duration'] if info else None
+
+
+def _duracion_registro(registro):
+    """Duración del audio del registro, calculada una sola vez"""
+    if 'audio_duration' not in registro:
+        registro['audio_duration'] = leer_duracion_audio(registro['audio_path'])
+    return registro['audio_duration']
+
+
+def ordenar_registros(registros, politica="fifo", aging_factor=1.0, esperas=None):
+    """
+    Ordena los registros según la política
+    
+    Con sjf la prioridad es duración - aging_factor * segundos_esperando:
+    cada segundo en cola descuenta aging_factor segundos de audio, así una
+    llamada larga termina adelantando a las cortas que llegan después.
+    
+    Args:
+        registros: Registros en orden FIFO
+        politica: "fifo" o "sjf"
+        aging_factor: Segundos de audio descontados por segundo de espera
+        esperas: Dict {transaction_id: segundos en cola}
+    
+    Returns:
+        list: Registros ordenados (estable: a igual prioridad se respeta FIFO)
+    """
+    if politica != "sjf":
+        return list(registros)
+    
+    esperas = esperas or {}
+    
+    def prioridad(registro):
+        duracion = _duracion_registro(registro)
+        if duracion is None:
+            # Sin archivo: que falle pronto y no ocupe un hueco largo
+            duracion = 0
+        return duracion - aging_factor * esperas.get(registro['transaction_id'], 0)
+    
+    return sorted(registros, key=prioridad)
+
+
+def simular_esperas(duraciones, workers=1):
+    """
+    Simula la espera en cola de cada trabajo atendido en el orden dado
+    
+    Args:
+        duraciones: Duraciones (segundos) en orden de atención
+        workers: Trabajos simultáneos
+    
+    Returns:
+        list: Espera de cada trabajo hasta iniciar
+    """
+    libres = [0.0] * max(1, workers)
+    esperas = []
+    for duracion in duraciones:
+        inicio = heapq.heappop(libres)
+        esperas.append(inicio)
+        heapq.heappush(libres, inicio + (duracion or 0))
+    return esperas
+
+
+def resumir_esperas(esperas):
+    """
+    Returns:
+        dict: {'mean': float, 'p95': float, 'count': int}
+    """
+    if not esperas:
+        return {'mean': 0.0, 'p95': 0.0, 'count': 0}
+    ordenadas = sorted(esperas)
+    indice = min(len(ordenadas) - 1, int(round(0.95 * (len(ordenadas) - 1))))
+    return {
+        'mean': round(sum(ordenadas) / len(ordenadas), 2),
+        'p95': round(ordenadas[indice], 2),
+        'count': len(ordenadas)
+    }
@@ -0,0 +1,184 @@
+"""
+Segmentación por actividad de voz (VAD por energía)
+Divide el PCM de 16 bits en segmentos de voz cortando en las pausas, con un
+tope de duración por segmento (límite del ASR) y descartando silencios y
+tramos sin voz. Sin NumPy cae a cortes fijos de duración máxima.
+Incluye un pre-chequeo vectorizado que descarta el audio sin voz antes de
+cualquier petición al ASR.
+"""
+from log import get_logger
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logger = get_logger()
+
+if np is None:
+    logger.warning("⚠ NumPy no disponible: la segmentación por voz usa cortes fijos")
+
+
+def cortes_fijos(num_muestras, sample_rate, max_segment_seconds):
+    """
+    Segmentos consecutivos de duración máxima (comportamiento sin VAD)
+    
+    Returns:
+        list: [(inicio, fin)] en muestras
+    """
+    paso = int(max_segment_seconds * sample_rate)
+    return [(inicio, min(inicio + paso, num_muestras)) for inicio in range(0, num_muestras, paso)]
+
+
+def _rms_por_frame(pcm, sample_rate, frame_ms):
+    """RMS de cada frame completo del PCM de 16 bits (array vacío si no hay frames)"""
+    num_muestras = len(pcm) // 2
+    muestras = np.frombuffer(pcm, dtype=np.int16, count=num_muestras)
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    num_frames = num_muestras // frame
+    frames = muestras[:num_frames * frame].reshape(num_frames, frame).astype(np.float32)
+    return np.sqrt(np.mean(frames * frames, axis=1)) if num_frames else np.zeros(0, dtype=np.float32)
+
+
+def _umbral_voz(rms, threshold_ratio, min_rms):
+    """
+    Umbral adaptativo: múltiplo del ruido de fondo (percentil 10), nunca menor que min_rms
+    
+    El percentil 10 solo es ruido si al menos un 10 % de los frames son pausa.
+    En habla casi continua (o un tono) el múltiplo supera a la propia voz
+    (percentil 90): se prueba el percentil 1 y, si tampoco hay contraste,
+    el umbral es min_rms.
+    """
+    alto = float(np.percentile(rms, 90))
+    for percentil in (10, 1):
+        umbral = float(np.percentile(rms, percentil)) * threshold_ratio
+        if umbral < alto:
+            return max(umbral, min_rms)
+    return min_rms
+
+
+def evaluar_silencio(pcm, sample_rate=16000, frame_ms=30, threshold_ratio=3.0, min_rms=150,
+                     min_speech_ratio=0.02, min_speech_seconds=1.0):
+    """
+    Pre-chequeo rápido de audio sin voz (silencio, línea abierta, buzón vacío)
+    
+    Solo puede ser silencio un audio cuya energía global no supera min_rms;
+    por encima, la proporción de voz no decide (el umbral adaptativo puede
+    fallar en habla sin pausas y descartaría una conversación real).
+    
+    Args:
+        pcm: Buffer PCM mono de 16 bits (bytes o memoryview)
+        min_speech_ratio: Fracción mínima de frames con voz
+        min_speech_seconds: Segundos mínimos con voz
+        (resto de parámetros como en segmentar_por_voz)
+    
+    Returns:
+        tuple: (es_silencio: bool, detalle: dict con rms, speech_ratio y speech_seconds)
+               Sin NumPy no se evalúa y se devuelve (False, None)
+    """
+    if np is None:
+        return False, None
+    
+    rms = _rms_por_frame(pcm, sample_rate, frame_ms)
+    if len(rms) == 0:
+        return True, {'rms': 0.0, 'speech_ratio': 0.0, 'speech_seconds': 0.0}
+    
+    frames_voz = int(np.count_nonzero(rms > _umbral_voz(rms, threshold_ratio, min_rms)))
+    detalle = {
+        'rms': round(float(np.sqrt(np.mean(rms * rms))), 1),
+        'speech_ratio': round(frames_voz / len(rms), 4),
+        'speech_seconds': round(frames_voz * frame_ms / 1000, 2)
+    }
+    es_silencio = detalle['rms'] <= min_rms and (
+        detalle['speech_ratio'] < min_speech_ratio or
+        detalle['speech_seconds'] < min_speech_seconds
+    )
+    return es_silencio, detalle
+
+
+def _tramos(mascara):
+    """Tramos consecutivos en True de una máscara booleana: [(inicio, fin)]"""
+    bordes = np.diff(np.concatenate(([0], mascara.astype(np.int8), [0])))
+    return list(zip(np.flatnonzero(bordes == 1), np.flatnonzero(bordes == -1)))
+
+
+def segmentar_por_voz(pcm, sample_rate=16000, max_segment_seconds=58, frame_ms=30,
+                      min_silence_ms=500, min_speech_ms=250, padding_ms=200,
+                      threshold_ratio=3.0, min_rms=150, max_gap_ms=1500):
+    """
+    Localiza los tramos con voz y los agrupa en segmentos para el ASR
+    
+    El umbral de energía se adapta a cada llamada: threshold_ratio veces el
+    ruido de fondo (percentil 10 del RMS por frame), nunca menor que min_rms
+    (ver _umbral_voz). Un audio con energía por encima de min_rms nunca
+    devuelve una lista vacía: si el VAD no separa tramos se usan cortes fijos.
+    
+    Args:
+        pcm: Buffer PCM mono de 16 bits (bytes o memoryview)
+        sample_rate: Frecuencia de muestreo
+        max_segment_seconds: Duración máxima de un segmento (límite del ASR)
+        frame_ms: Tamaño del frame de análisis
+        min_silence_ms: Pausas más cortas no separan tramos de voz
+        min_speech_ms: Tramos de voz más cortos se descartan (clics, ruido)
+        padding_ms: Margen añadido a cada lado de un tramo de voz
+        threshold_ratio: Múltiplo del ruido de fondo que se considera voz
+        min_rms: Umbral mínimo absoluto de energía
+        max_gap_ms: Tramos separados por menos de esto van en el mismo segmento
+    
+    Returns:
+        list: [(inicio, fin)] en muestras, en orden; vacía si no hay voz
+              (energía global no mayor que min_rms)
+    """
+    num_muestras = len(pcm) // 2
+    if np is None:
+        return cortes_fijos(num_muestras, sample_rate, max_segment_seconds)
+    
+    frame = max(1, int(sample_rate * frame_ms / 1000))
+    rms = _rms_por_frame(pcm, sample_rate, frame_ms)
+    num_frames = len(rms)
+    if num_frames == 0:
+        return []
+    
+    voz = rms > _umbral_voz(rms, threshold_ratio, min_rms)
+    
+    # Pausas cortas dentro de una frase no cortan el tramo
+    min_silencio = max(1, min_silence_ms // frame_ms)
+    for inicio, fin in _tramos(~voz):
+        if fin - inicio < min_silencio and inicio > 0 and fin < num_frames:
+            voz[inicio:fin] = True
+    
+    min_voz = max(1, min_speech_ms // frame_ms)
+    relleno = padding_ms // frame_ms
+    tramos = [
+        (max(0, inicio - relleno), min(num_frames, fin + relleno))
+        for inicio, fin in _tramos(voz)
+        if fin - inicio >= min_voz
+    ]
+    
+    # Agrupar tramos cercanos sin pasar del máximo; un tramo más largo que
+    # el máximo se parte en el frame de menor energía de su último cuarto
+    max_frames = max(1, int(max_segment_seconds * 1000 // frame_ms))
+    max_hueco = max_gap_ms // frame_ms
+    segmentos = []
+    for inicio, fin in tramos:
+        if segmentos:
+            previo_inicio, previo_fin = segmentos[-1]
+            if inicio <= previo_fin + max_hueco and fin - previo_inicio <= max_frames:
+                segmentos[-1] = (previo_inicio, max(previo_fin, fin))
+                continue
+            # El margen no debe repetir audio del segmento anterior
+            inicio = max(inicio, previo_fin)
+        
+        while fin - inicio > max_frames:
+            desde = inicio + 3 * max_frames // 4
+            corte = desde + int(np.argmin(rms[desde:inicio + max_frames]))
+            segmentos.append((inicio, corte))
+            inicio = corte
+        segmentos.append((inicio, fin))
+    
+    if not segmentos and float(np.sqrt(np.mean(rms * rms))) > min_rms:
+        # Hay energía pero el VAD no encontró tramos: mejor transcribir por cortes fijos que perder la llamada
+        logger.debug("VAD sin tramos de voz en audio con energía: se usan cortes fijos")
+        return cortes_fijos(num_muestras, sample_rate, max_segment_seconds)
+    
+    return [(inicio * frame, min(fin * frame, num_muestras)) for inicio, fin in segmentos]
@@ -1,12 +1,18 @@
+import os
 import signal
-import sys
 from log import log
 
 def register_signals(stop_event):
+    """
+    Primera señal: detiene el sistema drenando los trabajos en curso
+    Segunda señal: salida inmediata (los leases vencidos devuelven el trabajo a la cola)
+    """
     def handler(sig, frame):
-        log("Terminando aplicación...")
+        if stop_event.is_set():
+            log("Segunda señal recibida - Forzando salida sin esperar trabajos en curso")
+            os._exit(1)
+        log("Terminando aplicación... (drenando trabajos en curso)")
         stop_event.set()
-        sys.exit(0)
 
     signal.signal(signal.SIGINT, handler)
     signal.signal(signal.SIGTERM, handler)
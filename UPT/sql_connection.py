@@ -51,6 +51,73 @@ def ejecutar_query(query, parametros=None):
         return []
 
 
+def _epoch(valor):
+    """datetime de la BD a epoch (None si la columna no viene)"""
+    try:
+        return valor.timestamp() if valor is not None else None
+    except (AttributeError, ValueError, OverflowError):
+        return None
+
+
+def _convertir_registros(columns, rows, tipo_proceso):
+    """
+    Convierte las filas de un SP de pendientes a lista de diccionarios
+    
+    FechaEncolado (opcional) es el momento en que el registro entró a la
+    cola; da la espera real para el envejecimiento de sjf y las métricas.
+    BatchId (opcional, análisis) es el lote del proveedor al que ya se envió
+    el registro (ver registrar_lote).
+    
+    Args:
+        columns: Nombres de columnas del resultset
+        rows: Filas obtenidas
+        tipo_proceso: "transcription" o "analysis"
+    
+    Returns:
+        list: Registros válidos
+    """
+    registros = []
+    for row in rows:
+        row_dict = dict(zip(columns, row))
+        
+        if tipo_proceso == "transcription":
+            transaction_id = row_dict.get('TransactionId')
+            audio_path = row_dict.get('TransactionFile')
+            retry_count = row_dict.get('ReintentoCount', 0)
+            
+            if not isinstance(audio_path, str):
+                logger.warning(f"Saltando registro - audio_path inválido: TransactionId={transaction_id}")
+                continue
+            
+            registros.append({
+                'transaction_id': int(transaction_id) if transaction_id else 0,
+                'audio_path': audio_path,
+                'retry_count': int(retry_count) if retry_count else 0,
+                'enqueued_at': _epoch(row_dict.get('FechaEncolado'))
+            })
+            
+        elif tipo_proceso == "analysis":
+            transaction_id = row_dict.get('TransactionId')
+            audio_path = row_dict.get('TransactionFile')
+            transcription_path = row_dict.get('TranscriptionPath')
+            retry_count = row_dict.get('ReintentoCount', 0)
+            
+            if not isinstance(audio_path, str):
+                logger.warning(f"Saltando registro - audio_path inválido: TransactionId={transaction_id}")
+                continue
+            
+            registros.append({
+                'transaction_id': int(transaction_id) if transaction_id else 0,
+                'audio_path': audio_path,
+                'transcription_path': transcription_path if isinstance(transcription_path, str) else None,
+                'retry_count': int(retry_count) if retry_count else 0,
+                'enqueued_at': _epoch(row_dict.get('FechaEncolado')),
+                'batch_id': row_dict.get('BatchId') or None
+            })
+    
+    return registros
+
+
 def obtener_registros_pendientes(sp_name, tipo_proceso="transcription"):
     """Obtiene registros pendientes con manejo robusto de errores"""
     try:
@@ -68,41 +135,7 @@ def obtener_registros_pendientes(sp_name, tipo_proceso="transcription"):
             logger.debug(f"Columnas recibidas de {sp_name}: {columns}")
             
             # Convertir a lista de diccionarios
-            registros = []
-            for row in rows:
-                row_dict = dict(zip(columns, row))
-                
-                if tipo_proceso == "transcription":
-                    transaction_id = row_dict.get('TransactionId')
-                    audio_path = row_dict.get('TransactionFile')
-                    retry_count = row_dict.get('ReintentoCount', 0)
-                    
-                    if not isinstance(audio_path, str):
-                        logger.warning(f"Saltando registro - audio_path inválido: TransactionId={transaction_id}")
-                        continue
-                    
-                    registros.append({
-                        'transaction_id': int(transaction_id) if transaction_id else 0,
-                        'audio_path': audio_path,
-                        'retry_count': int(retry_count) if retry_count else 0
-                    })
-                    
-                elif tipo_proceso == "analysis":
-                    transaction_id = row_dict.get('TransactionId')
-                    audio_path = row_dict.get('TransactionFile')
-                    transcription_path = row_dict.get('TranscriptionPath')
-                    retry_count = row_dict.get('ReintentoCount', 0)
-                    
-                    if not isinstance(audio_path, str):
-                        logger.warning(f"Saltando registro - audio_path inválido: TransactionId={transaction_id}")
-                        continue
-                    
-                    registros.append({
-                        'transaction_id': int(transaction_id) if transaction_id else 0,
-                        'audio_path': audio_path,
-                        'transcription_path': transcription_path if isinstance(transcription_path, str) else None,
-                        'retry_count': int(retry_count) if retry_count else 0
-                    })
+            registros = _convertir_registros(columns, rows, tipo_proceso)
             
             logger.debug(f"Obtenidos {len(registros)} registros válidos de {tipo_proceso}")
             return registros
@@ -119,8 +152,96 @@ def obtener_registros_pendientes(sp_name, tipo_proceso="transcription"):
         return []
 
 
+def reclamar_registros_pendientes(sp_name, batch_size, worker_id, tipo_proceso="transcription",
+                                  lease_seconds=None, transaction_id=None):
+    """
+    Reclama atómicamente hasta batch_size registros pendientes para este worker
+    
+    El SP recibe (@BatchSize, @WorkerId[, @LeaseSeconds[, @TransactionId]]) y
+    en una sola transacción pasa a 'Procesando' los registros más antiguos que
+    nadie tenga tomados, o cuyo lease haya vencido (UPDATE ... WITH (UPDLOCK,
+    READPAST) ... OUTPUT), devolviendo solo esos registros con las mismas
+    columnas que el SP de pendientes (y FechaEncolado y BatchId, si existen). Así dos
+    instancias nunca reciben el mismo TransactionId. Con @TransactionId solo se reclama ese registro, si
+    sigue pendiente y libre (@LeaseSeconds NULL = sin lease).
+    
+    El SP no entrega registros que aún no se pueden procesar: los que tienen
+    NoAntesDe en el futuro (ver diferir_registro) y, para análisis, los que
+    no tienen su transcripción completada (TranscriptionPath NULL). Así un
+    registro que no está listo nunca ocupa el batch ni se reclama para
+    liberarlo después.
+    
+    Args:
+        sp_name: Nombre del SP de claim
+        batch_size: Máximo de registros a reclamar
+        worker_id: Identificador de este worker/instancia
+        tipo_proceso: "transcription" o "analysis"
+        lease_seconds: Duración del lease a registrar (None = sin lease)
+        transaction_id: Reclamar solo este registro (None = los más antiguos)
+    
+    Returns:
+        list: Registros reclamados (con 'claimed_by'), o None si el SP no existe
+    
+    Raises:
+        Exception: Si el claim falla por otro motivo (conexión, bloqueo...);
+            no se devuelve [] para no confundirlo con una cola vacía
+    """
+    try:
+        with pyodbc.connect(DB_CONNECTION_STRING, timeout=30) as conn:
+            cursor = conn.cursor()
+            if transaction_id is not None:
+                cursor.execute(
+                    f"EXEC {sp_name} ?, ?, ?, ?", batch_size, worker_id, lease_seconds or None, transaction_id
+                )
+            elif lease_seconds:
+                cursor.execute(f"EXEC {sp_name} ?, ?, ?", batch_size, worker_id, lease_seconds)
+            else:
+                cursor.execute(f"EXEC {sp_name} ?, ?", batch_size, worker_id)
+            
+            # Saltar conteos de filas previos al resultset del OUTPUT
+            while cursor.description is None and cursor.nextset():
+                pass
+            
+            columns = [column[0] for column in cursor.description] if cursor.description else []
+            rows = cursor.fetchall() if cursor.description else []
+            
+            # Confirmar el claim aunque no haya filas
+            conn.commit()
+            
+            if not rows:
+                return []
+            
+            logger.debug(f"Columnas recibidas de {sp_name}: {columns}")
+            
+            registros = _convertir_registros(columns, rows, tipo_proceso)
+            for registro in registros:
+                registro['claimed_by'] = worker_id
+            
+            logger.debug(
+                f"Reclamados {len(registros)}/{batch_size} registros de {tipo_proceso} "
+                f"para {worker_id}"
+            )
+            return registros
+            
+    except pyodbc.Error as e:
+        error_msg = str(e)
+        if "Could not find stored procedure" in error_msg:
+            logger.debug(f"⚠ SP '{sp_name}' no existe")
+            return None
+        logger.error(f"✗ Error SQL en {sp_name}: {error_msg}")
+        raise
+    except Exception as e:
+        logger.error(f"✗ Error inesperado en {sp_name}: {e}")
+        raise
+
+
 def guardar_transcripcion(transaction_id, transcription_path, transcription_name, tokens_in, tokens_out):
-    """Guarda transcripción con manejo robusto de errores"""
+    """
+    Guarda transcripción con manejo robusto de errores
+    
+    Returns:
+        bool: True si la BD confirmó el guardado
+    """
     try:
         success = ejecutar_sp(
             "SetTranscription",
@@ -140,13 +261,20 @@ def guardar_transcripcion(transaction_id, transcription_path, transcription_name
             )
         else:
             logger.debug(f"⚠ No se pudo guardar transcripción en BD para ID:{transaction_id} (SP no existe)")
+        return success
             
     except Exception as e:
         logger.warning(f"⚠ Error guardando transcripción para ID:{transaction_id}: {e}")
+        return False
 
 
 def guardar_analisis(transaction_id, analysis_path, analysis_name, tokens_in, tokens_out):
-    """Guarda análisis con manejo robusto de errores"""
+    """
+    Guarda análisis con manejo robusto de errores
+    
+    Returns:
+        bool: True si la BD confirmó el guardado
+    """
     try:
         success = ejecutar_sp(
             "SetAnalysis",
@@ -166,9 +294,11 @@ def guardar_analisis(transaction_id, analysis_path, analysis_name, tokens_in, to
             )
         else:
             logger.debug(f"⚠ No se pudo guardar análisis en BD para ID:{transaction_id} (SP no existe)")
+        return success
             
     except Exception as e:
         logger.warning(f"⚠ Error guardando análisis para ID:{transaction_id}: {e}")
+        return False
 
 
 def marcar_como_error(transaction_id, mensaje_error="Máximo de reintentos alcanzado"):
@@ -186,7 +316,12 @@ def marcar_como_error(transaction_id, mensaje_error="Máximo de reintentos alcan
 
 
 def actualizar_estado(transaction_id, nuevo_estado, retry_count=None):
-    """Actualiza estado con manejo robusto de errores"""
+    """
+    Actualiza estado con manejo robusto de errores
+    
+    Returns:
+        bool: True si la BD confirmó el cambio de estado
+    """
     try:
         parametros = [transaction_id, nuevo_estado]
         if retry_count is not None:
@@ -200,9 +335,76 @@ def actualizar_estado(transaction_id, nuevo_estado, retry_count=None):
             logger.debug(f"✓ Estado actualizado en BD - ID:{transaction_id} -> {nuevo_estado}")
         else:
             logger.debug(f"⚠ No se pudo actualizar estado en BD para ID:{transaction_id} (SP no existe)")
+        return success
             
     except Exception as e:
-        logger.debug(f"⚠ Error actualizando estado para ID:{transaction_id}: {e}")
+        logger.warning(f"⚠ Error actualizando estado para ID:{transaction_id}: {e}")
+        return False
+
+
+def liberar_registro(transaction_id, retry_count=None):
+    """
+    Devuelve a 'Pendiente' un registro reclamado que no se terminó
+    
+    Args:
+        transaction_id: ID de la transacción
+        retry_count: Reintentos acumulados (opcional)
+    
+    Returns:
+        bool: True si el registro volvió a 'Pendiente'
+    """
+    liberado = actualizar_estado(transaction_id, 'Pendiente', retry_count=retry_count)
+    if liberado:
+        logger.debug(f"Registro liberado - ID:{transaction_id}")
+    return liberado
+
+
+def diferir_registro(sp_name, transaction_id, seconds):
+    """
+    Devuelve a 'Pendiente' un registro que aún no se puede procesar, con
+    NoAntesDe = ahora + seconds: el SP de claim no lo entrega antes de esa
+    hora (seconds=0 lo vuelve a hacer reclamable de inmediato)
+    
+    El SP recibe (@TransactionId, @Seconds)
+    
+    Returns:
+        bool: True si el SP se ejecutó correctamente
+    """
+    return ejecutar_sp(sp_name, [transaction_id, seconds])
+
+
+def registrar_lote(sp_name, transaction_id, batch_id):
+    """
+    Guarda en BD el lote del proveedor al que se envió el análisis
+    (batch_id None lo borra al terminar el lote). La instancia que reclame
+    el registro después lo retoma desde ese lote en lugar de reenviarlo.
+    
+    El SP recibe (@TransactionId, @BatchId)
+    
+    Returns:
+        bool: True si el SP se ejecutó correctamente
+    """
+    return ejecutar_sp(sp_name, [transaction_id, batch_id])
+
+
+def renovar_lease(sp_name, transaction_id, worker_id, lease_seconds):
+    """
+    Extiende el lease de un registro reclamado por este worker
+    
+    Returns:
+        bool: True si el SP se ejecutó correctamente
+    """
+    return ejecutar_sp(sp_name, [transaction_id, worker_id, lease_seconds])
+
+
+def liberar_leases_expirados(sp_name):
+    """
+    Devuelve a 'Pendiente' los registros cuyo lease venció (instancia caída)
+    
+    Returns:
+        bool: True si el SP se ejecutó correctamente
+    """
+    return ejecutar_sp(sp_name, [])
 
 
 def obtener_tokens_mes(mes):
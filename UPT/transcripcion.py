@@ -1,33 +1,665 @@
+import json
 import os
-from math import ceil
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 import speech_recognition as sr
 from pydub import AudioSegment
 from log import get_logger
-import tempfile
-import time
+from metrics import get_metrics
+from connection_settings import ASR_CONFIG, BASE_DIR
+from segmentation import segmentar_por_voz, cortes_fijos, evaluar_silencio
+from audio_decoder import ffmpeg_disponible, decodificar_en_bloques, decodificar_wav
+from audio_probe import probar_audio, motivo_rechazo, describir, duracion_maxima
 
 logger = get_logger()
+metrics = get_metrics()
+
+# Formato PCM que se entrega al reconocedor
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2  # bytes por muestra (16 bits)
+
+ASR_LANGUAGE = ASR_CONFIG.get('language', 'es-ES')
+# Duración máxima de audio por petición al ASR
+MAX_SEGMENT_SECONDS = ASR_CONFIG.get('max_segment_seconds', 58)
+# Segmentación por voz: corta en pausas y descarta silencios
+VAD_CONFIG = ASR_CONFIG.get('vad', {})
+# Pre-chequeo de silencio antes de segmentar y llamar al ASR
+SILENCE_CONFIG = ASR_CONFIG.get('silence_prescreen', {})
+# Descarte por cabecera (dañada o audio muy corto) antes de decodificar
+PROBE_CONFIG = ASR_CONFIG.get('probe', {})
+# Decodificación en streaming para grabaciones largas (memoria acotada)
+STREAMING_CONFIG = ASR_CONFIG.get('streaming', {})
+# Grabaciones estéreo con un hablante por canal (centralita: agente y cliente)
+STEREO_CONFIG = ASR_CONFIG.get('stereo_split', {})
+# WAV PCM decodificados y remuestreados en proceso, sin lanzar ffmpeg
+WAV_FAST_PATH_CONFIG = ASR_CONFIG.get('wav_fast_path', {})
+# Fragmentos de una misma llamada reconocidos a la vez
+MAX_CONCURRENT_FRAGMENTS = max(1, int(ASR_CONFIG.get('max_concurrent_fragments', 4)))
+# Tope de peticiones simultáneas al servicio ASR desde este host (todos los workers)
+_asr_semaphore = threading.BoundedSemaphore(max(1, int(ASR_CONFIG.get('max_requests_per_host', 8))))
+
+
+class ConfiguracionASRInvalida(Exception):
+    """El motor de ASR configurado (asr.engine) no se puede crear"""
+
+
+class TranscriptionEngine(ABC):
+    """Clase abstracta para motores de reconocimiento de voz"""
+    
+    # Segmentos que el motor procesa en una sola llamada (1 = sin lotes)
+    max_batch = 1
+    # True si el motor llama a un servicio de red (aplica el límite por host)
+    remote = False
+    
+    @abstractmethod
+    def transcribe(self, audio_data) -> str:
+        """
+        Reconoce un segmento de audio
+        
+        Args:
+            audio_data: sr.AudioData (PCM mono de 16 bits)
+        
+        Returns:
+            str: Texto reconocido ("" si no se reconoció voz)
+        
+        Raises:
+            sr.RequestError: Error del servicio (no crítico, se cuenta como fragmento con error)
+        """
+        pass
+    
+    def transcribe_batch(self, audios) -> list:
+        """
+        Reconoce varios segmentos en una llamada (por defecto, uno a uno)
+        
+        Returns:
+            list: Texto de cada segmento, en el mismo orden
+        """
+        return [self.transcribe(audio_data) for audio_data in audios]
+    
+    @abstractmethod
+    def get_engine_name(self) -> str:
+        """Retorna el nombre del motor"""
+        pass
+
+
+class GoogleEngine(TranscriptionEngine):
+    """Implementación con la API web de Google (speech_recognition)"""
+    
+    remote = True
+    
+    def __init__(self, language=ASR_LANGUAGE):
+        self.language = language
+    
+    def transcribe(self, audio_data) -> str:
+        # El reconocedor no comparte estado entre llamadas, pero uno por fragmento evita sorpresas
+        recognizer = sr.Recognizer()
+        try:
+            return recognizer.recognize_google(audio_data, language=self.language) or ""
+        except sr.UnknownValueError:
+            # Audio ininteligible (situación esperable)
+            return ""
+    
+    def get_engine_name(self) -> str:
+        return "Google"
+
+
+class VoskEngine(TranscriptionEngine):
+    """Implementación local en CPU con Vosk (sin red, resultados deterministas)"""
+    
+    def __init__(self, model_path, max_batch=4):
+        import vosk
+        vosk.SetLogLevel(-1)
+        if not os.path.isdir(model_path):
+            raise ValueError(f"Modelo Vosk no encontrado: {model_path}")
+        self._vosk = vosk
+        self.model = vosk.Model(model_path)
+        # Un lote reutiliza el mismo reconocedor (se reinicia tras cada FinalResult)
+        self.max_batch = max(1, int(max_batch))
+    
+    def transcribe(self, audio_data) -> str:
+        return self.transcribe_batch([audio_data])[0]
+    
+    def transcribe_batch(self, audios) -> list:
+        recognizer = self._vosk.KaldiRecognizer(self.model, SAMPLE_RATE)
+        textos = []
+        for audio_data in audios:
+            recognizer.AcceptWaveform(bytes(audio_data.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=SAMPLE_WIDTH)))
+            textos.append(json.loads(recognizer.FinalResult()).get('text', ''))
+        return textos
+    
+    def get_engine_name(self) -> str:
+        return "Vosk"
+
+
+def _crear_motor(engine) -> TranscriptionEngine:
+    """Factory del motor de ASR configurado (asr.engine)"""
+    if engine == "google":
+        return GoogleEngine()
+    elif engine == "vosk":
+        vosk_cfg = ASR_CONFIG.get('vosk', {})
+        model_path = vosk_cfg.get('model_path', os.path.join('models', 'vosk-model-small-es-0.42'))
+        if not os.path.isabs(model_path):
+            model_path = os.path.join(BASE_DIR, model_path)
+        return VoskEngine(model_path, max_batch=vosk_cfg.get('max_batch', 4))
+    else:
+        raise ConfiguracionASRInvalida(f"Motor de ASR no soportado: {engine} (asr.engine: google o vosk)")
+
+
+# Instancia global del motor (se crea en el primer uso)
+_transcription_engine = None
+_transcription_engine_lock = threading.Lock()
+
+
+def get_transcription_engine() -> TranscriptionEngine:
+    """
+    Obtiene la instancia global del motor de ASR, creándola en el primer uso
+    
+    Importar el módulo no carga modelos ni dependencias del motor: un
+    asr.engine inválido se detecta aquí (al arrancar el TranscriptionPoller).
+    
+    Raises:
+        ConfiguracionASRInvalida: Motor no soportado, modelo no encontrado o
+            dependencia del motor no instalada
+    """
+    global _transcription_engine
+    with _transcription_engine_lock:
+        if _transcription_engine is None:
+            engine = ASR_CONFIG.get('engine', 'google')
+            try:
+                _transcription_engine = _crear_motor(engine)
+            except ConfiguracionASRInvalida:
+                raise
+            except Exception as e:
+                raise ConfiguracionASRInvalida(f"No se pudo crear el motor de ASR '{engine}': {e}") from e
+            logger.info(f"Motor de ASR: {_transcription_engine.get_engine_name()}")
+    return _transcription_engine
+
+
+def _reconocer_lote(audios, indice, num_segments, poller):
+    """
+    Reconoce un lote de fragmentos consecutivos con el motor configurado
+    
+    Args:
+        audios: Lista de sr.AudioData (hasta el max_batch del motor)
+        indice: Posición del primer fragmento del lote
+        num_segments: Total de fragmentos (solo para el log; None en streaming)
+        poller: Poller al que se atribuye la latencia de ASR
+    
+    Returns:
+        list: [(estado: 'ok' | 'vacio' | 'error', texto: str o None)] por fragmento
+    """
+    def etiqueta(i):
+        return f"{i+1}/{num_segments}" if num_segments else f"{i+1}"
+    
+    rango = etiqueta(indice) if len(audios) == 1 else f"{indice+1}-{indice+len(audios)}"
+    motor = get_transcription_engine()
+    try:
+        # Solo los motores de red cuentan contra el límite de peticiones por host
+        limite = _asr_semaphore if motor.remote else nullcontext()
+        with limite, metrics.medir('asr', poller=poller):
+            textos = motor.transcribe_batch(audios)
+    
+    except sr.RequestError as e:
+        # ERROR NO CRÍTICO: Error de conexión, pero se puede continuar
+        logger.warning(f"⚠ WARNING: Error de conexión en fragmento {rango}: {e}")
+        return [('error', None)] * len(audios)
+        
+    except Exception as e:
+        # ERROR NO CRÍTICO: Error en fragmento individual, pero se puede continuar
+        logger.warning(f"⚠ WARNING: Error procesando fragmento {rango}: {e}")
+        return [('error', None)] * len(audios)
+    
+    resultados = []
+    for i, texto in enumerate(textos, start=indice):
+        if texto and texto.strip():
+            logger.debug(f"Fragmento {etiqueta(i)}: ✓ OK ({len(texto)} chars)")
+            resultados.append(('ok', texto))
+        else:
+            # WARNING: Texto vacío o audio ininteligible (situación esperable)
+            logger.debug(f"Fragmento {etiqueta(i)}: Texto vacío o ininteligible")
+            resultados.append(('vacio', None))
+    return resultados
+
+
+def _segmentar(pcm):
+    """
+    Segmentos [(inicio, fin)] en muestras del PCM a enviar al ASR
+    
+    Con asr.vad.enabled a false se mantienen los cortes fijos de MAX_SEGMENT_SECONDS.
+    """
+    if not VAD_CONFIG.get('enabled', True):
+        return cortes_fijos(len(pcm) // SAMPLE_WIDTH, SAMPLE_RATE, MAX_SEGMENT_SECONDS)
+    
+    return segmentar_por_voz(
+        pcm,
+        sample_rate=SAMPLE_RATE,
+        max_segment_seconds=MAX_SEGMENT_SECONDS,
+        frame_ms=VAD_CONFIG.get('frame_ms', 30),
+        min_silence_ms=VAD_CONFIG.get('min_silence_ms', 500),
+        min_speech_ms=VAD_CONFIG.get('min_speech_ms', 250),
+        padding_ms=VAD_CONFIG.get('padding_ms', 200),
+        threshold_ratio=VAD_CONFIG.get('threshold_ratio', 3.0),
+        min_rms=VAD_CONFIG.get('min_rms', 150),
+        max_gap_ms=VAD_CONFIG.get('max_gap_ms', 1500)
+    )
+
+
+def _reconocer_en_orden(fragmentos, num_segments=None):
+    """
+    Reconoce los fragmentos en paralelo y devuelve los resultados en su orden
+    
+    Los fragmentos se agrupan en lotes del max_batch del motor.
+    Acepta un generador: como mucho 2 × MAX_CONCURRENT_FRAGMENTS lotes
+    quedan en vuelo, así que la memoria no depende de la duración del audio.
+    
+    Args:
+        fragmentos: Iterable de sr.AudioData en orden
+        num_segments: Total de fragmentos si se conoce (solo para el log)
+    
+    Returns:
+        list: [(estado, texto)] en el orden de los fragmentos
+    """
+    # Los hilos del pool no heredan el contexto del poller para las métricas
+    poller = metrics.poller_actual()
+    tamano_lote = get_transcription_engine().max_batch
+    resultados = []
+    en_vuelo = deque()
+    lote = []
+    enviados = 0
+    
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_FRAGMENTS, thread_name_prefix="asr") as executor:
+        for audio_data in fragmentos:
+            lote.append(audio_data)
+            if len(lote) < tamano_lote:
+                continue
+            en_vuelo.append(executor.submit(_reconocer_lote, lote, enviados, num_segments, poller))
+            enviados += len(lote)
+            lote = []
+            if len(en_vuelo) >= MAX_CONCURRENT_FRAGMENTS * 2:
+                resultados.extend(en_vuelo.popleft().result())
+        
+        if lote:
+            en_vuelo.append(executor.submit(_reconocer_lote, lote, enviados, num_segments, poller))
+        
+        while en_vuelo:
+            resultados.extend(en_vuelo.popleft().result())
+    
+    return resultados
+
+
+def _detalle(resultados=()):
+    """
+    Resumen de fragmentos de una transcripción
+    
+    Returns:
+        dict: {'fragments', 'ok', 'empty', 'errors'}
+    """
+    return {
+        'fragments': len(resultados),
+        'ok': sum(1 for estado, _ in resultados if estado == 'ok'),
+        'empty': sum(1 for estado, _ in resultados if estado == 'vacio'),
+        'errors': sum(1 for estado, _ in resultados if estado == 'error')
+    }
+
+
+def _resumir_resultados(resultados):
+    """
+    Une el texto reconocido y registra el resumen de fragmentos
+    
+    Returns:
+        tuple: (texto: str o None si ningún fragmento tuvo texto, detalle: dict)
+    """
+    detalle = _detalle(resultados)
+    num_segments = detalle['fragments']
+    fragmentos_exitosos = detalle['ok']
+    fragmentos_vacios = detalle['empty']
+    fragmentos_con_errores = detalle['errors']
+    
+    # Evaluar resultado
+    transcripcion = " ".join(texto for estado, texto in resultados if estado == 'ok').strip()
+    
+    # WARNING: No se obtuvo transcripción (situación esperable - audio sin voz válida)
+    if not transcripcion:
+        logger.warning(
+            f"⚠ WARNING: No se obtuvo transcripción válida - "
+            f"Exitosos: {fragmentos_exitosos}/{num_segments} | "
+            f"Vacíos/Ininteligibles: {fragmentos_vacios} | "
+            f"Errores: {fragmentos_con_errores}"
+        )
+        return None, detalle
+    
+    logger.info(
+        f"✓ Transcripción completada: {len(transcripcion)} caracteres, "
+        f"{fragmentos_exitosos}/{num_segments} fragmentos exitosos"
+    )
+    
+    return transcripcion, detalle
+
+
+def _usar_streaming(info):
+    """
+    True si la grabación es lo bastante larga para decodificarla en streaming
+    Con formato no reconocido se decide por tamaño al bitrate más bajo
+    habitual: mejor decodificar en streaming uno corto que cargar entero uno largo.
+    
+    El streaming mezcla a mono, así que un estéreo conocido con
+    stereo_split activo se decodifica completo para conservar la separación
+    por canal (un formato sin canales en la cabecera sí va en streaming).
+    """
+    if not STREAMING_CONFIG.get('enabled', True):
+        return False
+    if duracion_maxima(info) < STREAMING_CONFIG.get('threshold_seconds', 1800):
+        return False
+    if STEREO_CONFIG.get('enabled', True) and info.get('channels') == 2:
+        logger.debug("Audio largo en estéreo: se decodifica completo para separar los canales")
+        return False
+    return True
+
+
+def _fragmentos_en_streaming(archivo_original, resumen):
+    """
+    Genera los fragmentos de voz a medida que ffmpeg decodifica el audio
+    
+    Cada bloque se segmenta junto con la cola del anterior: el último
+    segmento de cada ventana puede seguir en el bloque siguiente, así que
+    se retiene hasta conocer su final. El buffer nunca supera un segmento
+    máximo más dos bloques.
+    
+    Args:
+        archivo_original: Ruta del archivo de audio
+        resumen: Dict que se completa con 'segundos_audio', 'segundos_voz'
+                 y 'decodificacion' (segundos dedicados a decodificar)
+    
+    Yields:
+        sr.AudioData: Fragmentos en orden
+    """
+    bytes_por_segundo = SAMPLE_RATE * SAMPLE_WIDTH
+    bloques = decodificar_en_bloques(
+        archivo_original,
+        sample_rate=SAMPLE_RATE,
+        chunk_seconds=STREAMING_CONFIG.get('chunk_seconds', 30)
+    )
+    pendiente = b""
+    
+    while True:
+        inicio = time.perf_counter()
+        bloque = next(bloques, None)
+        resumen['decodificacion'] += time.perf_counter() - inicio
+        
+        ultimo_bloque = bloque is None
+        if not ultimo_bloque:
+            resumen['segundos_audio'] += len(bloque) / bytes_por_segundo
+            buffer = pendiente + bloque
+        else:
+            buffer = pendiente
+        
+        segmentos = _segmentar(memoryview(buffer))
+        if not ultimo_bloque:
+            if segmentos:
+                # El último segmento puede continuar en el siguiente bloque
+                pendiente = buffer[segmentos[-1][0] * SAMPLE_WIDTH:]
+                segmentos = segmentos[:-1]
+            else:
+                # Solo silencio: se conserva el final por si la voz empieza en el corte
+                pendiente = buffer[-bytes_por_segundo:]
+        
+        for inicio_seg, fin_seg in segmentos:
+            resumen['segundos_voz'] += (fin_seg - inicio_seg) / SAMPLE_RATE
+            yield sr.AudioData(
+                buffer[inicio_seg * SAMPLE_WIDTH:fin_seg * SAMPLE_WIDTH],
+                SAMPLE_RATE,
+                SAMPLE_WIDTH
+            )
+        
+        if ultimo_bloque:
+            break
+
+
+def _transcribir_en_streaming(archivo_original):
+    """
+    Transcribe una grabación larga sin cargarla entera en memoria
+    
+    No aplica el pre-chequeo global de silencio (requiere todo el audio);
+    la segmentación por voz de cada ventana ya evita enviar silencios al ASR.
+    
+    Returns:
+        tuple: (texto o None si no se pudo transcribir, detalle de fragmentos)
+    """
+    logger.info("Audio largo: decodificando y transcribiendo en streaming...")
+    resumen = {'segundos_audio': 0.0, 'segundos_voz': 0.0, 'decodificacion': 0.0}
+    
+    # ERROR CRÍTICO: Fallo al decodificar (ffmpeg devuelve error)
+    try:
+        resultados = _reconocer_en_orden(_fragmentos_en_streaming(archivo_original, resumen))
+    except RuntimeError as e:
+        logger.error(f"✗ ERROR CRÍTICO: No se pudo convertir el audio: {e}")
+        raise
+    finally:
+        metrics.registrar('conversion', resumen['decodificacion'])
+    
+    logger.info(
+        f"Streaming: {len(resultados)} fragmento(s) - "
+        f"{resumen['segundos_voz']:.1f}s de voz de {resumen['segundos_audio']:.1f}s de audio"
+    )
+    
+    # WARNING: Sin voz detectada (silencio o música en espera)
+    if not resultados:
+        logger.warning(f"⚠ WARNING: No se detectó voz en el audio ({resumen['segundos_audio']:.2f}s)")
+        return None, _detalle()
+    
+    return _resumir_resultados(resultados)
+
+
+def _es_silencio(pcm):
+    """
+    True si el audio no tiene voz suficiente para pedir transcripción
+    (llamadas abandonadas, buzones vacíos). Sin NumPy no se descarta nada.
+    """
+    if not SILENCE_CONFIG.get('enabled', True):
+        return False
+    
+    es_silencio, detalle = evaluar_silencio(
+        pcm,
+        sample_rate=SAMPLE_RATE,
+        frame_ms=VAD_CONFIG.get('frame_ms', 30),
+        threshold_ratio=VAD_CONFIG.get('threshold_ratio', 3.0),
+        min_rms=VAD_CONFIG.get('min_rms', 150),
+        min_speech_ratio=SILENCE_CONFIG.get('min_speech_ratio', 0.02),
+        min_speech_seconds=SILENCE_CONFIG.get('min_speech_seconds', 1.0)
+    )
+    if detalle is not None:
+        logger.debug(
+            f"Pre-chequeo de voz: RMS={detalle['rms']} | "
+            f"voz={detalle['speech_seconds']}s ({detalle['speech_ratio']:.1%})"
+        )
+    return es_silencio
+
+
+def _canales_por_hablante(canales):
+    """
+    Canales a transcribir por separado, o None si no hay un hablante por canal
+    
+    Args:
+        canales: PCM de 16 bits de cada canal (bytes)
+    """
+    if len(canales) != 2:
+        return None
+    
+    # Estéreo "falso" (el mismo audio en ambos canales): no hay hablantes que separar
+    if canales[0] == canales[1]:
+        logger.debug("Canales estéreo idénticos: se transcribe en mono")
+        return None
+    
+    return [memoryview(canal) for canal in canales]
+
+
+def _decodificar(archivo_original):
+    """
+    Decodifica el audio completo a PCM de 16 bits a SAMPLE_RATE
+    
+    Los WAV PCM se leen y remuestrean en proceso; el resto de formatos (o
+    un WAV que no se pueda leer así) pasan por pydub/ffmpeg. El tiempo de
+    cada vía se registra como conversion_wav o conversion_ffmpeg.
+    
+    Returns:
+        tuple: (pcm mono o del primer canal: memoryview,
+                canales por hablante: list o None si se mezcló a mono)
+    """
+    separar = STEREO_CONFIG.get('enabled', True)
+    
+    if WAV_FAST_PATH_CONFIG.get('enabled', True):
+        inicio = time.perf_counter()
+        canales = decodificar_wav(archivo_original, SAMPLE_RATE, separar_canales=separar)
+        if canales is not None:
+            metrics.registrar('conversion_wav', time.perf_counter() - inicio)
+            por_hablante = _canales_por_hablante(canales)
+            return memoryview(canales[0]), por_hablante
+    
+    with metrics.medir('conversion_ffmpeg'):
+        sound = AudioSegment.from_file(archivo_original)
+        sound = sound.set_frame_rate(SAMPLE_RATE).set_sample_width(SAMPLE_WIDTH)
+        if separar and sound.channels == 2:
+            por_hablante = _canales_por_hablante([canal.raw_data for canal in sound.split_to_mono()])
+            if por_hablante is not None:
+                return por_hablante[0], por_hablante
+        return memoryview(sound.set_channels(1).raw_data), None
+
+
+def _etiquetas_canales():
+    """Hablante de cada canal según asr.stereo_split.agent_channel"""
+    if STEREO_CONFIG.get('agent_channel', 0) == 0:
+        return ("Agente", "Cliente")
+    return ("Cliente", "Agente")
+
+
+def _unir_turnos(segmentos, resultados, etiquetas):
+    """
+    Turnos de conversación a partir de los segmentos reconocidos de cada canal
+    
+    Los segmentos consecutivos del mismo hablante forman un único turno.
+    
+    Args:
+        segmentos: [(canal, inicio, fin)] en muestras, en orden cronológico
+        resultados: [(estado, texto)] en el mismo orden
+        etiquetas: Hablante de cada canal
+    
+    Returns:
+        list: [{'type', 'message', 'start', 'end'}] con tiempos en segundos
+    """
+    turnos = []
+    for (canal, inicio, fin), (estado, texto) in zip(segmentos, resultados):
+        if estado != 'ok':
+            continue
+        
+        hablante = etiquetas[canal]
+        if turnos and turnos[-1]['type'] == hablante:
+            turnos[-1]['message'] += " " + texto
+            turnos[-1]['end'] = max(turnos[-1]['end'], round(int(fin) / SAMPLE_RATE, 2))
+            continue
+        
+        turnos.append({
+            'type': hablante,
+            'message': texto,
+            'start': round(int(inicio) / SAMPLE_RATE, 2),
+            'end': round(int(fin) / SAMPLE_RATE, 2)
+        })
+    return turnos
+
+
+def _transcribir_por_canal(canales, duration_sec):
+    """
+    Transcribe cada canal por separado y fusiona los turnos por tiempo
+    
+    Cada canal pasa por su propio pre-chequeo de silencio y segmentación
+    por voz; los segmentos de ambos se ordenan por su inicio antes del ASR,
+    así que los resultados ya llegan en orden cronológico.
+    
+    Returns:
+        tuple: (texto con una línea "Hablante: mensaje" por turno o None,
+                detalle de fragmentos con 'turns': [{'type', 'message', 'start', 'end'}])
+    """
+    etiquetas = _etiquetas_canales()
+    segmentos = []
+    for canal, pcm in enumerate(canales):
+        # WARNING: Canal sin voz (el otro extremo solo escucha o no contestó)
+        if _es_silencio(pcm):
+            logger.debug(f"Canal {canal} ({etiquetas[canal]}) sin voz - se omite")
+            continue
+        segmentos.extend((canal, inicio, fin) for inicio, fin in _segmentar(pcm))
+    
+    # WARNING: Sin voz en ningún canal (situación esperable - abandonos, buzones)
+    if not segmentos:
+        logger.warning(f"⚠ WARNING: No se detectó voz en ningún canal ({duration_sec:.2f}s)")
+        return None, _detalle()
+    
+    segmentos.sort(key=lambda segmento: segmento[1])
+    
+    num_segments = len(segmentos)
+    segundos_voz = sum(fin - inicio for _, inicio, fin in segmentos) / SAMPLE_RATE
+    logger.info(
+        f"Estéreo por canales: {num_segments} fragmento(s) - "
+        f"{segundos_voz:.1f}s de voz de {duration_sec:.1f}s de audio..."
+    )
+    
+    fragmentos = (
+        sr.AudioData(canales[canal][inicio * SAMPLE_WIDTH:fin * SAMPLE_WIDTH], SAMPLE_RATE, SAMPLE_WIDTH)
+        for canal, inicio, fin in segmentos
+    )
+    resultados = _reconocer_en_orden(fragmentos, num_segments)
+    
+    transcripcion, detalle = _resumir_resultados(resultados)
+    if transcripcion is None:
+        return None, detalle
+    
+    turnos = _unir_turnos(segmentos, resultados, etiquetas)
+    detalle['turns'] = turnos
+    logger.info(f"✓ Separación por canales: {len(turnos)} turno(s) Agente/Cliente")
+    
+    return "\n".join(f"{turno['type']}: {turno['message']}" for turno in turnos), detalle
 
 
 def transcribir_audio(archivo_original):
     """
     Transcribe un archivo de audio a texto
     
+    Returns:
+        str: Texto transcrito o None si no se pudo transcribir
+    """
+    transcripcion, _ = transcribir_audio_con_detalle(archivo_original)
+    return transcripcion
+
+
+def transcribir_audio_con_detalle(archivo_original):
+    """
+    Transcribe un archivo de audio a texto devolviendo el detalle de fragmentos
+    
+    La cabecera descarta antes de decodificar los archivos dañados o
+    demasiado cortos (asr.probe). Los WAV PCM se decodifican en proceso (sin
+    ffmpeg) y el audio convertido se mantiene en memoria como PCM; cada
+    fragmento llega al reconocedor como una vista del mismo buffer, sin
+    archivos temporales. Los fragmentos se cortan en las pausas de voz (sin
+    enviar silencios al ASR), se reconocen en paralelo
+    (asr.max_concurrent_fragments) y el texto se reensambla en su orden
+    original. Las grabaciones que superan
+    asr.streaming.threshold_seconds se decodifican en streaming con ffmpeg.
+    Las grabaciones estéreo (asr.stereo_split) se transcriben canal a canal
+    y el texto sale ya separado en turnos Agente/Cliente.
+    
     Args:
         archivo_original: Ruta del archivo de audio original
     
     Returns:
-        str: Texto transcrito o None si no se pudo transcribir
+        tuple: (texto: str o None si no se pudo transcribir,
+                detalle: dict con fragments, ok, empty y errors; en estéreo
+                por canales, además 'turns' con los turnos ordenados por tiempo)
     
     Raises:
         Exception: Si hay un error CRÍTICO que impide el procesamiento
     """
-    # Crear nombres únicos para archivos temporales
-    timestamp = str(int(time.time() * 1000))
-    temp_dir = tempfile.gettempdir()
-    
-    archivo_convertido = os.path.join(temp_dir, f"temp_pcm_{timestamp}.wav")
-    
     try:
         logger.info("Convirtiendo el audio...")
         
@@ -40,109 +672,79 @@ def transcribir_audio(archivo_original):
         file_size = os.path.getsize(archivo_original)
         if file_size == 0:
             logger.warning(f"⚠ WARNING: Archivo vacío (0 bytes): {archivo_original}")
-            return None
+            return None, _detalle()
         
         logger.debug(f"Tamaño del archivo: {file_size} bytes")
         
+        info = probar_audio(archivo_original)
+        if info is None:
+            # Eliminado o movido tras la comprobación anterior
+            logger.error(f"✗ ERROR CRÍTICO: Archivo no existe: {archivo_original}")
+            raise FileNotFoundError(f"Archivo no existe: {archivo_original}")
+        logger.debug(f"Audio: {describir(info)}")
+        
+        # WARNING: Cabecera dañada o audio muy corto (se descarta sin decodificar)
+        if PROBE_CONFIG.get('enabled', True):
+            motivo = motivo_rechazo(info, PROBE_CONFIG.get('min_duration_seconds', 1.0))
+            if motivo:
+                logger.warning(f"⚠ WARNING: Audio descartado sin decodificar - {motivo}: {archivo_original}")
+                return None, _detalle()
+        
+        if _usar_streaming(info):
+            if ffmpeg_disponible():
+                return _transcribir_en_streaming(archivo_original)
+            logger.warning("⚠ ffmpeg no disponible: el audio largo se decodifica completo en memoria")
+        
         # ERROR CRÍTICO: Fallo al convertir audio
         try:
-            sound = AudioSegment.from_file(archivo_original)
-            sound = sound.set_frame_rate(16000).set_channels(1)
-            sound.export(archivo_convertido, format="wav")
+            with metrics.medir('conversion'):
+                pcm, canales = _decodificar(archivo_original)
         except Exception as e:
             logger.error(f"✗ ERROR CRÍTICO: No se pudo convertir el audio: {e}")
             raise  # Propagar el error - es crítico
-
-        recognizer = sr.Recognizer()
-        audio = AudioSegment.from_wav(archivo_convertido)
         
         # WARNING: Audio muy corto (situación esperable)
-        duration_ms = len(audio)
-        duration_sec = duration_ms / 1000
+        duration_sec = len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH)
         logger.debug(f"Duración del audio: {duration_sec:.2f} segundos")
         
         if duration_sec < 1:
             logger.warning(f"⚠ WARNING: Audio muy corto (< 1 segundo) - {duration_sec:.2f}s")
-            return None
-        
-        segment_duration = 60 * 1000  # 60 segundos
-        num_segments = ceil(len(audio) / segment_duration)
+            return None, _detalle()
         
-        logger.info(f"Procesando {num_segments} fragmento(s)...")
-
-        transcripcion = ""
-        fragmentos_exitosos = 0
-        fragmentos_vacios = 0
-        fragmentos_con_errores = 0
+        # Agente y cliente en canales separados: sin mezcla a mono
+        if canales is not None:
+            return _transcribir_por_canal(canales, duration_sec)
         
-        for i in range(num_segments):
-            inicio = i * segment_duration
-            fin = min((i + 1) * segment_duration, len(audio))
-            fragmento = audio[inicio:fin]
-            
-            # Nombre único para cada fragmento
-            fragment_path = os.path.join(temp_dir, f"temp_fragment_{timestamp}_{i}.wav")
-            
-            try:
-                fragmento.export(fragment_path, format="wav")
-
-                with sr.AudioFile(fragment_path) as source:
-                    recognizer.adjust_for_ambient_noise(source, duration=0.3)
-                    audio_data = recognizer.record(source)
-
-                try:
-                    texto = recognizer.recognize_google(audio_data, language="es-ES")
-                    if texto and texto.strip():
-                        transcripcion += texto + " "
-                        fragmentos_exitosos += 1
-                        logger.debug(f"Fragmento {i+1}/{num_segments}: ✓ OK ({len(texto)} chars)")
-                    else:
-                        fragmentos_vacios += 1
-                        logger.debug(f"Fragmento {i+1}/{num_segments}: Texto vacío")
-                        
-                except sr.UnknownValueError:
-                    # WARNING: Audio ininteligible (situación esperable)
-                    fragmentos_vacios += 1
-                    logger.debug(f"Fragmento {i+1}/{num_segments}: Audio ininteligible")
-                    
-                except sr.RequestError as e:
-                    # ERROR NO CRÍTICO: Error de conexión, pero se puede continuar
-                    fragmentos_con_errores += 1
-                    logger.warning(f"⚠ WARNING: Error de conexión en fragmento {i+1}: {e}")
-                    continue
-                    
-            except Exception as e:
-                # ERROR NO CRÍTICO: Error en fragmento individual, pero se puede continuar
-                fragmentos_con_errores += 1
-                logger.warning(f"⚠ WARNING: Error procesando fragmento {i+1}: {e}")
-                
-            finally:
-                # Limpiar fragmento temporal
-                try:
-                    if os.path.exists(fragment_path):
-                        os.remove(fragment_path)
-                except Exception as e:
-                    logger.debug(f"No se pudo eliminar {fragment_path}: {e}")
-
-        # Evaluar resultado
-        transcripcion = transcripcion.strip()
-        
-        # WARNING: No se obtuvo transcripción (situación esperable - audio sin voz válida)
-        if not transcripcion:
+        # WARNING: Audio sin voz (situación esperable - abandonos, buzones)
+        if _es_silencio(pcm):
             logger.warning(
-                f"⚠ WARNING: No se obtuvo transcripción válida - "
-                f"Exitosos: {fragmentos_exitosos}/{num_segments} | "
-                f"Vacíos/Ininteligibles: {fragmentos_vacios} | "
-                f"Errores: {fragmentos_con_errores}"
+                f"⚠ WARNING: Audio sin voz detectado en pre-chequeo ({duration_sec:.2f}s) - "
+                f"se omite el ASR"
             )
-            return None
+            return None, _detalle()
         
+        segmentos = _segmentar(pcm)
+        
+        # WARNING: Sin voz detectada (silencio o música en espera)
+        if not segmentos:
+            logger.warning(f"⚠ WARNING: No se detectó voz en el audio ({duration_sec:.2f}s)")
+            return None, _detalle()
+        
+        num_segments = len(segmentos)
+        segundos_voz = sum(fin - inicio for inicio, fin in segmentos) / SAMPLE_RATE
         logger.info(
-            f"✓ Transcripción completada: {len(transcripcion)} caracteres, "
-            f"{fragmentos_exitosos}/{num_segments} fragmentos exitosos"
+            f"Procesando {num_segments} fragmento(s) - "
+            f"{segundos_voz:.1f}s de voz de {duration_sec:.1f}s de audio..."
         )
         
-        return transcripcion
+        # Vistas sobre el buffer PCM: los fragmentos no se copian ni pasan por disco
+        fragmentos = (
+            sr.AudioData(pcm[inicio * SAMPLE_WIDTH:fin * SAMPLE_WIDTH], SAMPLE_RATE, SAMPLE_WIDTH)
+            for inicio, fin in segmentos
+        )
+        resultados = _reconocer_en_orden(fragmentos, num_segments)
+        
+        return _resumir_resultados(resultados)
         
     except FileNotFoundError:
         # ERROR CRÍTICO: Propagar hacia arriba
@@ -151,12 +753,4 @@ def transcribir_audio(archivo_original):
     except Exception as e:
         # ERROR CRÍTICO: Excepción inesperada
         logger.error(f"✗ ERROR CRÍTICO en transcripción: {e}", exc_info=True)
-        raise
-        
-    finally:
-        # Limpiar archivo convertido
-        try:
-            if os.path.exists(archivo_convertido):
-                os.remove(archivo_convertido)
-        except Exception as e:
-            logger.debug(f"No se pudo eliminar {archivo_convertido}: {e}")
\ No newline at end of file
+        raise
\ No newline at end of file
@@ -0,0 +1,240 @@
+"""
+Caché local de transcripciones por contenido del audio
+Reintentos, re-encolados manuales y filas duplicadas que apuntan a la misma
+grabación reutilizan la transcripción ya obtenida en lugar de volver a pagar
+el ASR. La clave es un hash del contenido del archivo más una huella de la
+configuración ASR que cambia el resultado; tamaño y mtime evitan re-hashear
+un archivo que no ha cambiado. Los resultados vacíos (audio sin voz) caducan,
+porque un falso silencio no debe servirse para siempre.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from log import get_logger
+
+logger = get_logger()
+
+# Lectura del archivo al calcular el hash
+_BLOQUE_HASH = 1024 * 1024
+# Ajustes de asr que cambian el texto o los turnos obtenidos
+_CLAVES_HUELLA = ('engine', 'language', 'max_segment_seconds', 'vad',
+                  'silence_prescreen', 'stereo_split', 'vosk')
+
+
+def hash_contenido(ruta):
+    """Hash BLAKE2b (128 bits) del contenido completo del archivo"""
+    h = hashlib.blake2b(digest_size=16)
+    with open(ruta, "rb") as f:
+        for bloque in iter(lambda: f.read(_BLOQUE_HASH), b""):
+            h.update(bloque)
+    return h.hexdigest()
+
+
+def huella_config(asr_config):
+    """
+    Hash corto de los ajustes de asr que afectan al resultado: cambiar el
+    idioma, el VAD o la separación estéreo invalida las entradas previas
+    """
+    relevantes = {clave: asr_config.get(clave) for clave in _CLAVES_HUELLA}
+    serializado = json.dumps(relevantes, sort_keys=True, default=str)
+    return hashlib.blake2b(serializado.encode('utf-8'), digest_size=6).hexdigest()
+
+
+class TranscriptionCache:
+    """Transcripciones por hash de contenido con desalojo LRU por tamaño"""
+    
+    def __init__(self, db_path, max_size_mb=200, huella="", empty_ttl_seconds=86400):
+        """
+        Args:
+            db_path: Ruta del archivo SQLite
+            max_size_mb: Tamaño máximo del texto almacenado; se desalojan
+                primero las entradas usadas hace más tiempo
+            huella: Huella de la configuración ASR (ver huella_config)
+            empty_ttl_seconds: Vigencia de las transcripciones vacías
+        """
+        self.db_path = db_path
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self.huella = huella
+        self.empty_ttl_seconds = empty_ttl_seconds
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'stored': 0, 'evicted': 0}
+        
+        directorio = os.path.dirname(db_path)
+        if directorio:
+            os.makedirs(directorio, exist_ok=True)
+        
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS transcripciones (
+                    hash TEXT PRIMARY KEY,
+                    texto TEXT NOT NULL,
+                    stats TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS archivos (
+                    ruta TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    hash TEXT NOT NULL
+                )
+                """
+            )
+    
+    def calcular_clave(self, ruta):
+        """
+        Hash de contenido del archivo, reutilizando el ya calculado si el
+        tamaño y el mtime no cambiaron
+        
+        Returns:
+            str: Hash hexadecimal
+        """
+        info = os.stat(ruta)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT hash FROM archivos WHERE ruta = ? AND size = ? AND mtime = ?",
+                (ruta, info.st_size, info.st_mtime)
+            ).fetchone()
+        if row:
+            return row[0]
+        
+        clave = hash_contenido(ruta)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO archivos VALUES (?, ?, ?, ?)",
+                (ruta, info.st_size, info.st_mtime, clave)
+            )
+        return clave
+    
+    def clave_transcripcion(self, motor, ruta):
+        """
+        Clave de la transcripción: motor, huella de configuración y contenido
+        
+        Returns:
+            str: Clave para buscar/guardar
+        """
+        return f"{motor}:{self.huella}:{self.calcular_clave(ruta)}"
+    
+    def buscar(self, clave):
+        """
+        Returns:
+            tuple: (texto: str, stats: dict) o None si no está en caché.
+                   Un texto vacío indica audio sin transcripción válida;
+                   pasado empty_ttl_seconds se descarta y cuenta como fallo.
+        """
+        ahora = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT texto, stats, created_at FROM transcripciones WHERE hash = ?",
+                (clave,)
+            ).fetchone()
+            if row is not None and not row[0] and ahora - row[2] > self.empty_ttl_seconds:
+                self._conn.execute("DELETE FROM transcripciones WHERE hash = ?", (clave,))
+                row = None
+            if row is None:
+                self.stats['misses'] += 1
+                return None
+            self._conn.execute(
+                "UPDATE transcripciones SET last_used_at = ? WHERE hash = ?",
+                (ahora, clave)
+            )
+            self.stats['hits'] += 1
+        return row[0], json.loads(row[1])
+    
+    def guardar(self, clave, texto, stats=None):
+        """
+        Guarda una transcripción y desaloja las menos usadas si se supera el tamaño
+        
+        Args:
+            clave: Clave de clave_transcripcion
+            texto: Transcripción ("" si el audio no tiene voz válida)
+            stats: Dict con el detalle de fragmentos
+        """
+        texto = texto or ""
+        ahora = time.time()
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO transcripciones VALUES (?, ?, ?, ?, ?, ?)",
+                    (clave, texto, json.dumps(stats or {}), len(texto.encode('utf-8')), ahora, ahora)
+                )
+                self.stats['stored'] += 1
+                self._desalojar()
+        except Exception as e:
+            # Un fallo de caché no debe detener la transcripción
+            logger.warning(f"⚠ No se pudo guardar la transcripción en caché: {e}")
+    
+    def _desalojar(self):
+        """Elimina entradas LRU hasta quedar bajo max_bytes (requiere _lock)"""
+        total = self._conn.execute(
+            "SELECT COALESCE(SUM(size_bytes), 0) FROM transcripciones"
+        ).fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        
+        desalojadas = 0
+        filas = self._conn.execute(
+            "SELECT hash, size_bytes FROM transcripciones ORDER BY last_used_at"
+        ).fetchall()
+        for clave, size_bytes in filas:
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM transcripciones WHERE hash = ?", (clave,))
+            total -= size_bytes
+            desalojadas += 1
+        
+        self._conn.execute(
+            "DELETE FROM archivos WHERE hash NOT IN (SELECT hash FROM transcripciones)"
+        )
+        self.stats['evicted'] += desalojadas
+        logger.debug(f"TranscriptionCache - {desalojadas} entradas desalojadas (LRU)")
+    
+    def get_stats(self):
+        """
+        Returns:
+            dict: hits, misses, hit_rate, stored, evicted, entries, size_bytes
+        """
+        with self._lock:
+            entries, size_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM transcripciones"
+            ).fetchone()
+            stats = self.stats.copy()
+        consultas = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / consultas, 3) if consultas else 0.0
+        stats['entries'] = entries
+        stats['size_bytes'] = size_bytes
+        return stats
+
+
+# Instancia global
+_transcription_cache = None
+
+
+def get_transcription_cache():
+    """Obtiene la instancia de la caché (None si está deshabilitada)"""
+    global _transcription_cache
+    if _transcription_cache is None:
+        from connection_settings import BASE_DIR, ASR_CONFIG
+        cache_cfg = ASR_CONFIG.get('cache', {})
+        if not cache_cfg.get('enabled', True):
+            return None
+        db_path = cache_cfg.get('db_path', os.path.join('state', 'transcription_cache.db'))
+        if not os.path.isabs(db_path):
+            db_path = os.path.join(BASE_DIR, db_path)
+        _transcription_cache = TranscriptionCache(
+            db_path=db_path,
+            max_size_mb=cache_cfg.get('max_size_mb', 200),
+            huella=huella_config(ASR_CONFIG),
+            empty_ttl_seconds=cache_cfg.get('empty_ttl_seconds', 86400)
+        )
+    return _transcription_cache